@@ -2,9 +2,26 @@ import json
 import sys
 # sys.path.append('.')
 from call_llm import call_llm
+from conversation_log import ConversationLogger
+from structured_output import (
+    ANALYSIS_SIMULATION_SCHEMA,
+    ANALYSIS_VERDICT_SCHEMA,
+    format_instructions,
+    format_stats,
+    parse_reply,
+    response_format,
+)
+from trajectory_compressor import compress_for_prompt
+from analysis_memo import trajectory_fingerprint
+from episode_cache import hash_interface_source
 from tqdm import tqdm
 import os
+import threading
+import concurrent.futures
 TEMPLATE = os.getenv("TEMPLATE", "vanilla")
+# 同时分析的失败轨迹数；ANALYSIS_COLLECT_ALL=1 时不在第一个结果处停止，而是收集所有不同的分析结果
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", 4))
+ANALYSIS_COLLECT_ALL = os.getenv("ANALYSIS_COLLECT_ALL", "0") == "1"
 
 if TEMPLATE == "vanilla":
     import analysis_agent_prompt_vanilla as analysis_agent_prompt_vanilla
@@ -16,24 +33,17 @@ else:
 import re
 
 def process_llm_response(response: str, simulator: EnvSimulator, cur_env_rule):
-    # Extract contents of various tags
-    action_pattern = r"<action>(.*?)</action>"
-    environment_logic_pattern = r"<environment_logic_and_misalignments>(.*?)</environment_logic_and_misalignments>"
-
-    # Search for matches
-    action_match = re.search(action_pattern, response, flags=re.DOTALL)
-    environment_logic_match = re.search(environment_logic_pattern, response, flags=re.DOTALL)
-    
-    # Store found content (if any) – you could log or display these as desired
-    environment_logic = environment_logic_match.group(1).strip() if environment_logic_match else ""
+    # 标签格式与 JSON（结构化输出）都由 schema 驱动的 parse_reply 解析
+    fields, _ = parse_reply(response, ANALYSIS_SIMULATION_SCHEMA)
+    environment_logic = fields["environment_logic_and_misalignments"]
 
     # If a <conclusion> tag is present, we consider the process finished
     if environment_logic:
         return True, True, (environment_logic, )
 
     # If we have an <action> tag, parse it to decide which simulator method to invoke
-    if action_match:
-        action_content = action_match.group(1).strip()
+    if fields["action"]:
+        action_content = fields["action"]
 
         if action_content.startswith("init_simulator(task_id="):
             task_id_match = re.search(r'init_simulator\(task_id\s*=\s*"([^"]+)"\)', action_content)
@@ -83,6 +93,15 @@ def process_llm_response(response: str, simulator: EnvSimulator, cur_env_rule):
             success, env_log = simulator.get_next_agent_action()
             return False, success, env_log
 
+        elif action_content.startswith("explore("):
+            explore_match = re.search(r'explore\(actions\s*=\s*\[(.*)\]\s*\)', action_content, flags=re.DOTALL)
+            if explore_match:
+                explore_actions = re.findall(r'"([^"]+)"', explore_match.group(1))
+                success, env_log = simulator.explore(explore_actions)
+                return False, success, env_log
+            else:
+                return False, False, "[Error]: Invalid Action Format for explore. Expected format: explore(actions=[\"xxx\", \"yyy\"])"
+
         else:
             # Unrecognized action format
             return False, False, f"[Error]: Unrecognized action format: {action_content}"
@@ -93,7 +112,7 @@ class AnalysisAgent:
     def __init__(self):
         pass
     
-    def analyze_logging(self, cur_env_rule, env_logging, model, agent_logger, environment_logics):
+    def analyze_logging(self, cur_env_rule, env_logging, model, agent_logger, environment_logics, num_workers=ANALYSIS_CONCURRENCY, collect_all=ANALYSIS_COLLECT_ALL, memo=None):
         """
         cur_env_rule: str = def WrapStep...
         env_logging: [
@@ -102,79 +121,133 @@ class AnalysisAgent:
                 "logging": str
             }
         ]
+        Failed trajectories are analyzed `num_workers` at a time, each with its own EnvSimulator. The first confirmed
+        misalignment wins and the other analyses are cancelled; with `collect_all` every distinct result is returned.
+        memo: optional AnalysisMemo; trajectories already judged under the same interface reuse the stored verdict.
+        """
+        failed_logs = [env_log for env_log in env_logging if env_log["score"] != 1]
+        if not failed_logs:
+            return ""
+
+        cancel_event = threading.Event()
+        results = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_workers))
+        futures = [
+            executor.submit(self.analyze_one, cur_env_rule, env_log, model, agent_logger, environment_logics, cancel_event, memo)
+            for env_log in failed_logs
+        ]
+        try:
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+                result = future.result()
+                if not result or result in results:
+                    continue
+                results.append(result)
+                if not collect_all:
+                    break
+        finally:
+            # 还没开始的直接取消；已经在跑的分析在下一次 LLM 调用前退出，等它们结束后再保存 memo，
+            # 这样它们在退出前得出的结论（memo.put）也会写进文件
+            cancel_event.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            if memo is not None:
+                memo.save()
+                agent_logger.info(f"[AnalysisAgent] analysis memo hits: {memo.hits}")
+            agent_logger.info(f"[AnalysisAgent] {format_stats.report()}")
+
+        environment_logics = "\n\n".join(results)
+        if environment_logics:
+            agent_logger.info(f"[AnalysisAgent] analyses: {environment_logics}")
+        return environment_logics
+
+    def analyze_one(self, cur_env_rule, env_log, model, agent_logger, environment_logics, cancel_event=None, memo=None):
         """
-        for env_log in tqdm(env_logging):
-            if env_log["score"] == 1:
+        Analyzes one failed trajectory. Returns the environment logic and misalignments found, or None.
+        """
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        if memo is not None:
+            interface_hash = hash_interface_source(cur_env_rule)
+            fingerprint = trajectory_fingerprint(env_log)
+            entry = memo.get(interface_hash, fingerprint)
+            if entry is not None:
+                agent_logger.info(f"[AnalysisAgent] task {env_log.get('task_id')}: reusing verdict '{entry['verdict']}' from turn {entry.get('turn')} (task {entry.get('task_id')})")
+                return entry["result"] if entry["verdict"] == "Found Misalignment" else None
+
+        def remember(verdict, result=None):
+            if memo is not None:
+                memo.put(interface_hash, fingerprint, verdict, result, task_id=env_log.get("task_id"), turn=env_log.get("turn"))
+
+        conversation = ConversationLogger(agent_logger, "AnalysisAgent")
+        trajectory, step_map = compress_for_prompt(env_log["logging"], env_log["gold_action_obs_sequence"])
+        if env_log.get("cluster_size", 1) > 1:
+            trajectory = f"(This failure pattern occurred in {env_log['cluster_size']} failed trajectories in this turn, task ids: {', '.join(env_log['cluster_task_ids'])}. The log below is one representative.)\n" + trajectory
+        if step_map is not None:
+            num_steps = sum(len(numbers) for _, numbers in step_map)
+            agent_logger.info(f"[AnalysisAgent] task {env_log.get('task_id')}: trajectory compressed from {len(env_log['logging'])} to {len(trajectory)} chars ({num_steps} steps in {len(step_map)} entries)")
+        gen_done = False
+        for _ in range(10):
+            if cancelled():
+                return None
+            messages = [
+                {
+                    "role": "user",
+                    "content": analysis_agent_prompt_vanilla.get_analyze_logging_user_prompt(cur_env_rule, trajectory, environment_logics, "\n".join(env_log["gold_action_obs_sequence"])) + format_instructions(ANALYSIS_VERDICT_SCHEMA)
+                }
+            ]
+            conversation.log(messages)
+            response = call_llm(messages, model=model, temperature=0.1, response_format=response_format(ANALYSIS_VERDICT_SCHEMA))
+            messages.append({"role": "assistant", "content": response})
+            conversation.log(messages)
+            fields, error = parse_reply(response, ANALYSIS_VERDICT_SCHEMA)
+            if error is None and fields["analysis_result"] == "Found Misalignment" and not fields["environment_logic_and_misalignments"]:
+                error = "missing <environment_logic_and_misalignments>"
+            format_stats.record("AnalysisAgent", error)
+            if error:
+                agent_logger.info(f"[AnalysisAgent] response format error: {error}")
                 continue
+            analysis_result = fields["analysis_result"]
             
-            gen_done = False
-            for _ in range(10):
-                messages = [
-                    {
-                        "role": "user",
-                        "content": analysis_agent_prompt_vanilla.get_analyze_logging_user_prompt(cur_env_rule, env_log["logging"], environment_logics, "\n".join(env_log["gold_action_obs_sequence"]))
-                    }
-                ]
-                task_id = env_log["logging"].split("Task ID: ")[1].split(" ==========")[0].strip()
-                agent_logger.info(f"[AnalysisAgent] messages: {messages}")
-                response = call_llm(messages, model=model, temperature=0.1)
-                messages.append({"role": "assistant", "content": response})
-                agent_logger.info(f"[AnalysisAgent] response: {response}")
-                if "<analysis_result>" not in response or "</analysis_result>" not in response:
-                    agent_logger.info("[AnalysisAgent] response format error")
-                    continue
-                analysis_result = response.split("<analysis_result>")[1].split("</analysis_result>")[0].strip()
-                if analysis_result != "No Misalignment" and analysis_result != "Found Misalignment":
-                    agent_logger.info("[AnalysisAgent] analysis result error")
-                    continue
-                
-                if analysis_result == "Found Misalignment":
-                    if "<environment_logic_and_misalignments>" not in response or "</environment_logic_and_misalignments>" not in response:
-                        agent_logger.info("[AnalysisAgent] response format error")
-                        continue
-                
-                gen_done = True
+            gen_done = True
+            break
+        if not gen_done:
+            agent_logger.info("[AnalysisAgent] generation failed")
+            return None
+
+        if analysis_result == "No Misalignment":
+            remember("No Misalignment")
+            return None
+
+        messages.append({"role": "user", "content": analysis_agent_prompt_vanilla.get_simulate_env_user_prompt() + format_instructions(ANALYSIS_SIMULATION_SCHEMA)})
+        conversation.log(messages)
+        simulator = EnvSimulator()
+        MAX_SIMULATE_STEP = 30
+        simulate_step = 0
+        while True:
+            if cancelled():
+                return None
+            response = call_llm(messages, model=model, temperature=0.1, response_format=response_format(ANALYSIS_SIMULATION_SCHEMA))
+            simulate_step += 1
+            messages.append({"role": "assistant", "content": response})
+            conversation.log(messages)
+            if "No Misalignment" in response:
+                remember("No Misalignment")
+                return None
+            finished, p1, p2 = process_llm_response(response, simulator, cur_env_rule)
+            format_stats.record("AnalysisAgent", isinstance(p2, str) and p2.startswith("[Error]: Unrecognized response format"))
+            if finished:
                 break
-            if not gen_done:
-                agent_logger.info("[AnalysisAgent] generation failed")
-                continue
-
-            if analysis_result == "No Misalignment":
-                continue
-            else:
-                messages.append({"role": "user", "content": analysis_agent_prompt_vanilla.get_simulate_env_user_prompt()})
-                agent_logger.info(f"[AnalysisAgent] add user message: {messages[-1]['content']}")
-                simulator = EnvSimulator()
-                MAX_SIMULATE_STEP = 30
-                simulate_step = 0
-                STOP = False
-                while True:
-                    response = call_llm(messages, model=model, temperature=0.1)
-                    simulate_step += 1
-                    messages.append({"role": "assistant", "content": response})
-                    agent_logger.info(f"[AnalysisAgent] response: {response}")
-                    if "No Misalignment" in response:
-                        STOP = True
-                        break
-                    finished, p1, p2 = process_llm_response(response, simulator, cur_env_rule)
-                    if finished:
-                        break
-                    messages.append({"role": "user", "content": p2})
-                    agent_logger.info(f"[AnalysisAgent] add user message: {p2}")
-                    if simulate_step > MAX_SIMULATE_STEP:
-                        agent_logger.info("[AnalysisAgent] simulation step exceed limit")
-                        STOP = True
-                        break
-                    if simulate_step == MAX_SIMULATE_STEP:
-                        messages[-1]["content"] += """Now you must give your conclusion, provide it in this format:
+            messages.append({"role": "user", "content": p2})
+            conversation.log(messages)
+            if simulate_step > MAX_SIMULATE_STEP:
+                agent_logger.info("[AnalysisAgent] simulation step exceed limit")
+                return None
+            if simulate_step == MAX_SIMULATE_STEP:
+                messages[-1]["content"] += """Now you must give your conclusion, provide it in this format:
 
 <thought> Your reasoning here </thought>
 <environment_logic_and_misalignments> the new environment rules and misalignments identified by you, which have not been fixed by current `WrapStep` function. </environment_logic_and_misalignments>"""
-                        agent_logger.info(f"[AnalysisAgent] add user message: {messages[-1]['content']}")
-                if STOP:
-                    continue
+                conversation.log(messages)
 
-                environment_logics = p2[0].strip()
-                agent_logger.info(f"[AnalysisAgent] analyses: {environment_logics}")
-                return environment_logics
-        return ""
+        remember("Found Misalignment", p2[0].strip())
+        return p2[0].strip()
@@ -200,6 +200,10 @@ Here are the operations you can use:
    - Retrieves the next action that the real Agent would perform under the current simulation conditions.
    - Note: The Agent’s choice of the next action is based on the current environment state, including the outcomes of any previous `step()` or `get_next_agent_action()` call, along with the latest observations.
 
+6. explore(actions: list[str])
+   - Executes each candidate agent action with the `WrapStep` function, every one starting from the current simulator state, and returns all outcomes together.
+   - The current simulator state is not changed. Use it to compare several hypotheses in one operation, e.g. explore(actions=["open drawer 1", "go to drawer 1"]).
+
 If you believe you have reached a conclusion from your experiments, provide it in this format:
 
 <thought> Your reasoning here </thought>
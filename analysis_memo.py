@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from trajectory_compressor import parse_steps, MAX_LOOP_PERIOD
+
+# 跨 turn 的分析结论缓存：同一个 interface 下，归一化后相同的失败轨迹直接复用上次的结论，不再问 LLM
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+def _collapse_loops(pairs):
+    # 循环只保留一遍，卡在同一个循环里 8 次和 12 次的轨迹算作同一条
+    collapsed = []
+    for pair in pairs:
+        collapsed.append(pair)
+        for period in range(1, MAX_LOOP_PERIOD + 1):
+            if len(collapsed) >= 2 * period and collapsed[-period:] == collapsed[-2 * period:-period]:
+                del collapsed[-period:]
+                break
+    return collapsed
+
+def trajectory_fingerprint(env_log):
+    """
+    Hash of the task description plus the (action, observation) sequence with whitespace/case normalized and
+    repeated loops collapsed. WrapStep debug logs are left out; the interface hash in the memo key covers them.
+    """
+    header, steps = parse_steps(env_log["logging"])
+    task_lines = [_normalize(line.split("INFO - Task: ", 1)[-1]) for line in header if line.strip() and "Task ID:" not in line]
+    pairs = _collapse_loops([(_normalize(step["action"]), _normalize(step["observation"])) for step in steps])
+    payload = json.dumps([task_lines, pairs], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AnalysisMemo:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _key(interface_hash, fingerprint):
+        return f"{interface_hash}:{fingerprint}"
+
+    def get(self, interface_hash, fingerprint):
+        """
+        Returns {"verdict": "No Misalignment" | "Found Misalignment", "result": str | None, ...} or None.
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(interface_hash, fingerprint))
+            if entry is not None:
+                self.hits += 1
+            return entry
+
+    # put / get / save 都在同一把锁里，分析线程可以并发调用；save 写出的是加锁时刻的完整快照
+    def put(self, interface_hash, fingerprint, verdict, result=None, task_id=None, turn=None):
+        with self._lock:
+            self.entries[self._key(interface_hash, fingerprint)] = {"verdict": verdict, "result": result, "task_id": task_id, "turn": turn}
+
+    def save(self):
+        with self._lock:
+            # 临时文件带 pid，多个进程同时保存同一个 memo 时不会写到同一个临时文件上
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
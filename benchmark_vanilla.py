@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("ALFWORLD_DATA", "alfworld/data")
+
+# 不依赖 LLM 的热点路径微基准：结果存成 JSON baseline，compare 子命令标出超过阈值的回退
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+def time_repeats(func, repeat):
+    """
+    Runs `func` `repeat` times and returns per-run wall times in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def summarize_timings(timings, ops_per_run=1):
+    median = statistics.median(timings)
+    return {
+        "median_s": median,
+        "min_s": min(timings),
+        "runs": len(timings),
+        "ops_per_run": ops_per_run,
+        "ops_per_s": ops_per_run / median if median > 0 else None,
+    }
+
+def load_golden_trajectories(max_tasks):
+    """
+    Returns [(task_id, game_file, [expert actions])] for golden-store tasks with a valid expert sequence.
+    """
+    with open("alfworld/golden_action_obs.json", "r", encoding="utf-8") as f:
+        golden_action_obs = json.load(f)
+    with open("alfworld/file_names_train.json", "r") as f:
+        file_names = json.load(f)
+    trajectories = []
+    for task_id, sequence in golden_action_obs.items():
+        actions = [line[len("Agent Action: "):] for line in sequence if line.startswith("Agent Action: ")]
+        if not actions:
+            continue
+        task_type_idx, task_idx = (int(x) for x in task_id.split("-"))
+        trajectories.append((task_id, file_names[task_type_idx][task_idx], actions))
+        if len(trajectories) >= max_tasks:
+            break
+    return trajectories
+
+def make_env(game_file):
+    import task_catalog
+    from experiment_vanilla import SingleAlfredTWEnv
+    env = SingleAlfredTWEnv(task_catalog.get_alfworld_config(), game_file, "train")
+    env = env.init_env(batch_size=1)
+    obs, info = env.reset()
+    return env, obs
+
+@benchmark("env_create_reset")
+def bench_env_create_reset(repeat, max_tasks):
+    trajectories = load_golden_trajectories(max_tasks)
+    return summarize_timings(
+        time_repeats(lambda: [make_env(game_file) for _, game_file, _ in trajectories], repeat),
+        ops_per_run=len(trajectories),
+    )
+
+@benchmark("env_step")
+def bench_env_step(repeat, max_tasks):
+    trajectories = load_golden_trajectories(max_tasks)
+    timings = []
+    num_steps = sum(len(actions) for _, _, actions in trajectories)
+    for _ in range(repeat):
+        envs = [(make_env(game_file)[0], actions) for _, game_file, actions in trajectories]
+        start = time.perf_counter()
+        for env, actions in envs:
+            for action in actions:
+                env.step([action])
+        timings.append(time.perf_counter() - start)
+    return summarize_timings(timings, ops_per_run=num_steps)
+
+@benchmark("wrapstep_overhead")
+def bench_wrapstep_overhead(repeat, max_tasks):
+    import logging
+    from interface_vanilla import WrapStep
+    trajectories = load_golden_trajectories(max_tasks)
+    num_steps = sum(len(actions) for _, _, actions in trajectories)
+    logger = logging.Logger("benchmark_wrapstep")
+    logger.addHandler(logging.NullHandler())
+    timings = []
+    for _ in range(repeat):
+        episodes = []
+        for _, game_file, actions in trajectories:
+            env, obs = make_env(game_file)
+            obs = '\n'.join(obs[0].split('\n\n')[1:])
+            episodes.append((env, obs.split('\n')[0].strip(), obs.split('\n')[1].strip(), actions))
+        start = time.perf_counter()
+        for env, init_obs, task, actions in episodes:
+            for action in actions:
+                WrapStep(env, init_obs, task, action, logger)
+        timings.append(time.perf_counter() - start)
+    return summarize_timings(timings, ops_per_run=num_steps)
+
+def make_synthetic_turn(num_tasks, steps_per_task, seed=0):
+    """
+    Synthetic exp_logger.log content shaped like a real turn: header, task, then action / observation /
+    reward / done / WrapStep debug dump / separator per step, with "Nothing happens." loops mixed in.
+    """
+    rng = random.Random(seed)
+    lines, gold_action_obs = [], {}
+    for n in range(num_tasks):
+        task_id = f"{n % 6}-{n}"
+        gold_action_obs[task_id] = [f"Task: synthetic task {n}", "Agent Action: go to shelf 1"]
+        lines.append(f"INFO - ========== Task ID: {task_id} ==========\n")
+        lines.append(f"INFO - Task: You are in the middle of a room. Looking quickly around you, you see a cabinet {n}, a shelf 1.\n")
+        lines.append("Your task is to: put a mug in shelf.\n")
+        for step in range(steps_per_task):
+            stuck = rng.random() < 0.3
+            lines.append(f"INFO - Agent Action: {'open drawer 3' if stuck else f'go to cabinet {step}'}\n")
+            lines.append(f"INFO - Observation: {'Nothing happens.' if stuck else f'You arrive at cabinet {step}. The cabinet {step} is closed.'}\n")
+            lines.append("INFO - Reward: False\n")
+            lines.append("INFO - Done: False\n")
+            lines.append("INFO - Log contents when executing `WrapStep`: DEBUG - Parsed action: {'matched': True}\n")
+            lines.append("DEBUG - Current observation after 'look': You are facing the cabinet.\n\n")
+            lines.append("INFO - ---------------------------------\n")
+        lines.append("\n")
+    return lines, gold_action_obs
+
+@benchmark("log_parsing")
+def bench_log_parsing(repeat, max_tasks):
+    from turn_logging import parse_exp_logging
+    lines, gold_action_obs = make_synthetic_turn(num_tasks=600, steps_per_task=60)
+    return summarize_timings(time_repeats(lambda: parse_exp_logging(lines, gold_action_obs), repeat), ops_per_run=len(lines))
+
+@benchmark("validate_WrapStep_code")
+def bench_validate_wrapstep(repeat, max_tasks):
+    import interface_cache
+    from env_simulator_vanilla import validate_WrapStep_code
+    with open("alfworld/interface_vanilla.py", "r") as f:
+        source = f.read()
+
+    def validate():
+        # 清掉编译缓存，测的是完整的 parse / compile / exec，而不是缓存命中
+        interface_cache.clear()
+        validate_WrapStep_code(source)
+    return summarize_timings(time_repeats(validate, repeat))
+
+@benchmark("prompt_building")
+def bench_prompt_building(repeat, max_tasks):
+    import analysis_agent_prompt_vanilla
+    import optimization_agent_prompt_vanilla
+    with open("alfworld/interface_vanilla.py", "r") as f:
+        source = f.read()
+    lines, _ = make_synthetic_turn(num_tasks=1, steps_per_task=100)
+    logs = "".join(lines)
+    environment_logics = "\n".join(f"### Analysis Result {i}\nAnalysis Task ID: 0-{i}" for i in range(50))
+    gold = "\n".join(f"Agent Action: go to cabinet {i}" for i in range(40))
+
+    def build():
+        analysis_agent_prompt_vanilla.get_analyze_logging_user_prompt(source, logs, environment_logics, gold)
+        optimization_agent_prompt_vanilla.get_optimize_user_prompt(source, environment_logics, environment_logics)
+    return summarize_timings(time_repeats(build, repeat * 20), ops_per_run=2)
+
+def run_benchmarks(names, repeat, max_tasks):
+    results = {}
+    for name in names:
+        print(f"[benchmark] {name} ...")
+        try:
+            results[name] = BENCHMARKS[name](repeat, max_tasks)
+        except ImportError as e:
+            # 例如没有安装 alfworld / textworld 的机器上跳过环境相关的基准
+            print(f"[benchmark] {name} skipped: {e}")
+            results[name] = {"skipped": str(e)}
+            continue
+        print(f"[benchmark] {name}: median {results[name]['median_s']:.6f}s, {results[name]['ops_per_s']} ops/s")
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "max_tasks": max_tasks,
+        "results": results,
+    }
+
+def compare(baseline, current, threshold):
+    """
+    Returns [(name, baseline_median, current_median, ratio, regressed)] for benchmarks present in both runs.
+    """
+    rows = []
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if not cur or "median_s" not in base or "median_s" not in cur:
+            continue
+        ratio = cur["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        rows.append((name, base["median_s"], cur["median_s"], ratio, ratio > 1 + threshold))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the rollout hot paths (no LLM calls)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and store the results as JSON")
+    run_parser.add_argument("--output", type=str, default="alfworld/benchmarks/latest.json")
+    run_parser.add_argument("--only", type=str, nargs="*", choices=sorted(BENCHMARKS), help="Subset of benchmarks to run")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--max_tasks", type=int, default=8, help="Golden trajectories used by the env benchmarks")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown, e.g. 0.1 = 10%%")
+
+    argparse_args = parser.parse_args()
+
+    if argparse_args.command == "run":
+        report = run_benchmarks(argparse_args.only or list(BENCHMARKS), argparse_args.repeat, argparse_args.max_tasks)
+        os.makedirs(os.path.dirname(argparse_args.output) or ".", exist_ok=True)
+        with open(argparse_args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved benchmark results to {argparse_args.output}")
+    else:
+        with open(argparse_args.baseline, "r") as f:
+            baseline = json.load(f)
+        with open(argparse_args.current, "r") as f:
+            current = json.load(f)
+        rows = compare(baseline, current, argparse_args.threshold)
+        for name, base, cur, ratio, regressed in rows:
+            flag = "REGRESSION" if regressed else "ok"
+            print(f"{name:28s} {base:12.6f}s -> {cur:12.6f}s  x{ratio:.2f}  {flag}")
+        sys.exit(1 if any(row[4] for row in rows) else 0)
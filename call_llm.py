@@ -49,12 +49,14 @@ def call_llm(
     stream: bool = False,
     max_retries: int = 6,
     llm_port_idx: Optional[int] = None,  # 为保持签名，不使用
+    response_format: Optional[dict] = None,
 ) -> Union[str, Dict[str, Union[str, List[str]]]]:
     """
     与原项目签名保持最大兼容。
     - 返回：默认返回完整字符串；若 stream=True，返回增量拼接后的字符串。
     - 支持：stop、seed、top_p、temperature、max_tokens
     - 低显存建议：适当降低 max_tokens；必要时把 DEFAULT_NUM_CTX 设为 4096（已默认）
+    - response_format：{"type": "json_schema", ...}，Ollama 据此做约束解码（见 structured_output.py）
     """
     model_name = _resolve_model(model)
     last_err = None
@@ -82,6 +84,8 @@ def call_llm(
     }
     if stop is not None:
         payload["stop"] = stop
+    if response_format is not None:
+        payload["response_format"] = response_format
 
     for attempt in range(1, max_retries + 1):
         try:
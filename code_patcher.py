@@ -0,0 +1,164 @@
+import ast
+import re
+import textwrap
+
+# 优化 agent 的增量修改：模型只输出改动（统一 diff，或只给出要替换的函数定义），在当前接口源码上打补丁，
+# 打完用 ast 检查语法以及 InferRules / WrapStep 是否还在，不再每次重新解码整份 400 多行的文件
+REQUIRED_FUNCTIONS = ("InferRules", "WrapStep")
+
+class PatchError(ValueError):
+    pass
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+def is_unified_diff(patch):
+    return any(_HUNK_HEADER.match(line) for line in patch.split("\n"))
+
+def _parse_hunks(diff):
+    """
+    [(hint_line, old_lines, new_lines)] for each hunk; file headers (---/+++) are skipped.
+    """
+    hunks = []
+    for line in diff.split("\n"):
+        header = _HUNK_HEADER.match(line)
+        if header:
+            hunks.append((int(header.group(1)) - 1, [], []))
+            continue
+        if not hunks or line.startswith("--- ") or line.startswith("+++ ") or line.startswith("\\ No newline"):
+            continue
+        _, old_lines, new_lines = hunks[-1]
+        if line.startswith("-"):
+            old_lines.append(line[1:])
+        elif line.startswith("+"):
+            new_lines.append(line[1:])
+        else:
+            # 上下文行；模型常把空的上下文行输出成完全空行（少了开头的空格）
+            old_lines.append(line[1:] if line.startswith(" ") else line)
+            new_lines.append(line[1:] if line.startswith(" ") else line)
+    # 去掉 diff 末尾多出来的空上下文行
+    for _, old_lines, new_lines in hunks:
+        while old_lines and new_lines and old_lines[-1] == new_lines[-1] == "":
+            old_lines.pop()
+            new_lines.pop()
+    return hunks
+
+def _find_block(lines, block, start, hint):
+    """
+    Index where `block` occurs in `lines[start:]`, closest to `hint`; trailing whitespace is ignored if there is
+    no exact match. None if the block does not occur.
+    """
+    for normalize in (lambda line: line, lambda line: line.rstrip()):
+        target = [normalize(line) for line in block]
+        matches = [i for i in range(start, len(lines) - len(block) + 1)
+                   if [normalize(line) for line in lines[i:i + len(block)]] == target]
+        if matches:
+            return min(matches, key=lambda i: abs(i - hint))
+    return None
+
+def apply_unified_diff(source, diff):
+    lines = source.split("\n")
+    hunks = _parse_hunks(diff)
+    if not hunks:
+        raise PatchError("no hunks found in the diff")
+    position, offset = 0, 0
+    for k, (hint, old_lines, new_lines) in enumerate(hunks, start=1):
+        if not old_lines:
+            # 纯插入且没有上下文：按行号插入
+            index = min(max(hint + offset, position), len(lines))
+        else:
+            index = _find_block(lines, old_lines, position, hint + offset)
+            if index is None:
+                raise PatchError(f"hunk {k} does not match the current code (first line: {old_lines[0]!r})")
+        lines[index:index + len(old_lines)] = new_lines
+        offset += len(new_lines) - len(old_lines)
+        position = index + len(new_lines)
+    return "\n".join(lines)
+
+def _function_defs(tree):
+    """
+    name -> [node] for every function definition, top-level ones first.
+    """
+    defs = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            defs.setdefault(node.name, []).append(node)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node not in tree.body:
+            defs.setdefault(node.name, []).append(node)
+    return defs
+
+def _node_span(node):
+    # 装饰器算在函数定义里
+    first = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+    return first - 1, node.end_lineno
+
+def replace_functions(source, replacement):
+    """
+    Every function defined at the top level of `replacement` replaces the function of the same name in `source`
+    (a top-level one, or else a unique nested one, re-indented to fit); unknown functions are appended. Imports in
+    `replacement` that `source` lacks are added at the top.
+    """
+    try:
+        patch_tree = ast.parse(textwrap.dedent(replacement))
+    except SyntaxError as e:
+        raise PatchError(f"the replacement code does not parse: {e}")
+    replacement_lines = textwrap.dedent(replacement).split("\n")
+    source_tree = ast.parse(source)
+    source_defs = _function_defs(source_tree)
+    lines = source.split("\n")
+
+    edits, appended, imports = [], [], []
+    for node in patch_tree.body:
+        start, end = _node_span(node)
+        snippet = replacement_lines[start:end]
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if not any(line.strip() == ast.get_source_segment(textwrap.dedent(replacement), node) for line in lines):
+                imports.extend(snippet)
+            continue
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            raise PatchError(f"only function definitions and imports are allowed in function-level replacements (line {node.lineno})")
+        targets = source_defs.get(node.name, [])
+        if not targets:
+            appended.extend([""] + snippet)
+            continue
+        target = targets[0]
+        if target not in source_tree.body and len(targets) > 1:
+            raise PatchError(f"function `{node.name}` is defined {len(targets)} times in the current code; replace the enclosing function instead")
+        target_start, target_end = _node_span(target)
+        indent = " " * target.col_offset
+        edits.append((target_start, target_end, [indent + line if line.strip() else line for line in snippet]))
+
+    # 从后往前替换，前面的行号不受影响
+    edits.sort(key=lambda edit: edit[0], reverse=True)
+    for k in range(1, len(edits)):
+        if edits[k][1] > edits[k - 1][0]:
+            raise PatchError("replaced functions overlap (a function and a function nested in it were both given)")
+    for start, end, new_lines in edits:
+        lines[start:end] = new_lines
+    lines = imports + lines + appended
+    return "\n".join(lines)
+
+def check_interface(source):
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise PatchError(f"the patched code does not parse: {e}")
+    defined = {node.name for node in tree.body if isinstance(node, ast.FunctionDef)}
+    missing = [name for name in REQUIRED_FUNCTIONS if name not in defined]
+    if missing:
+        raise PatchError(f"the patched code no longer defines {', '.join(missing)}")
+
+def apply_patch(source, patch):
+    """
+    Applies a unified diff or function-level replacements to `source`. Returns (new_source, error); new_source is
+    None and error describes the problem when the patch cannot be applied or the result is not a valid interface.
+    """
+    try:
+        if is_unified_diff(patch):
+            new_source = apply_unified_diff(source, patch)
+        else:
+            new_source = replace_functions(source, patch)
+        check_interface(new_source)
+    except PatchError as e:
+        return None, str(e)
+    return new_source.strip(), None
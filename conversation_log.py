@@ -0,0 +1,85 @@
+import argparse
+import itertools
+import json
+import os
+
+from log_writer import read_log_lines
+
+# agent 对话的增量日志：每次只记录相对上一次新增（或被改写）的消息，带会话 id 与序号，
+# 避免每一步都把整段不断增长的对话重新写一遍；用本文件的命令行工具可以还原任意时刻的完整对话
+CONV_MARKER = "[CONV] "
+
+_conversation_counter = itertools.count()
+
+class ConversationLogger:
+    def __init__(self, agent_logger, agent_name):
+        self.agent_logger = agent_logger
+        self.agent_name = agent_name
+        self.conv_id = f"{agent_name}-{os.getpid()}-{next(_conversation_counter)}"
+        self.seq = 0
+        self._logged = []
+
+    def log(self, messages):
+        """
+        Logs the change from the previously logged state of this conversation to `messages`:
+        the length of the unchanged prefix (`keep`) plus the messages after it (`append`).
+        Handles appends, pops, rebuilt message lists and in-place edits of earlier messages.
+        """
+        current = [(m["role"], m["content"]) for m in messages]
+        keep = 0
+        for old, new in zip(self._logged, current):
+            if old != new:
+                break
+            keep += 1
+        if keep == len(self._logged) == len(current):
+            return
+        record = {
+            "conv": self.conv_id,
+            "seq": self.seq,
+            "keep": keep,
+            "append": [{"role": role, "content": content} for role, content in current[keep:]],
+        }
+        self.agent_logger.info(f"[{self.agent_name}] {CONV_MARKER}{json.dumps(record, ensure_ascii=False)}")
+        self.seq += 1
+        self._logged = current
+
+def read_conversation_records(log_path):
+    # 包括写日志进程轮转出来的 .N.gz 分段，按写入顺序读
+    for line in read_log_lines(log_path):
+        if CONV_MARKER in line:
+            yield json.loads(line.split(CONV_MARKER, 1)[1])
+
+def reconstruct(log_path, conv_id, seq=None):
+    """
+    Returns the full message list of `conv_id` after record `seq` (default: the last record).
+    """
+    messages = None
+    for record in read_conversation_records(log_path):
+        if record["conv"] != conv_id:
+            continue
+        messages = (messages or [])[:record["keep"]] + record["append"]
+        if seq is not None and record["seq"] >= seq:
+            break
+    return messages
+
+def list_conversations(log_path):
+    conversations = {}
+    for record in read_conversation_records(log_path):
+        conversations[record["conv"]] = record["seq"]
+    return conversations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruct agent conversations from a delta-encoded agent_logger.log")
+    parser.add_argument("log_path", type=str)
+    parser.add_argument("--conv", type=str, help="Conversation id; omit to list all conversations")
+    parser.add_argument("--seq", type=int, help="Reconstruct the state after this sequence number (default: last)")
+    argparse_args = parser.parse_args()
+
+    if argparse_args.conv is None:
+        for conv_id, last_seq in list_conversations(argparse_args.log_path).items():
+            print(f"{conv_id}\t{last_seq + 1} records")
+    else:
+        messages = reconstruct(argparse_args.log_path, argparse_args.conv, argparse_args.seq)
+        if messages is None:
+            raise SystemExit(f"Conversation {argparse_args.conv} not found in {argparse_args.log_path}")
+        print(json.dumps(messages, ensure_ascii=False, indent=2))
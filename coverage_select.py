@@ -0,0 +1,228 @@
+import ast
+import functools
+import hashlib
+import json
+import linecache
+import os
+import shutil
+import sys
+
+from episode_cache import hash_interface_source
+from log_writer import log_segments
+
+# 覆盖率引导的回归选择：rollout / 回放时记录每个任务执行到了接口代码的哪些分支，新版本只重新验证 / 重新 rollout
+# 覆盖到改动分支的任务。分支键与行号无关（由函数名、条件表达式等组成），新旧两个版本的同一分支键相同；
+# 每个分支的 hash 只包含它自己的语句（嵌套分支只留占位），所以改动一个分支不会让所有外层分支都算作改动。
+# COVERAGE_FULL_RUN=1 时仍记录覆盖率，但不做选择，全部重跑
+COVERAGE_SELECTION = os.getenv("COVERAGE_SELECTION", "0") == "1"
+COVERAGE_FULL_RUN = os.getenv("COVERAGE_FULL_RUN", "0") == "1"
+
+MODULE_KEY = "<module>"
+
+def _text(node):
+    return ast.unparse(node) if node is not None else ""
+
+class _BranchMapper:
+    def __init__(self):
+        self.parts = {}      # 分支键 -> 参与 hash 的内容
+        self.line_keys = {}  # 行号 -> 分支键
+
+    def new_region(self, key, parts=()):
+        # 同一个父分支下出现两个相同的条件时加序号区分
+        unique, n = key, 1
+        while unique in self.parts:
+            n += 1
+            unique = f"{key} #{n}"
+        self.parts[unique] = list(parts)
+        return unique
+
+    def assign_lines(self, key, node):
+        if node is None:
+            return
+        for line in range(node.lineno, (node.end_lineno or node.lineno) + 1):
+            self.line_keys[line] = key
+
+    def block(self, key, stmts):
+        for stmt in stmts:
+            self.statement(key, stmt)
+
+    def statement(self, key, stmt):
+        parts = self.parts[key]
+        if isinstance(stmt, ast.If):
+            # if / elif 链：每个条件单独成一个分支，hash 包含它前面所有条件（在前面插一个 elif 会改变谁能走到这里）
+            parts.append("if-chain")
+            tests = []
+            node, first = stmt, stmt
+            while True:
+                tests.append(ast.dump(node.test))
+                test_key = self.new_region(f"{key} > if {_text(node.test)}", tests)
+                self.assign_lines(test_key, node.test)
+                self.block(self.new_region(f"{test_key} > then"), node.body)
+                if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+                    node = node.orelse[0]
+                    continue
+                if node.orelse:
+                    self.block(self.new_region(f"{key} > if {_text(first.test)} > else", tests), node.orelse)
+                break
+        elif isinstance(stmt, (ast.For, ast.AsyncFor)):
+            parts.append(f"for {ast.dump(stmt.target)} in {ast.dump(stmt.iter)}")
+            self.assign_lines(key, stmt.iter)
+            body_key = self.new_region(f"{key} > for {_text(stmt.target)} in {_text(stmt.iter)}")
+            self.block(body_key, stmt.body)
+            if stmt.orelse:
+                self.block(self.new_region(f"{body_key} > else"), stmt.orelse)
+        elif isinstance(stmt, ast.While):
+            parts.append(f"while {ast.dump(stmt.test)}")
+            self.assign_lines(key, stmt.test)
+            body_key = self.new_region(f"{key} > while {_text(stmt.test)}")
+            self.block(body_key, stmt.body)
+            if stmt.orelse:
+                self.block(self.new_region(f"{body_key} > else"), stmt.orelse)
+        elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+            parts.append(f"with {[ast.dump(item) for item in stmt.items]}")
+            for item in stmt.items:
+                self.assign_lines(key, item.context_expr)
+            self.block(self.new_region(f"{key} > with {', '.join(_text(item.context_expr) for item in stmt.items)}"), stmt.body)
+        elif isinstance(stmt, ast.Try):
+            parts.append("try")
+            try_key = self.new_region(f"{key} > try")
+            self.block(try_key, stmt.body)
+            for handler in stmt.handlers:
+                handler_key = self.new_region(f"{try_key} > except {_text(handler.type)}", [ast.dump(handler.type) if handler.type else "", handler.name or ""])
+                self.line_keys[handler.lineno] = handler_key
+                self.block(handler_key, handler.body)
+            if stmt.orelse:
+                self.block(self.new_region(f"{try_key} > else"), stmt.orelse)
+            if stmt.finalbody:
+                self.block(self.new_region(f"{try_key} > finally"), stmt.finalbody)
+        elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # def 语句本身在外层执行；函数体是一个独立的分支
+            parts.append(f"def {stmt.name} {ast.dump(stmt.args)} {[ast.dump(d) for d in stmt.decorator_list]}")
+            for line in range(min([stmt.lineno] + [d.lineno for d in stmt.decorator_list]), stmt.body[0].lineno):
+                self.line_keys.setdefault(line, key)
+            self.block(self.new_region(f"{key} > def {stmt.name}"), stmt.body)
+        else:
+            parts.append(ast.dump(stmt))
+            self.assign_lines(key, stmt)
+
+@functools.lru_cache(maxsize=32)
+def branch_map(source):
+    """
+    ({branch key: hash of the branch's own statements}, {line number: branch key}) for an interface source.
+    """
+    mapper = _BranchMapper()
+    mapper.block(mapper.new_region(MODULE_KEY), ast.parse(source).body)
+    hashes = {key: hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16] for key, parts in mapper.parts.items()}
+    return hashes, mapper.line_keys
+
+def branches_for_lines(source, lines):
+    _, line_keys = branch_map(source)
+    return sorted({line_keys[line] for line in lines if line in line_keys})
+
+def changed_branches(old_source, new_source):
+    """
+    Branch keys of `old_source` whose own statements differ (or that are gone) in `new_source`.
+    None means "everything": module-level code changed (it runs at load time, outside any recorded
+    coverage) or one of the versions does not parse.
+    """
+    try:
+        old_hashes, _ = branch_map(old_source)
+        new_hashes, _ = branch_map(new_source)
+    except SyntaxError:
+        return None
+    if old_hashes.get(MODULE_KEY) != new_hashes.get(MODULE_KEY):
+        return None
+    return {key for key, branch_hash in old_hashes.items() if new_hashes.get(key) != branch_hash}
+
+def affects(coverage, changed):
+    """
+    Whether a task with recorded `coverage` (branch keys, None if unknown) may behave differently after the change.
+    """
+    return changed is None or coverage is None or bool(changed.intersection(coverage))
+
+class CoverageRecorder:
+    """
+    Line coverage of one loaded interface (its code objects share the `<interface-...>` filename from
+    interface_cache), collected with sys.settrace in the current thread. Disabled unless COVERAGE_SELECTION.
+    """
+    def __init__(self, function, enabled=None):
+        self.enabled = COVERAGE_SELECTION if enabled is None else enabled
+        self.filename = function.__code__.co_filename
+        self.interface_hash = getattr(function, "__interface_hash__", None)
+        self.lines = set()
+        self._previous = []
+
+    def _trace_call(self, frame, event, arg):
+        if frame.f_code.co_filename == self.filename:
+            return self._trace_line
+        return None
+
+    def _trace_line(self, frame, event, arg):
+        if event == "line":
+            self.lines.add(frame.f_lineno)
+        return self._trace_line
+
+    def __enter__(self):
+        if self.enabled:
+            self._previous.append(sys.gettrace())
+            sys.settrace(self._trace_call)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            sys.settrace(self._previous.pop())
+        return False
+
+    def branches(self):
+        source = "".join(linecache.getlines(self.filename))
+        if not source:
+            return None
+        try:
+            return branches_for_lines(source, self.lines)
+        except SyntaxError:
+            return None
+
+    def result(self):
+        """
+        {"interface_hash", "branches"} to store with a task result, or None when recording is disabled.
+        """
+        if not self.enabled:
+            return None
+        return {"interface_hash": self.interface_hash, "branches": self.branches()}
+
+def reuse_unaffected_results(previous_dir, previous_source, source, turn_dir, task_indices, split="train"):
+    """
+    Copies the result JSON and task log of every sampled task whose coverage under `previous_source` (recorded in
+    `previous_dir`) does not reach a branch changed in `source` into `turn_dir`; run_single_task then skips those
+    tasks and their logs are merged into the turn as usual. Returns the reused task ids.
+    """
+    changed = changed_branches(previous_source, source)
+    if changed is None:
+        return []
+    previous_hash = hash_interface_source(previous_source)
+    reused = []
+    for task_type_idx, task_idxs in task_indices.items():
+        for task_idx in task_idxs:
+            name = f"task_{split}_{task_type_idx}_{task_idx}"
+            result_path = f"{previous_dir}/{name}.json"
+            if not os.path.exists(result_path) or not log_segments(f"{previous_dir}/{name}.log"):
+                continue
+            with open(result_path, "r") as f:
+                result = json.load(f)
+            coverage = result.get("coverage")
+            if not result.get("success") or not coverage or coverage["interface_hash"] != previous_hash:
+                continue
+            if affects(coverage["branches"], changed):
+                continue
+            if os.path.exists(f"{turn_dir}/{name}.json"):
+                continue
+            # 连同轮转出来的 .N.gz 分段一起拷贝
+            for segment in log_segments(f"{previous_dir}/{name}.log"):
+                shutil.copyfile(segment, f"{turn_dir}/{os.path.basename(segment)}")
+            # 没走到改动的分支，覆盖情况在新版本下不变；记到新版本名下，下一轮还能继续复用
+            result["coverage"]["interface_hash"] = hash_interface_source(source)
+            result["reused_from"] = previous_dir
+            with open(f"{turn_dir}/{name}.json", "w") as f:
+                json.dump(result, f, indent=2)
+            reused.append(f"{task_type_idx}-{task_idx}")
+    return reused
@@ -0,0 +1,135 @@
+import copy
+import time
+from contextlib import contextmanager
+
+# WrapStep 里隐藏的 env.step 开销：interface_vanilla 每个动作前都先 step(['look'])、step(['inventory'])，
+# 一个 agent 动作就是三次 TextWorld step，生成的接口可能更多。MeteredEnv 按 agent 动作、按动词统计这些调用的
+# 次数与耗时。与 agent 动作原文相同的那次 step 算作动作本身，其余都算隐藏开销；不在 agent 动作内的 step
+# （simulator 直接执行的原始动作、checkpoint 回放）不计
+
+def _verb(action):
+    words = action.strip().split()
+    return words[0].lower() if words else ""
+
+class StepMeter:
+    def __init__(self):
+        self.agent_actions = 0
+        self.own_steps = 0
+        self.own_seconds = 0.0
+        self.hidden = {}  # 动词 -> [次数, 秒]
+        self._action = None
+        self._matched = False
+
+    @contextmanager
+    def action(self, agent_action):
+        """
+        Attributes the env.step calls made inside the block to `agent_action`.
+        """
+        self.agent_actions += 1
+        self._action, self._matched = agent_action.strip().lower(), False
+        try:
+            yield
+        finally:
+            self._action = None
+
+    def record(self, action, seconds):
+        if self._action is None:
+            return
+        if not self._matched and action.strip().lower() == self._action:
+            self._matched = True
+            self.own_steps += 1
+            self.own_seconds += seconds
+            return
+        entry = self.hidden.setdefault(_verb(action), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def summary(self):
+        return summarize(self.agent_actions, self.own_steps, self.own_seconds, self.hidden)
+
+def summarize(agent_actions, own_steps, own_seconds, hidden):
+    hidden_steps = sum(count for count, _ in hidden.values())
+    hidden_seconds = sum(seconds for _, seconds in hidden.values())
+    return {
+        "agent_actions": agent_actions,
+        "env_steps": own_steps + hidden_steps,
+        "hidden_steps": hidden_steps,
+        "hidden_steps_per_action": hidden_steps / agent_actions if agent_actions else 0.0,
+        "env_seconds": round(own_seconds + hidden_seconds, 4),
+        "hidden_seconds": round(hidden_seconds, 4),
+        "own_steps": own_steps,
+        "own_seconds": round(own_seconds, 4),
+        "hidden_by_verb": {verb: {"count": count, "seconds": round(seconds, 4)} for verb, (count, seconds) in sorted(hidden.items(), key=lambda item: -item[1][0])},
+    }
+
+def merge_summaries(summaries):
+    """
+    One summary over several tasks' StepMeter summaries (None entries, e.g. from older results, are skipped).
+    """
+    agent_actions, own_steps, own_seconds, hidden = 0, 0, 0.0, {}
+    for summary in summaries:
+        if not summary:
+            continue
+        agent_actions += summary["agent_actions"]
+        own_steps += summary["own_steps"]
+        own_seconds += summary["own_seconds"]
+        for verb, entry in summary["hidden_by_verb"].items():
+            total = hidden.setdefault(verb, [0, 0.0])
+            total[0] += entry["count"]
+            total[1] += entry["seconds"]
+    return summarize(agent_actions, own_steps, own_seconds, hidden)
+
+def format_overhead(summary, max_verbs=5):
+    if not summary["agent_actions"]:
+        return "Hidden env.step overhead: no agent actions recorded."
+    per_action = summary["env_steps"] / summary["agent_actions"]
+    text = (f"Hidden env.step overhead: {summary['hidden_steps']} hidden of {summary['env_steps']} env.steps over "
+            f"{summary['agent_actions']} agent actions ({per_action:.2f} env.steps / action), "
+            f"{summary['hidden_seconds']:.1f}s of {summary['env_seconds']:.1f}s env time.")
+    verbs = list(summary["hidden_by_verb"].items())
+    if verbs:
+        text += " By verb: " + ", ".join(f"{verb} {entry['count']} ({entry['count'] / summary['agent_actions']:.2f}/action, {entry['seconds']:.1f}s)" for verb, entry in verbs[:max_verbs])
+    return text
+
+class EnvProxy:
+    """
+    Base of the env wrappers (MeteredEnv, ProfiledEnv): everything except `step` passes through to the wrapped env,
+    while attributes that `WrapStep` stores on the env (e.g. `_current_location`) live on the proxy. The attributes
+    named in `_shared` (the recorder) are not copied by deepcopy.
+    """
+    _shared = ()
+
+    def __init__(self, env):
+        self._env = env
+
+    def __deepcopy__(self, memo):
+        # 快照拷贝环境以及 WrapStep 挂在代理上的属性，记录器仍然共用同一个
+        cls = type(self)
+        copied = cls.__new__(cls)
+        memo[id(self)] = copied
+        for name, value in self.__dict__.items():
+            copied.__dict__[name] = value if name in self._shared else copy.deepcopy(value, memo)
+        return copied
+
+    def __getattr__(self, name):
+        # 拷贝 / 反序列化时 __init__ 还没运行，不能再转发到不存在的 _env 上
+        if name == "_env" or name in self._shared:
+            raise AttributeError(name)
+        return getattr(self._env, name)
+
+class MeteredEnv(EnvProxy):
+    """
+    Proxy around an env that reports every `env.step` call to a StepMeter.
+    """
+    _shared = ("_meter",)
+
+    def __init__(self, env, meter):
+        super().__init__(env)
+        self._meter = meter
+
+    def step(self, actions):
+        start = time.perf_counter()
+        try:
+            return self._env.step(actions)
+        finally:
+            self._meter.record(actions[0] if actions else "", time.perf_counter() - start)
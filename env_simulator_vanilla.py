@@ -1,9 +1,22 @@
 from experiment_vanilla import SingleAlfredTWEnv
-import yaml
+import task_catalog
+from interface_cache import load_interface
+from sandbox import call_interface, InterfaceViolation, limit_memory, run_watched, can_fork, INTERFACE_CALL_TIMEOUT
 import json
 import os
+import copy
+import multiprocessing
 AGENTIC_SYSTEM_DEFAULT_MODEL = os.getenv("AGENTIC_SYSTEM_DEFAULT_MODEL", "qwen2.5:7b-instruct")
+# 在检查点上保存游戏状态快照，cancel / reset 恢复最近的快照再重放其后的少数几步，不再重建环境并重放全部历史
+SIMULATOR_SNAPSHOTS = os.getenv("SIMULATOR_SNAPSHOTS", "1") != "0"
+SIMULATOR_SNAPSHOT_STACK_SIZE = int(os.getenv("SIMULATOR_SNAPSHOT_STACK_SIZE", 32))
+# 只在每隔这么多步的检查点上拷贝环境（deepcopy 不便宜）；cancel 到两个检查点之间时从前一个检查点重放
+SIMULATOR_SNAPSHOT_INTERVAL = int(os.getenv("SIMULATOR_SNAPSHOT_INTERVAL", 4))
+SIMULATOR_EXPLORE_WORKERS = int(os.getenv("SIMULATOR_EXPLORE_WORKERS", 4))
+SIMULATOR_RUN_TASKS_WORKERS = int(os.getenv("SIMULATOR_RUN_TASKS_WORKERS", 4))
 from call_llm import call_llm
+from profiler import get_profiler, ProfiledEnv
+from env_meter import StepMeter, MeteredEnv, format_overhead
 import logging
 import io
 
@@ -31,85 +44,111 @@ def check_task_id(task_id: str):
     # 如果都符合，则返回 True 以及解析出的数字
     return True, task_type_idx, task_idx
 
-import ast
 def validate_WrapStep_code(env_rule_code: str):
-    # 1. 尝试解析为 AST
-    try:
-        tree = ast.parse(env_rule_code)
-    except SyntaxError:
-        return False, None
-
-    # 2. 在 AST 中查找函数定义 WrapStep，并检查形参列表
-    WrapStep_def = None
-    for node in tree.body:
-        if isinstance(node, ast.FunctionDef) and node.name == 'WrapStep':
-            # 确认形参个数及命名
-            if (len(node.args.args) == 5 and
-                node.args.args[0].arg == 'env' and
-                node.args.args[1].arg == 'init_obs' and
-                node.args.args[2].arg == 'task' and
-                node.args.args[3].arg == 'agent_action' and
-                node.args.args[4].arg == 'logger'):
-                WrapStep_def = node
-                break
-
-    if not WrapStep_def:
-        return False, None
-
-    # 3. 若 AST 检查通过，则尝试执行代码并获取 WrapStep 函数对象
-    env_locals = {}
-    try:
-        code_obj = compile(env_rule_code, '<string>', 'exec')
-        exec(code_obj, env_locals)
-    except Exception:
-        # 如果执行过程中报错，比如引用了未安装的包等，也返回 False
-        return False, None
-
-    func = env_locals.get('WrapStep')
-    if not callable(func):
-        return False, None
-
-    return True, func
+    # 解析 / 编译 / 执行由 interface_cache 按源码 hash 只做一次
+    interface = load_interface(env_rule_code)
+    return interface.WrapStep is not None, interface.WrapStep
 
 def validate_InferRules_code(env_rule_code: str):
-    # 1. 尝试解析为 AST
+    interface = load_interface(env_rule_code)
+    return interface.InferRules is not None, interface.InferRules
+
+# None: 还没验证过；验证一次后整个进程沿用结果（deepcopy 出来的环境如果和原环境共享底层状态，就不能用快照）。
+# deepcopy 第一次失败也记为 False，之后不再尝试拷贝，直接重建 + 重放
+_snapshot_support = None
+
+def snapshot_env(env):
+    """
+    Deep copy of the env (TextWorld game state plus any attributes `WrapStep` stored on it), or None if it cannot be
+    copied; a failure turns checkpoint snapshots off for the rest of the process.
+    """
+    global _snapshot_support
     try:
-        tree = ast.parse(env_rule_code)
-    except SyntaxError:
-        return False, None
-
-    # 2. 在 AST 中查找函数定义 InferRules，并检查形参列表
-    InferRules_def = None
-    for node in tree.body:
-        if isinstance(node, ast.FunctionDef) and node.name == 'InferRules':
-            # 确认形参个数及命名
-            if (len(node.args.args) == 2 and
-                node.args.args[0].arg == 'init_obs' and
-                node.args.args[1].arg == 'task'):
-                InferRules_def = node
-                break
-
-    if not InferRules_def:
-        return False, None
-
-    # 3. 若 AST 检查通过，则尝试执行代码并获取 InferRules 函数对象
-    env_locals = {}
+        return copy.deepcopy(env)
+    except Exception as e:
+        print(f"[EnvSimulator] env cannot be copied ({type(e).__name__}: {e}); falling back to replay")
+        _snapshot_support = False
+        return None
+
+def build_env(task_type_idx, task_idx, meter=None):
+    """
+    Fresh env of a train task: (env, obs, info). With a StepMeter, every env.step is counted (MeteredEnv).
+    """
+    profiler = get_profiler()
+    with profiler.span("simulator.env_init", category="env"):
+        env = SingleAlfredTWEnv(task_catalog.get_alfworld_config(), task_catalog.get_game_file("train", task_type_idx, task_idx), "train")
+        env = env.init_env(batch_size=1)
+        obs, info = env.reset()
+    if profiler.enabled:
+        env = ProfiledEnv(env, profiler)
+    if meter is not None:
+        env = MeteredEnv(env, meter)
+    return env, obs, info
+
+# explore 的 worker 用 fork 启动，直接继承父进程里的 simulator，不需要把 env / WrapStep pickle 过去。
+# 在分析线程里（AnalysisAgent 并发分析时）不 fork，逐个在本进程里跑，见 sandbox.can_fork
+_explore_parent = None
+
+def _explore_worker_init(simulator):
+    global _explore_parent
+    _explore_parent = simulator
+
+def _explore_one(action, simulator=None):
+    forked = (simulator or _explore_parent).fork()
+    if forked.WrapStep is not None:
+        return forked.execute_agent_action(action)
+    return forked.step(action)
+
+def run_explore(simulator, actions):
+    """
+    Returns [(success, log)] for each action in `actions`, each run on a fork of `simulator`.
+    """
+    num_workers = min(len(actions), SIMULATOR_EXPLORE_WORKERS)
+    if num_workers <= 1 or not can_fork():
+        return [_explore_one(action, simulator) for action in actions]
+    # 先在本进程检查一次 env 能否拷贝，出错时直接报给调用方
+    simulator.fork()
+    # 每个候选动作只跑一次 WrapStep，超过单次调用上限的两倍（至少 60 秒）仍未返回就杀掉 worker
+    timeout = max(2 * INTERFACE_CALL_TIMEOUT, 60) if INTERFACE_CALL_TIMEOUT else 0
+    outcomes = [None] * len(actions)
+    watched = run_watched(_explore_one, {i: (action,) for i, action in enumerate(actions)}, num_workers, timeout=timeout,
+                          initializer=_explore_worker_init, initargs=(simulator,), mp_context=multiprocessing.get_context("fork"))
+    for i, outcome, error in watched:
+        outcomes[i] = outcome if error is None else (False, f"Error executing action: {type(error).__name__}: {error}")
+    return outcomes
+
+def _run_task_summary(task_id, env_rule_code):
+    simulator = EnvSimulator()
     try:
-        code_obj = compile(env_rule_code, '<string>', 'exec')
-        exec(code_obj, env_locals)
-    except Exception:
-        # 如果执行过程中报错，比如引用了未安装的包等，也返回 False
-        return False, None
-
-    func = env_locals.get('InferRules')
-    if not callable(func):
-        return False, None
-
-    return True, func
+        success, log = simulator.run_task(task_id, env_rule_code)
+    except Exception as e:
+        return {"task_id": task_id, "error": f"{type(e).__name__}: {e}"}
+    if not success:
+        return {"task_id": task_id, "error": log}
+    return simulator.run_summary
+
+def run_task_summaries(task_ids, env_rule_code):
+    """
+    Returns the `run_summary` of a full episode for each task id, run in a fork-started process pool.
+    """
+    return run_task_summaries_batch([(task_id, env_rule_code) for task_id in task_ids])
+
+def run_task_summaries_batch(jobs):
+    """
+    `run_task_summaries` for [(task_id, env_rule_code)] pairs, e.g. several candidate interfaces in one pool.
+    """
+    num_workers = min(len(jobs), SIMULATOR_RUN_TASKS_WORKERS)
+    if num_workers <= 1 or not can_fork():
+        return [_run_task_summary(task_id, env_rule_code) for task_id, env_rule_code in jobs]
+    summaries = [None] * len(jobs)
+    for i, summary, error in run_watched(_run_task_summary, dict(enumerate(jobs)), num_workers, initializer=limit_memory, mp_context=multiprocessing.get_context("fork")):
+        summaries[i] = summary if error is None else {"task_id": jobs[i][0], "error": f"{type(error).__name__}: {error}"}
+    return summaries
 
 class EnvSimulator:
     def __init__(self):
          self.WrapStep = None
+         self.snapshots = []
     
     def init(self, task_id: str, env_rule_code: str | None):
         eval_result, task_type_idx, task_idx = check_task_id(task_id)
@@ -119,43 +158,39 @@ class EnvSimulator:
         self.task_idx = task_idx
 
         if env_rule_code is not None:
-            eval_result, WrapStep_func = validate_WrapStep_code(env_rule_code)
-            if not eval_result:
-                return False, "Invalid env_rule_code: {env_rule_code}. Must contain a function named 'WrapStep' with parameters 'env', 'agent_action' and 'logger'. And the function should be executable."
-            
-            self.WrapStep = WrapStep_func
-            
-            eval_result, InferRules_func = validate_InferRules_code(env_rule_code)
-            if not eval_result:
-                return False, "Invalid env_rule_code: {env_rule_code}. Must contain a function named 'InferRules' with parameters 'init_obs' and 'task'. And the function should be executable."
-            self.InferRules = InferRules_func
-
-
+            interface = load_interface(env_rule_code)
+            diagnostics = " ".join(interface.diagnostics)
+            if interface.WrapStep is None:
+                return False, f"Invalid env_rule_code. Must contain a function named 'WrapStep' with parameters 'env', 'init_obs', 'task', 'agent_action' and 'logger'. And the function should be executable. {diagnostics}"
+            if interface.InferRules is None:
+                return False, f"Invalid env_rule_code. Must contain a function named 'InferRules' with parameters 'init_obs' and 'task'. And the function should be executable. {diagnostics}"
+            self.WrapStep = interface.WrapStep
+            self.InferRules = interface.InferRules
             self.env_rule_code = env_rule_code
         else:
             self.WrapStep = None
             self.InferRules = None
             self.env_rule_code = None
 
-        with open(f"alfworld/file_names_train.json", "r") as f:
-            FILE_NAMES = json.load(f)
-        with open("alfworld/alfworld/configs/base_config.yaml", "r") as f:
-            alfworld_config = yaml.safe_load(f)
-        
+        # WrapStep 内部隐藏的 env.step 统计，从 init 开始计
+        self.meter = StepMeter()
         try:
-            env = SingleAlfredTWEnv(alfworld_config, FILE_NAMES[self.task_type_idx][self.task_idx], "train")
+            self.env, self.obs, self.info = build_env(self.task_type_idx, self.task_idx, self.meter)
         except Exception as e:
             return False, f"Error initializing environment: {e}. The task_id may be invalid."
-        
-        self.env = env.init_env(batch_size=1)
-
-        self.obs, self.info = self.env.reset()
         self.obs = '\n'.join(self.obs[0].split('\n\n')[1:])
         self.task = self.obs.split('\n')[1].strip()
         self.init_obs = self.obs.split('\n')[0].strip()
+        # InferRules 只依赖初始观察和任务，init 时算一次，reset 时沿用
+        try:
+            self.rules = call_interface(self.InferRules, self.init_obs, self.task) if self.InferRules is not None else ""
+        except Exception as e:
+            return False, f"Error executing InferRules: {e}"
 
         self.action_history = []
         self.have_execute_agent_action = False
+        self.snapshots = []
+        self._push_snapshot(self.obs, 0, False)
 
         self.messages = [
             {
@@ -204,7 +239,7 @@ You will iterate this process—receiving the environment’s feedback, deciding
 
 # Environment Rule
 
-{self.InferRules(self.init_obs, self.task)}"""
+{self.rules}"""
             },
             {
                 "role": "user",
@@ -216,27 +251,162 @@ Begin by examining the environment or taking any initial steps you find relevant
             }
         ]
 
+        self._attach_log_stream()
+
+        log = f"Initializing environment...\n"
+        log += f"Observation: {self.obs}\n"
+        log += f"Action history: {self.action_history}"
+        return True, log
+
+    def _attach_log_stream(self):
+        # 每个 simulator（包括 fork 出来的）各自一个 logger，WrapStep 的日志互不串
         self.log_stream = io.StringIO()
         stream_handler = logging.StreamHandler(self.log_stream)
         stream_handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter("%(levelname)s - %(message)s")
         stream_handler.setFormatter(formatter)
-        self.simulator_logger = logging.getLogger("simulator_logger")
-        for handler in self.simulator_logger.handlers[:]:
-            self.simulator_logger.removeHandler(handler)
-        self.simulator_logger.setLevel(logging.DEBUG)
+        self.simulator_logger = logging.Logger("simulator_logger", logging.DEBUG)
         self.simulator_logger.addHandler(stream_handler)
         self.simulator_logger.propagate = False
 
-        log = f"Initializing environment...\n"
-        log += f"Observation: {self.obs}\n"
-        log += f"Action history: {self.action_history}"
+    def fork(self):
+        """
+        Independent copy of this simulator: env state (including what `WrapStep` stored on the env), action history,
+        messages and snapshots. Raises RuntimeError if the env cannot be copied.
+        """
+        env = snapshot_env(self.env)
+        if env is None:
+            raise RuntimeError("The environment of this simulator cannot be copied.")
+        forked = EnvSimulator()
+        for name, value in self.__dict__.items():
+            if name not in ("env", "log_stream", "simulator_logger"):
+                setattr(forked, name, value)
+        forked.env = env
+        forked.action_history = list(self.action_history)
+        forked.messages = copy.deepcopy(self.messages)
+        # 快照里的 env 只会被拷贝出来用，不会被原地修改，可以共享
+        forked.snapshots = list(self.snapshots)
+        forked._attach_log_stream()
+        return forked
+
+    def explore(self, actions):
+        """
+        Runs each candidate action on its own fork of the current state, in parallel worker processes, and returns
+        all outcomes in one log. Agent actions go through `WrapStep` when there is one, otherwise through `step`.
+        The state of this simulator is not changed.
+        """
+        if not actions:
+            return False, "No candidate actions to explore."
+        try:
+            outcomes = run_explore(self, actions)
+        except RuntimeError as e:
+            return False, f"Error exploring actions: {e}"
+        log = f"Explored {len(actions)} candidate actions from the current state (the simulator state is unchanged).\n"
+        for i, (action, (success, action_log)) in enumerate(zip(actions, outcomes)):
+            log += f"\n### Candidate {i + 1}: {action}\n"
+            log += action_log if success else f"[Error]: {action_log}"
+            log += "\n"
+        log += f"\nAction history: {self.action_history}"
         return True, log
 
+    def run_tasks(self, task_ids, env_rule_code: str):
+        """
+        Runs whole episodes for several tasks concurrently with `env_rule_code` and returns one summary line per task
+        (success, steps, first invalid action) instead of the full logs. The state of this simulator is not changed.
+        """
+        if not task_ids:
+            return False, "No task ids to run."
+        for task_id in task_ids:
+            eval_result, _, _ = check_task_id(task_id)
+            if not eval_result:
+                return False, f"Invalid task_id: {task_id}. Must be in the format 'int-int' where int1 in [0, 5]."
+        summaries = run_task_summaries(task_ids, env_rule_code)
+        log = f"Ran {len(task_ids)} tasks with the current `WrapStep` function.\n"
+        for summary in summaries:
+            if "error" in summary:
+                log += f"Task {summary['task_id']}: error: {summary['error']}\n"
+                continue
+            first_invalid = summary["first_invalid_action"]
+            first_invalid = f"step {first_invalid['step']}: {first_invalid['action']}" if first_invalid else "none"
+            log += f"Task {summary['task_id']}: success={summary['success']}, steps={summary['steps']}, hidden env.steps per action: {summary['env_steps']['hidden_steps_per_action']:.1f}, first invalid action: {first_invalid}\n"
+        num_success = sum(1 for summary in summaries if summary.get("success"))
+        log += f"Success: {num_success}/{len(task_ids)}"
+        return True, log
+
+    def _push_snapshot(self, obs, reward, done, num_actions=None):
+        """
+        Records the env state after the current action history if it is a checkpoint (every
+        SIMULATOR_SNAPSHOT_INTERVAL actions). Snapshot 0 (the freshly reset game) is always kept; after it only the
+        newest SIMULATOR_SNAPSHOT_STACK_SIZE checkpoints are, older states are rebuilt by replay.
+        """
+        num_actions = len(self.action_history) if num_actions is None else num_actions
+        if not SIMULATOR_SNAPSHOTS or _snapshot_support is False:
+            return
+        if num_actions % max(1, SIMULATOR_SNAPSHOT_INTERVAL) != 0:
+            return
+        env_copy = snapshot_env(self.env)
+        if env_copy is None:
+            self.snapshots = []
+            return
+        self.snapshots.append((num_actions, env_copy, obs, reward, done))
+        if len(self.snapshots) > SIMULATOR_SNAPSHOT_STACK_SIZE + 1:
+            del self.snapshots[1]
+
+    def _replay(self, env, actions, obs, reward, done):
+        with get_profiler().span("simulator.replay", steps=len(actions)):
+            for action in actions:
+                obs, reward, done, info = env.step([action])
+                obs, reward, done = obs[0], info['won'][0], done[0]
+        return obs, reward, done
+
+    def _restore(self, num_actions):
+        """
+        Puts `self.env` into the state after the first `num_actions` actions of the history and returns that state's
+        (obs, reward, done): restores the newest snapshot at or before it and replays only the actions after it.
+        """
+        global _snapshot_support
+        self.snapshots = [snapshot for snapshot in self.snapshots if snapshot[0] <= num_actions]
+        env = None
+        if self.snapshots and _snapshot_support is not False:
+            base_actions, base_env, obs, reward, done = self.snapshots[-1]
+            env = snapshot_env(base_env)
+        from_snapshot = env is not None
+        if not from_snapshot:
+            env, obs, info = build_env(self.task_type_idx, self.task_idx, self.meter)
+            obs, reward, done, base_actions = '\n'.join(obs[0].split('\n\n')[1:]), 0, False, 0
+            if num_actions == 0:
+                self.snapshots = []
+                self.env = env
+                self._push_snapshot(obs, reward, done, num_actions=0)
+        obs, reward, done = self._replay(env, self.action_history[base_actions:num_actions], obs, reward, done)
+
+        if from_snapshot and _snapshot_support is None:
+            _snapshot_support = self._check_snapshot(env, num_actions)
+            if not _snapshot_support:
+                self.snapshots = []
+                return self._restore(num_actions)
+        self.env = env
+        return obs, reward, done
+
+    def _check_snapshot(self, env, num_actions):
+        # 第一次用快照时，与“重建 + 重放”的结果对比一次，确认拷贝出来的环境没有和原环境共享游戏状态。
+        # 探测用的 look / inventory 在 env 的另一份拷贝上执行，不改变之后要用的 env 的历史和步数
+        probe = snapshot_env(env)
+        if probe is None:
+            return False
+        reference, obs, info = build_env(self.task_type_idx, self.task_idx)
+        self._replay(reference, self.action_history[:num_actions], obs, 0, False)
+        for action in ("look", "inventory"):
+            if probe.step([action])[0][0] != reference.step([action])[0][0]:
+                print("[EnvSimulator] env snapshots are not independent copies; falling back to replay")
+                return False
+        return True
+
     def step(self, action: str):
         self.action_history.append(action)
         obs, reward, done, info = self.env.step([action])
         obs, reward, done = obs[0], info['won'][0], done[0]
+        self._push_snapshot(obs, reward, done)
         log = f"Executing action: {action}\n"
         log += f"Observation: {obs}\n"
         log += f"Reward: {reward}\n"
@@ -257,21 +427,7 @@ Now you need to give your next action."""})
         if len(self.action_history) == 0:
             return False, "No action history to cancel."
 
-        with open(f"alfworld/file_names_train.json", "r") as f:
-            FILE_NAMES = json.load(f)
-        with open("alfworld/alfworld/configs/base_config.yaml", "r") as f:
-            alfworld_config = yaml.safe_load(f)
-        env = SingleAlfredTWEnv(alfworld_config, FILE_NAMES[self.task_type_idx][self.task_idx], "train")
-        self.env = env.init_env(batch_size=1)
-
-        self.obs, self.info = self.env.reset()
-        self.obs = '\n'.join(self.obs[0].split('\n\n')[1:])
-        self.task = self.obs.split('\n')[1].strip()
-        obs, reward, done = self.obs, 0, False
-       
-        for i in range(len(self.action_history) - 1):
-            obs, reward, done, info = self.env.step([self.action_history[i]])
-            obs, reward, done = obs[0], info['won'][0], done[0]
+        obs, reward, done = self._restore(len(self.action_history) - 1)
 
         log = f"Canceling action: {self.action_history[-1]}\n"
         log += f"The action history executed: {self.action_history[:-1]}\n"
@@ -284,15 +440,7 @@ Now you need to give your next action."""})
         return True, log
     
     def reset(self):
-        with open(f"alfworld/file_names_train.json", "r") as f:
-            FILE_NAMES = json.load(f)
-        with open("alfworld/alfworld/configs/base_config.yaml", "r") as f:
-            alfworld_config = yaml.safe_load(f)
-        env = SingleAlfredTWEnv(alfworld_config, FILE_NAMES[self.task_type_idx][self.task_idx], "train")
-        self.env = env.init_env(batch_size=1)
-
-        self.obs, self.info = self.env.reset()
-        self.obs = '\n'.join(self.obs[0].split('\n\n')[1:])
+        self.obs, _, _ = self._restore(0)
         self.task = self.obs.split('\n')[1].strip()
         self.init_obs = self.obs.split('\n')[0].strip()
         self.action_history = []
@@ -344,7 +492,7 @@ You will iterate this process—receiving the environment’s feedback, deciding
 
 # Environment Rule
 
-{self.InferRules(self.init_obs, self.task)}"""
+{self.rules}"""
             },
             {
                 "role": "user",
@@ -368,7 +516,8 @@ Begin by examining the environment or taking any initial steps you find relevant
         try:
             self.log_stream.seek(0)
             self.log_stream.truncate(0)
-            obs, reward, done = self.WrapStep(self.env, self.init_obs, self.task, agent_action, self.simulator_logger)
+            with get_profiler().span("simulator.WrapStep", category="interface", action=agent_action), self.meter.action(agent_action):
+                obs, reward, done = call_interface(self.WrapStep, self.env, self.init_obs, self.task, agent_action, self.simulator_logger)
             log_contents = self.log_stream.getvalue()
         except Exception as e:
             return False, f"Error executing agent action: {e}"
@@ -392,7 +541,8 @@ Now you need to give your next action."""})
         return True, log
     
     def get_next_agent_action(self):
-        agent_action = call_llm(self.messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024)
+        with get_profiler().span("simulator.llm_call", category="llm"):
+            agent_action = call_llm(self.messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024)
         log = f"Next agent action: {agent_action}\n"
         return True, log
     
@@ -416,19 +566,32 @@ Now you need to give your next action."""
 
         same_action_count = 0
         same_action = ""
+        # run_tasks 用的精简结果
+        self.run_summary = {"task_id": task_id, "success": False, "steps": 0, "first_invalid_action": None}
 
+        profiler = get_profiler()
         for i in range(100):
-            agent_action = call_llm(self.messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024)
+            with profiler.span("simulator.llm_call", category="llm", step=i):
+                agent_action = call_llm(self.messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024)
             self.messages.append({"role": "assistant", "content": agent_action})
             log += f"Agent Action: {agent_action}\n"
 
             self.log_stream.seek(0)
             self.log_stream.truncate(0)
-            obs, reward, done = self.WrapStep(self.env, self.init_obs, self.task, agent_action, self.simulator_logger)
+            with profiler.span("simulator.WrapStep", category="interface", step=i, action=agent_action), self.meter.action(agent_action):
+                try:
+                    obs, reward, done = call_interface(self.WrapStep, self.env, self.init_obs, self.task, agent_action, self.simulator_logger)
+                except InterfaceViolation as e:
+                    self.simulator_logger.error(f"[Interface error] {e}")
+                    obs, reward, done = f"[Interface error] {e}", False, True
             log_contents = self.log_stream.getvalue()
 
             self.have_execute_agent_action = True
             self.action_history.append(agent_action)
+            self.run_summary["steps"] = i + 1
+            self.run_summary["success"] = bool(reward)
+            if self.run_summary["first_invalid_action"] is None and str(obs).strip().startswith("Nothing happens"):
+                self.run_summary["first_invalid_action"] = {"step": i + 1, "action": agent_action}
             
             log += f"Observation: {obs}\n"
             log += f"Reward: {reward}\n"
@@ -457,4 +620,6 @@ Now you need to give your next action."""
 
             if done:
                 break
+        self.run_summary["env_steps"] = self.meter.summary()
+        log += format_overhead(self.run_summary["env_steps"]) + "\n"
         return True, log
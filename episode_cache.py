@@ -0,0 +1,80 @@
+import hashlib
+import inspect
+import json
+import os
+
+# 跨 turn / 跨实验共享的 episode 结果缓存
+EPISODE_CACHE_DIR = os.getenv("EPISODE_CACHE_DIR", "alfworld/episode_cache")
+EPISODE_CACHE_ENABLED = os.getenv("EPISODE_CACHE", "1") != "0"
+
+_interface_hash_cache = {}
+
+def hash_interface_source(source: str):
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+def get_interface_hash(InferRules, WrapStep):
+    """
+    Hash of the interface source that defines `InferRules` and `WrapStep`.
+    Uses the whole module source when available (so module-level helpers are covered),
+    returns None when the source cannot be recovered (e.g. code exec'd from a string).
+    """
+    # interface_cache 加载的函数自带源码 hash
+    interface_hash = getattr(WrapStep, "__interface_hash__", None)
+    if interface_hash is not None and getattr(InferRules, "__interface_hash__", None) == interface_hash:
+        return interface_hash
+    parts = []
+    for func in (InferRules, WrapStep):
+        module = inspect.getmodule(func)
+        module_file = getattr(module, "__file__", None)
+        if module_file and os.path.exists(module_file):
+            memo_key = (module_file, os.path.getmtime(module_file))
+            if memo_key not in _interface_hash_cache:
+                with open(module_file, "r", encoding="utf-8") as f:
+                    _interface_hash_cache[memo_key] = hash_interface_source(f.read())
+            parts.append(_interface_hash_cache[memo_key])
+        else:
+            try:
+                parts.append(hash_interface_source(inspect.getsource(func)))
+            except (OSError, TypeError):
+                return None
+    if parts[0] == parts[1]:
+        return parts[0]
+    return hash_interface_source("\n".join(parts))
+
+def make_cache_key(interface_hash, game_file, model, prompt_version):
+    key_fields = [interface_hash, game_file, model, prompt_version]
+    return hashlib.sha256(json.dumps(key_fields).encode("utf-8")).hexdigest(), key_fields
+
+def _cache_path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+def load_episode(interface_hash, game_file, model, prompt_version, cache_dir=None):
+    """
+    Returns the cached {"result": ..., "trajectory": [...]} entry, or None on a miss.
+    """
+    if not EPISODE_CACHE_ENABLED or interface_hash is None:
+        return None
+    key, key_fields = make_cache_key(interface_hash, game_file, model, prompt_version)
+    path = _cache_path(key, cache_dir or EPISODE_CACHE_DIR)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("key_fields") != key_fields:
+        return None
+    return entry
+
+def store_episode(interface_hash, game_file, model, prompt_version, result, trajectory, cache_dir=None):
+    if not EPISODE_CACHE_ENABLED or interface_hash is None:
+        return
+    key, key_fields = make_cache_key(interface_hash, game_file, model, prompt_version)
+    path = _cache_path(key, cache_dir or EPISODE_CACHE_DIR)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再原子替换，多个 worker / 多个实验同时写也不会读到半个文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key_fields": key_fields, "result": result, "trajectory": trajectory}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
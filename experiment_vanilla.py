@@ -1,20 +1,24 @@
 import importlib
+import importlib.util
 import json
 import random
 from types import FunctionType
 import os
 import sys
-import yaml
 import logging
 import io
 from tqdm import tqdm
 import concurrent.futures
+import time
+import traceback
 
 import multiprocessing
 
 os.environ["ALFWORLD_DATA"] = "alfworld/data"
 AGENTIC_SYSTEM_DEFAULT_MODEL = os.getenv("AGENTIC_SYSTEM_DEFAULT_MODEL", "qwen2.5:7b-instruct")
 MAX_WORKERS = 128  # Default number of parallel threads
+# 修改 run_single_task 中的 agent prompt 时需要同步更新，否则 episode 缓存会返回旧 prompt 下的结果
+PROMPT_TEMPLATE_VERSION = "vanilla-v1"
 
 if AGENTIC_SYSTEM_DEFAULT_MODEL=="Qwen2.5-7B-Instruct":
     from call_llm import VLLM_CONFIG
@@ -22,6 +26,16 @@ else:
     VLLM_CONFIG = [1]
 
 from call_llm import call_llm
+from episode_cache import get_interface_hash, load_episode, store_episode
+from work_queue import WorkQueue, FileLock, LeaseHeartbeat, default_worker_id
+from profiler import get_profiler, ProfiledEnv, merge_traces
+from env_meter import StepMeter, MeteredEnv, merge_summaries, format_overhead
+import log_writer
+from log_writer import open_file_logger, close_file_logger
+import task_catalog
+from interface_cache import load_interface
+from sandbox import call_interface, InterfaceViolation, limit_memory, run_watched
+from coverage_select import CoverageRecorder
 from alfworld.alfworld.agents.environment.alfred_tw_env import AlfredTWEnv
 class SingleAlfredTWEnv(AlfredTWEnv):
     def __init__(self, config, name, train_eval="train"):
@@ -50,33 +64,73 @@ def run_single_task(split, file_lock, task_info, InferRules, WrapStep, logger_ba
     print(f"{task_type_idx} - {task_idx} - {file_name} - {split}")
 
     if task_logger_file_path:
-        if os.path.exists(task_logger_file_path):
-            with open(task_logger_file_path, "w") as f:
-                f.write("")
-        task_logger = logging.getLogger(f"task_{task_info[0]}_{task_info[1]}")
-        task_logger.setLevel(logging.INFO)
-        task_logger.propagate = False
-        formatter = logging.Formatter('%(levelname)s - %(message)s')
-        file_handler = logging.FileHandler(task_logger_file_path)
-        for handler in task_logger.handlers[:]:
-            task_logger.removeHandler(handler)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(formatter)
-        task_logger.addHandler(file_handler)
+        # 经由写日志进程写入（当前进程没有写日志进程时退化为普通 FileHandler），任务结束时关闭文件
+        task_logger = open_file_logger(f"task_{task_info[0]}_{task_info[1]}", task_logger_file_path)
     else:
         task_logger = None
 
-    if task_logger:
-        task_logger.info(f"========== Task ID: {task_type_idx}-{task_idx} ==========")
-    
+    try:
+        return _run_single_task(split, file_lock, task_info, InferRules, WrapStep, logger_base_dir, llm_port_idx, base_dir, task_logger)
+    finally:
+        close_file_logger(task_logger)
+
+def _run_single_task(split, file_lock, task_info, InferRules, WrapStep, logger_base_dir, llm_port_idx, base_dir, task_logger):
+    task_type_idx, task_idx, file_name, split, alfworld_config = task_info
+    # build_task_list 不再把配置放进每个任务里，由本进程的 task_catalog 提供
+    alfworld_config = alfworld_config or task_catalog.get_alfworld_config()
+    profiler = get_profiler()
+    trace_path = f"{logger_base_dir}/trace/task_{split}_{task_type_idx}_{task_idx}.trace.json" if logger_base_dir else None
+
+    trajectory = []
+    def log_trajectory(message):
+        trajectory.append(message)
+        if task_logger:
+            with profiler.span("logging", category="log"):
+                task_logger.info(message)
+
+    interface_hash = get_interface_hash(InferRules, WrapStep)
+    # 接口代码超时 / 超内存时记下原因；这样的结果不写入 episode 缓存
+    interface_violation = None
+    # 记录本任务执行到的接口分支（COVERAGE_SELECTION=1 时），供下一版接口做回归选择
+    coverage = CoverageRecorder(WrapStep)
+    cached_episode = load_episode(interface_hash, file_name, AGENTIC_SYSTEM_DEFAULT_MODEL, PROMPT_TEMPLATE_VERSION)
+    if cached_episode is not None:
+        print(f"Task {task_type_idx}-{task_idx} hit the episode cache.")
+        for message in cached_episode["trajectory"]:
+            log_trajectory(message)
+        ensure_gold_action_obs(split, file_lock, task_type_idx, task_idx, file_name, alfworld_config, base_dir)
+        if trace_path:
+            profiler.dump(trace_path)
+        return cached_episode["result"]
+
+    log_trajectory(f"========== Task ID: {task_type_idx}-{task_idx} ==========")
+
     # with env_init_lock:
-    env = SingleAlfredTWEnv(alfworld_config, file_name, split)
-    env = env.init_env(batch_size=1)
-    obs, info = env.reset()
+    with profiler.span("env_init", category="env"):
+        env = SingleAlfredTWEnv(alfworld_config, file_name, split)
+        env = env.init_env(batch_size=1)
+        obs, info = env.reset()
+    if profiler.enabled:
+        env = ProfiledEnv(env, profiler)
+    # 按 agent 动作统计 WrapStep 里隐藏的 env.step（次数 / 耗时 / 动词）
+    meter = StepMeter()
+    env = MeteredEnv(env, meter)
     obs = '\n'.join(obs[0].split('\n\n')[1:])
     task = obs.split('\n')[1].strip()
     init_obs = obs.split('\n')[0].strip()
 
+    try:
+        with coverage:
+            rules = call_interface(InferRules, init_obs, task)
+    except InterfaceViolation as e:
+        log_trajectory(f"Task: {obs}")
+        log_trajectory(f"[Interface error] {e}")
+        final_result = {'task': file_name, 'score': 0, 'success': True, 'interface_violation': str(e)}
+        ensure_gold_action_obs(split, file_lock, task_type_idx, task_idx, file_name, alfworld_config, base_dir)
+        if trace_path:
+            profiler.dump(trace_path)
+        return final_result
+
     messages = [
         {
             "role": "system",
@@ -124,7 +178,7 @@ You will iterate this process—receiving the environment’s feedback, deciding
 
 # Environment Rule
 
-{InferRules(init_obs, task)}"""
+{rules}"""
         },
         {
             "role": "user",
@@ -136,42 +190,98 @@ Begin by examining the environment or taking any initial steps you find relevant
         }
     ]
 
-    if task_logger:
-        task_logger.info(f"Task: {obs}")
+    log_trajectory(f"Task: {obs}")
 
     log_stream = io.StringIO()
     stream_handler = logging.StreamHandler(log_stream)
     stream_handler.setLevel(logging.INFO)
     formatter = logging.Formatter('%(levelname)s - %(message)s')
     stream_handler.setFormatter(formatter)
-    function_logger = logging.getLogger(f"function_logger_{split}_{task_type_idx}_{task_idx}")
-    for handler in function_logger.handlers[:]:
-        function_logger.removeHandler(handler)
+    # 不注册到 logging 的全局表中，任务结束后随局部变量一起释放；内容按步并入 task 日志
+    function_logger = logging.Logger(f"function_logger_{split}_{task_type_idx}_{task_idx}")
     function_logger.setLevel(logging.DEBUG)
     function_logger.addHandler(stream_handler)
     function_logger.propagate = False
 
     same_action_count = 0
     same_action = ""
-
-    for i in range(100):
-        agent_action = call_llm(messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024, llm_port_idx=llm_port_idx)
+    agent_actions = []
+    observations = []
+    start_step = 0
+
+    # 检查点是 JSONL：第一行是任务、接口 hash 和初始 messages，之后每一步只追加这一步新增的内容
+    checkpoint_path = f"{logger_base_dir}/task_{split}_{task_type_idx}_{task_idx}.ckpt.jsonl" if logger_base_dir else None
+    checkpoint_header = {"file_name": file_name, "interface_hash": interface_hash, "messages": messages}
+    checkpoint = load_step_checkpoint(checkpoint_path, file_name, interface_hash)
+    if checkpoint is not None:
+        # 不调用 LLM：把记录的 agent 动作重新送进 WrapStep，由其中的 env.step 重建环境状态
+        # （WrapStep 自己挂在 env 上的状态，比如 _current_location，也会一并恢复）
+        replay_ok = True
+        with profiler.span("checkpoint_replay", steps=checkpoint["step"]):
+            for agent_action, recorded_obs in zip(checkpoint["agent_actions"], checkpoint["observations"]):
+                log_stream.seek(0)
+                log_stream.truncate(0)
+                try:
+                    with coverage:
+                        obs, reward, done = call_interface(WrapStep, env, init_obs, task, agent_action, function_logger)
+                except InterfaceViolation:
+                    replay_ok = False
+                    break
+                if obs != recorded_obs:
+                    replay_ok = False
+                    break
+        if replay_ok:
+            print(f"Task {task_type_idx}-{task_idx} resumed from step {checkpoint['step']}.")
+            start_step = checkpoint["step"]
+            agent_actions = checkpoint["agent_actions"]
+            observations = checkpoint["observations"]
+            messages = checkpoint["messages"]
+            checkpoint_header["messages"] = checkpoint["initial_messages"]
+            same_action_count = checkpoint["same_action_count"]
+            same_action = checkpoint["same_action"]
+            reward = checkpoint["reward"]
+            for message in checkpoint["trajectory"]:
+                log_trajectory(message)
+        else:
+            print(f"Task {task_type_idx}-{task_idx}: replay diverged from checkpoint, restarting the episode.")
+            with profiler.span("env_init", category="env"):
+                env = SingleAlfredTWEnv(alfworld_config, file_name, split)
+                env = env.init_env(batch_size=1)
+                env.reset()
+            if profiler.enabled:
+                env = ProfiledEnv(env, profiler)
+            env = MeteredEnv(env, meter)
+            checkpoint = None
+    if checkpoint_path:
+        # 重写一次：新的 episode 只留表头，续跑的去掉崩溃时可能写了一半的最后一行
+        start_step_checkpoint(checkpoint_path, checkpoint_header, checkpoint["records"] if checkpoint else [])
+
+    for i in range(start_step, 100):
+        num_messages, num_trajectory = len(messages), len(trajectory)
+        with profiler.span("llm_call", category="llm", step=i):
+            agent_action = call_llm(messages, model=AGENTIC_SYSTEM_DEFAULT_MODEL, temperature=0.0, max_tokens=1024, llm_port_idx=llm_port_idx)
         messages.append({"role": "assistant", "content": agent_action})
-        if task_logger:
-            task_logger.info(f"Agent Action: {agent_action}")
+        log_trajectory(f"Agent Action: {agent_action}")
 
         log_stream.seek(0)
         log_stream.truncate(0)
-        obs, reward, done = WrapStep(env, init_obs, task, agent_action, function_logger)
+        with profiler.span("WrapStep", category="interface", step=i, action=agent_action), meter.action(agent_action):
+            try:
+                with coverage:
+                    obs, reward, done = call_interface(WrapStep, env, init_obs, task, agent_action, function_logger)
+            except InterfaceViolation as e:
+                # 超时 / 超内存记为失败的一步并结束本任务，不让一个坏补丁卡住 worker
+                interface_violation = str(e)
+                function_logger.error(f"[Interface error] {e}")
+                obs, reward, done = f"[Interface error] {e}", False, True
         log_content = log_stream.getvalue()
 
-        if task_logger:
-            task_logger.info(f"Observation: {obs}")
-            task_logger.info(f"Reward: {reward}")
-            task_logger.info(f"Done: {done}")
-            if log_content:
-                task_logger.info(f"Log contents when executing `WrapStep`: {log_content}\n")
-            task_logger.info(f"---------------------------------")
+        log_trajectory(f"Observation: {obs}")
+        log_trajectory(f"Reward: {reward}")
+        log_trajectory(f"Done: {done}")
+        if log_content:
+            log_trajectory(f"Log contents when executing `WrapStep`: {log_content}\n")
+        log_trajectory(f"---------------------------------")
 
         messages.append({
     "role": "user",
@@ -191,82 +301,187 @@ Now you need to give your next action."""
         if same_action_count > 6:
             done = True
 
+        agent_actions.append(agent_action)
+        observations.append(obs)
+        if checkpoint_path and not done:
+            with profiler.span("checkpoint", category="log", step=i):
+                append_step_checkpoint(checkpoint_path, {
+                    "step": i + 1,
+                    "agent_action": agent_action,
+                    "observation": obs,
+                    "messages": messages[num_messages:],
+                    "trajectory": trajectory[num_trajectory:],
+                    "same_action_count": same_action_count,
+                    "same_action": same_action,
+                    "reward": None if reward is None else bool(reward),
+                })
+
         if done:
             break
 
-    final_result = {'task': file_name, 'score': int(reward), 'success': True}
-    
+    final_result = {'task': file_name, 'score': int(reward), 'success': True, 'env_steps': meter.summary()}
+    if coverage.enabled:
+        final_result['coverage'] = coverage.result()
+    if interface_violation:
+        final_result['interface_violation'] = interface_violation
+    else:
+        store_episode(interface_hash, file_name, AGENTIC_SYSTEM_DEFAULT_MODEL, PROMPT_TEMPLATE_VERSION, final_result, trajectory)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    ensure_gold_action_obs(split, file_lock, task_type_idx, task_idx, file_name, alfworld_config, base_dir)
+    if trace_path:
+        profiler.dump(trace_path)
+
+    return final_result
+
+def load_step_checkpoint(checkpoint_path, file_name, interface_hash):
+    """
+    Rebuilds the episode state from a step checkpoint (a header line, then one line per finished step). A last line
+    cut off by a crash is ignored. None if there is no finished step recorded for this task and interface.
+    """
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        header = json.loads(lines[0])
+    except (OSError, ValueError):
+        return None
+    if header.get("file_name") != file_name or header.get("interface_hash") != interface_hash:
+        return None
+    records = []
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    if not records:
+        return None
+    return {
+        "step": records[-1]["step"],
+        "agent_actions": [record["agent_action"] for record in records],
+        "observations": [record["observation"] for record in records],
+        "initial_messages": header["messages"],
+        "messages": header["messages"] + [message for record in records for message in record["messages"]],
+        "trajectory": [message for record in records for message in record["trajectory"]],
+        "same_action_count": records[-1]["same_action_count"],
+        "same_action": records[-1]["same_action"],
+        "reward": records[-1]["reward"],
+        "records": records,
+    }
+
+def start_step_checkpoint(checkpoint_path, header, records):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in [header] + list(records):
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+    os.replace(tmp_path, checkpoint_path)
+
+def append_step_checkpoint(checkpoint_path, record):
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+def ensure_gold_action_obs(split, file_lock, task_type_idx, task_idx, file_name, alfworld_config, base_dir):
     if split=="train" and file_lock is not None:
+        alfworld_config = alfworld_config or task_catalog.get_alfworld_config()
         gold_action_obs_sequence = []
-        with file_lock:
+        profiler = get_profiler()
+        with profiler.span("lock_wait", category="lock"):
+            file_lock.acquire()
+        try:
             with open(f"{base_dir}/golden_action_obs.json", "r", encoding="utf-8") as f:
                 gold_action_obs = json.load(f)
             if f"{task_type_idx}-{task_idx}" in gold_action_obs:
                 # results[-1]["gold_action_obs_sequence"] = gold_action_obs[f"{task_type_idx}-{task_idx}"]
                 pass
             else:
-                env = SingleAlfredTWEnv(alfworld_config, file_name, split)
-                env = env.init_env(batch_size=1)
-                obs, info = env.reset()
-                obs = '\n'.join(obs[0].split('\n\n')[1:])
-                gold_action_obs_sequence.append(f"Task: {obs}")
-                max_steps = 150
-                done = False
-                step = 0
-                while not done:
-                    action = info["extra.expert_plan"][0][0]
-                    obs, score, done, info = env.step([action])
-                    obs, reward, done = obs[0], info['won'][0], done[0]
-                    gold_action_obs_sequence.append(f"Agent Action: {action}")
-                    gold_action_obs_sequence.append(f"Observation: {obs} | Reward: {reward} | Done: {done}")
-                    step += 1
-                    if step >= max_steps or done:
-                        break
-                if done and info["won"][0]:
-                    # results[-1]["gold_action_obs_sequence"] = gold_action_obs_sequence
-                    gold_action_obs[f"{task_type_idx}-{task_idx}"] = gold_action_obs_sequence
-                else:
-                    # results[-1]["gold_action_obs_sequence"] = ["We can't give you the gold action sequence for this task."]
-                    gold_action_obs[f"{task_type_idx}-{task_idx}"] = ["We can't give you the gold action sequence for this task."]
+                with profiler.span("golden_sequence"):
+                    env = SingleAlfredTWEnv(alfworld_config, file_name, split)
+                    env = env.init_env(batch_size=1)
+                    obs, info = env.reset()
+                    obs = '\n'.join(obs[0].split('\n\n')[1:])
+                    gold_action_obs_sequence.append(f"Task: {obs}")
+                    max_steps = 150
+                    done = False
+                    step = 0
+                    while not done:
+                        action = info["extra.expert_plan"][0][0]
+                        obs, score, done, info = env.step([action])
+                        obs, reward, done = obs[0], info['won'][0], done[0]
+                        gold_action_obs_sequence.append(f"Agent Action: {action}")
+                        gold_action_obs_sequence.append(f"Observation: {obs} | Reward: {reward} | Done: {done}")
+                        step += 1
+                        if step >= max_steps or done:
+                            break
+                    if done and info["won"][0]:
+                        # results[-1]["gold_action_obs_sequence"] = gold_action_obs_sequence
+                        gold_action_obs[f"{task_type_idx}-{task_idx}"] = gold_action_obs_sequence
+                    else:
+                        # results[-1]["gold_action_obs_sequence"] = ["We can't give you the gold action sequence for this task."]
+                        gold_action_obs[f"{task_type_idx}-{task_idx}"] = ["We can't give you the gold action sequence for this task."]
             with open(f"{base_dir}/golden_action_obs.json", "w", encoding="utf-8") as f:
                 json.dump(gold_action_obs, f, ensure_ascii=False, indent=4)
-
-    return final_result
-
-def run_experiment_parallel(split, interface_module_name, logger_base_dir=None, _slice=None, random_choice=False, max_workers=MAX_WORKERS, task_type_list=[0,1,2,3,4,5], base_dir=""):
-    print(f"interface_module_name: {interface_module_name}")
-    print(f"Using {max_workers} parallel workers")
-
-    if logger_base_dir:
-        os.makedirs(logger_base_dir, exist_ok=True)
-    
+        finally:
+            file_lock.release()
+
+def init_rollout_worker(log_queue):
+    log_writer.init_worker(log_queue)
+    limit_memory()
+
+def failed_task_result(file_name, error):
+    """
+    Result recorded for a task whose worker raised, crashed or was killed. `success` is False, so a re-run of the
+    turn retries it; `error` marks it as an infrastructure error, which is not counted in the scores.
+    """
+    return {'task': file_name, 'score': 0, 'success': False, 'error': f"{type(error).__name__}: {error}"}
+
+def is_scored(result):
+    # 沙箱 / 运行框架出错的任务不算作任务失败
+    return "error" not in result
+
+def read_interface_source(interface_module_name):
+    if not isinstance(interface_module_name, str):
+        raise ValueError("interface_module_name must be a string")
+    importlib.invalidate_caches()
+    spec = importlib.util.find_spec(interface_module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+        print(f"Error: Could not import module '{interface_module_name}'")
+        raise ImportError(f"No interface source file found for module '{interface_module_name}'")
+    with open(spec.origin, "r", encoding="utf-8") as f:
+        return f.read()
+
+def load_interface_module(interface_module_name):
+    # 不再 import 模块，按源码 hash 从 interface_cache 取编译好的函数
+    interface = load_interface(read_interface_source(interface_module_name))
+    if interface.InferRules is None or interface.WrapStep is None:
+        print(f"Error: Could not load 'InferRules' and 'WrapStep' from module '{interface_module_name}': {' '.join(interface.diagnostics)}")
+        raise AttributeError(f"Invalid interface module '{interface_module_name}'")
+    return interface.InferRules, interface.WrapStep
+
+def run_single_task_from_source(split, file_lock, task_info, interface_source, *args):
+    """
+    `run_single_task` for process pools: exec'd interface functions cannot be pickled, so workers receive
+    the source and load it through their own interface_cache (a forked worker inherits the parent's).
+    """
+    interface = load_interface(interface_source)
+    return run_single_task(split, file_lock, task_info, interface.InferRules, interface.WrapStep, *args)
+
+def build_task_list(split, _slice=None, random_choice=False, task_type_list=[0,1,2,3,4,5], task_indices=None):
     # Dictionary to store all tasks
     all_tasks = []
 
-    if isinstance(interface_module_name, str):
-        try:
-            module = importlib.import_module(interface_module_name)
-            InferRules = getattr(module, "InferRules")
-            WrapStep = getattr(module, "WrapStep")
-        except ImportError:
-            print(f"Error: Could not import module '{interface_module_name}'")
-            raise
-        except AttributeError:
-            print(f"Error: Could not find function 'get_environment_explanation' or 'WrapStep' in module '{interface_module_name}'")
-            raise
-    # elif isinstance(interface_module_name, FunctionType):
-    #     WrapStep = interface_module_name
-    else:
-        raise ValueError("interface_module_name must be a string")
-    
-    with open(f"alfworld/file_names_{split}.json", "r") as f:
-        file_names = json.load(f)
-    with open("alfworld/alfworld/configs/base_config.yaml", "r") as f:
-        alfworld_config = yaml.safe_load(f)
+    file_names = list(task_catalog.get_file_names(split))
 
     for i in task_type_list:
         file_names[i] = [(idx, file_name) for idx, file_name in enumerate(file_names[i])]
-    if _slice is not None:
+    if task_indices is not None:
+        # 由调用方（例如 task_sampler）指定具体任务
+        for i in task_type_list:
+            file_names[i] = [file_names[i][idx] for idx in task_indices[i]]
+    elif _slice is not None:
         for i in task_type_list:
             if not random_choice:
                 file_names[i] = file_names[i][:_slice]
@@ -275,57 +490,193 @@ def run_experiment_parallel(split, interface_module_name, logger_base_dir=None,
     
     for i in task_type_list:
         for task_idx, file_name in file_names[i]:
-            all_tasks.append((i, task_idx, file_name, split, alfworld_config))
-    
+            # 配置为 None：worker 从 task_catalog 取，不随每个任务 pickle 一份
+            all_tasks.append((i, task_idx, file_name, split, None))
+    return all_tasks
+
+def run_experiment_parallel(split, interface_module_name, logger_base_dir=None, _slice=None, random_choice=False, max_workers=MAX_WORKERS, task_type_list=[0,1,2,3,4,5], base_dir="", task_indices=None, interface_source=None):
+    print(f"interface_module_name: {interface_module_name}")
+    print(f"Using {max_workers} parallel workers")
+
+    if logger_base_dir:
+        os.makedirs(logger_base_dir, exist_ok=True)
+
+    if interface_source is None:
+        interface_source = read_interface_source(interface_module_name)
+    # 在主进程里校验一次，fork 出来的 worker 直接复用已编译的结果
+    interface = load_interface(interface_source)
+    if interface.InferRules is None or interface.WrapStep is None:
+        raise ValueError(f"Invalid interface '{interface_module_name}': {' '.join(interface.diagnostics)}")
+    all_tasks = build_task_list(split, _slice, random_choice, task_type_list, task_indices)
+
     results_by_type = {i: {split: []} for i in range(6)}
 
     manager = multiprocessing.Manager()
     file_lock = manager.Lock()
+    # fork 出来的 worker 直接继承已加载的配置
+    task_catalog.preload([split])
+
+    # 没有上层（main.py）启动的写日志进程时，为本次运行单独启动一个
+    own_log_writer = logger_base_dir is not None and log_writer.get_queue() is None
+    if own_log_writer:
+        log_writer.start_log_writer()
+
+    jobs = {}
+    for i, task_info in enumerate(all_tasks):
+        if logger_base_dir:
+            task_logger_file_path = f"{logger_base_dir}/task_{split}_{task_info[0]}_{task_info[1]}.log"
+        else:
+            task_logger_file_path = None
+        jobs[i] = (split, file_lock, task_info, interface_source, logger_base_dir, task_logger_file_path, i%len(VLLM_CONFIG), base_dir)
+
+    # 使用tqdm显示进度
+    pbar = tqdm(total=len(jobs), desc="Processing tasks")
+    # run_watched：单个任务超过 INTERFACE_TASK_TIMEOUT 时杀掉它的 worker 进程（接口卡在 C 调用里时信号打断不了）
+    for i, result, error in run_watched(run_single_task_from_source, jobs, max_workers, initializer=init_rollout_worker, initargs=(log_writer.get_queue(),)):
+        task_type_idx, task_idx, file_name, split, _ = all_tasks[i]
+        if error is not None:
+            # 接口代码抛出的异常（或 worker 本身出错、超时被杀）只让这一个任务失败，不中断整轮
+            print(f"Task {task_type_idx}-{task_idx} failed: {type(error).__name__}: {error}")
+            result = failed_task_result(file_name, error)
+        if logger_base_dir:
+            result_path = f"{logger_base_dir}/task_{split}_{task_type_idx}_{task_idx}.json"
+            try:
+                with open(result_path, 'w') as f:
+                    json.dump(result, f, indent=2)
+                print(f"Saved result to {result_path}")
+            except Exception as e:
+                print(f"ERROR: Could not save result to {result_path}: {str(e)}")
+
+        results_by_type[task_type_idx][split].append(result)
+        pbar.update(1)
+    pbar.close()
+
+    # 确保所有 task 日志都已落盘，main.py 紧接着就会合并它们
+    if own_log_writer:
+        log_writer.stop_log_writer()
+    else:
+        log_writer.sync_log_writer()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_task = {}
-        for i, task_info in enumerate(all_tasks):
-            if logger_base_dir:
-                task_logger_file_path = f"{logger_base_dir}/task_{split}_{task_info[0]}_{task_info[1]}.log"
-            else:
-                task_logger_file_path = None
-            future_to_task[executor.submit(run_single_task, split, file_lock, task_info, InferRules, WrapStep, logger_base_dir, task_logger_file_path, i%len(VLLM_CONFIG), base_dir)] = task_info
-        
-        # 使用tqdm显示进度
-        completed = 0
-        total = len(future_to_task)
-        pbar = tqdm(total=total, desc="Processing tasks")
-        
-        for future in concurrent.futures.as_completed(future_to_task):
-            task_info = future_to_task[future]
-            task_type_idx, task_idx, file_name, split, _ = task_info
+    print("All tasks completed. Saving final results...")
+    save_and_print_results(results_by_type, split, logger_base_dir)
+    if logger_base_dir and get_profiler().enabled:
+        merge_traces(f"{logger_base_dir}/trace", f"{logger_base_dir}/trace.json")
 
-            result = future.result()
-            if logger_base_dir:
-                result_path = f"{logger_base_dir}/task_{split}_{task_type_idx}_{task_idx}.json"
-                try:
-                    with open(result_path, 'w') as f:
-                        json.dump(result, f, indent=2)
-                    print(f"Saved result to {result_path}")
-                except Exception as e:
-                    print(f"ERROR: Could not save result to {result_path}: {str(e)}")
-            
-            results_by_type[task_type_idx][split].append(result)
+    return results_by_type
 
-            completed += 1
-            pbar.update(1)
-            
-            # 定期保存整体结果
-            # if completed % 20 == 0:
-            #     save_and_print_results(results_by_type, split, logger_base_dir)
-        
-        pbar.close()
+def run_experiment_queue(split, interface_module_name, queue_db, logger_base_dir, _slice=None, random_choice=False, task_type_list=[0,1,2,3,4,5], base_dir="", poll_interval=10, task_indices=None):
+    """
+    Coordinator side of the shared-filesystem work queue: enqueues the turn's tasks and waits until
+    `experiment_vanilla.py --worker` processes (on any host sharing `queue_db`) have finished them.
+    `logger_base_dir` doubles as the job id, so re-running a turn resumes the same job.
+    """
+    print(f"interface_module_name: {interface_module_name}")
+    print(f"Using work queue {queue_db}")
+
+    os.makedirs(logger_base_dir, exist_ok=True)
+    # 只检查能否导入，真正的执行在 worker 里
+    load_interface_module(interface_module_name)
+    all_tasks = build_task_list(split, _slice, random_choice, task_type_list, task_indices)
+
+    queue = WorkQueue(queue_db)
+    job = logger_base_dir
+    queue.enqueue(job, [
+        (f"{split}_{task_type_idx}_{task_idx}", {
+            "split": split,
+            "interface_module_name": interface_module_name,
+            "task_type_idx": task_type_idx,
+            "task_idx": task_idx,
+            "file_name": file_name,
+            "logger_base_dir": logger_base_dir,
+            "base_dir": base_dir,
+            "llm_port_idx": i % len(VLLM_CONFIG),
+        })
+        for i, (task_type_idx, task_idx, file_name, split, _) in enumerate(all_tasks)
+    ])
+
+    total = len(all_tasks)
+    pbar = tqdm(total=total, desc="Waiting for queue workers")
+    finished = 0
+    while True:
+        counts = queue.counts(job)
+        now_finished = counts.get("done", 0) + counts.get("failed", 0)
+        pbar.update(now_finished - finished)
+        finished = now_finished
+        if finished >= total:
+            break
+        time.sleep(poll_interval)
+    pbar.close()
+
+    results, errors = queue.results(job)
+    for task_key, error in errors.items():
+        print(f"ERROR: Task {task_key} failed on all attempts: {error}")
+
+    results_by_type = {i: {split: []} for i in range(6)}
+    for task_type_idx, task_idx, file_name, split, _ in all_tasks:
+        task_key = f"{split}_{task_type_idx}_{task_idx}"
+        if task_key in results:
+            results_by_type[task_type_idx][split].append(results[task_key])
 
     print("All tasks completed. Saving final results...")
     save_and_print_results(results_by_type, split, logger_base_dir)
+    if get_profiler().enabled:
+        merge_traces(f"{logger_base_dir}/trace", f"{logger_base_dir}/trace.json")
 
     return results_by_type
 
+def run_queue_worker(queue_db, worker_id=None, poll_interval=5, exit_when_idle=False, log_queue=None):
+    """
+    Worker side of the work queue: claims tasks with a lease, keeps the lease alive while the
+    episode runs and writes the result JSON into the turn directory, exactly as
+    `run_experiment_parallel` does. Expired leases of crashed workers are re-claimed by others.
+    """
+    init_rollout_worker(log_queue)
+    queue = WorkQueue(queue_db)
+    worker_id = worker_id or default_worker_id()
+    print(f"[worker {worker_id}] polling {queue_db}")
+
+    while True:
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        job, task_key, payload = claimed
+        split = payload["split"]
+        task_type_idx, task_idx = payload["task_type_idx"], payload["task_idx"]
+        logger_base_dir = payload["logger_base_dir"]
+        base_dir = payload["base_dir"]
+        task_info = (task_type_idx, task_idx, payload["file_name"], split, None)
+        file_lock = FileLock(f"{base_dir}/golden_action_obs.json.lock") if base_dir else None
+
+        try:
+            InferRules, WrapStep = load_interface_module(payload["interface_module_name"])
+            with LeaseHeartbeat(queue, job, task_key, worker_id) as heartbeat:
+                result = run_single_task(split, file_lock, task_info, InferRules, WrapStep, logger_base_dir,
+                                         f"{logger_base_dir}/task_{split}_{task_type_idx}_{task_idx}.log",
+                                         payload["llm_port_idx"], base_dir)
+                # 任务日志落盘后再上报完成，协调者随后会合并这些日志；超时（TimeoutError）按失败重试
+                log_writer.sync_log_writer()
+        except Exception as e:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            error_details = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+            print(f"[worker {worker_id}] task {task_key} failed: {error_details}")
+            queue.fail(job, task_key, worker_id, error_details)
+            continue
+
+        if heartbeat.lost:
+            print(f"[worker {worker_id}] lease on {task_key} was lost; discarding result.")
+            continue
+        result_path = f"{logger_base_dir}/task_{split}_{task_type_idx}_{task_idx}.json"
+        try:
+            with open(result_path, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f"Saved result to {result_path}")
+        except Exception as e:
+            print(f"ERROR: Could not save result to {result_path}: {str(e)}")
+        queue.complete(job, task_key, worker_id, result)
+
 def save_and_print_results(results_by_type, split, logger_base_dir):
     if not logger_base_dir:
         return
@@ -334,6 +685,7 @@ def save_and_print_results(results_by_type, split, logger_base_dir):
     score["average"] = []
     total_score = 0
     total_count = 0
+    num_errors = 0
 
     for task_type_idx in range(6):
         if task_type_idx not in score:
@@ -343,7 +695,8 @@ def save_and_print_results(results_by_type, split, logger_base_dir):
             score[task_type_idx][split] = []
         
         # Calculate average score for this task type and split
-        task_results = results_by_type[task_type_idx][split]
+        task_results = [result for result in results_by_type[task_type_idx][split] if is_scored(result)]
+        num_errors += len(results_by_type[task_type_idx][split]) - len(task_results)
         if task_results:
             task_scores = [result["score"] for result in task_results]
             avg_score = sum(task_scores) / len(task_scores)
@@ -354,6 +707,7 @@ def save_and_print_results(results_by_type, split, logger_base_dir):
     
     if total_count > 0:
         score["average"] = [total_score / total_count]
+    score["errors"] = num_errors
     
     # Save scores to file
     with open(f"{logger_base_dir}/score.json", "w") as f:
@@ -363,6 +717,13 @@ def save_and_print_results(results_by_type, split, logger_base_dir):
     print(json.dumps(score, indent=2))
     print(f"Total tasks completed: {total_count}; Total score: {total_score}")
     print(f"Current average score: {total_score / total_count if total_count > 0 else 'N/A'}")
+    if num_errors:
+        print(f"{num_errors} tasks hit an infrastructure error (sandbox / worker) and are not counted in the score")
+
+    overhead = merge_summaries(result.get("env_steps") for task_type_idx in range(6) for result in results_by_type[task_type_idx][split])
+    print(format_overhead(overhead))
+    with open(f"{logger_base_dir}/env_overhead.json", "w") as f:
+        json.dump(overhead, f, indent=2)
     
     # Save full results
     with open(f"{logger_base_dir}/all_results.json", "w") as f:
@@ -374,11 +735,49 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run experiment")
     parser.add_argument("--interface_module", type=str, help="Module name for interface")
     parser.add_argument("--logger_base_dir", type=str, help="Base directory for logging results")
+    parser.add_argument("--sequential", action="store_true", help="Stop evaluation early once the score is pinned down (see sequential_eval.py)")
+    parser.add_argument("--compare_interface_module", type=str, help="With --sequential: second interface module for a paired comparison")
+    parser.add_argument("--precision", type=float, default=0.05, help="With --sequential: target half-width of the score interval")
+    parser.add_argument("--confidence", type=float, default=0.95, help="With --sequential: overall confidence level")
+    parser.add_argument("--worker", action="store_true", help="Run as a work-queue worker instead of running an experiment")
+    parser.add_argument("--queue_db", type=str, default=os.getenv("WORK_QUEUE_DB"), help="SQLite work-queue file on a shared directory")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes to start with --worker")
+    parser.add_argument("--exit_when_idle", action="store_true", help="Stop workers once the queue is empty")
     
     argparse_args = parser.parse_args()
     interface_module = argparse_args.interface_module
     logger_base_dir = argparse_args.logger_base_dir
 
+    if argparse_args.worker:
+        if not argparse_args.queue_db:
+            raise ValueError("--worker requires --queue_db or WORK_QUEUE_DB")
+        # 每台机器一个写日志进程，本机所有 worker 进程共用
+        log_writer.start_log_writer()
+        workers = [
+            multiprocessing.Process(target=run_queue_worker, args=(argparse_args.queue_db,), kwargs={"exit_when_idle": argparse_args.exit_when_idle, "log_queue": log_writer.get_queue()})
+            for _ in range(argparse_args.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        log_writer.stop_log_writer()
+        sys.exit(0)
+
+    if argparse_args.sequential:
+        from sequential_eval import run_sequential_evaluation
+        interface_modules = [interface_module]
+        if argparse_args.compare_interface_module:
+            interface_modules.append(argparse_args.compare_interface_module)
+        run_sequential_evaluation(
+            split="eval_out_of_distribution",
+            interface_module_names=interface_modules,
+            logger_base_dir=logger_base_dir,
+            precision=argparse_args.precision,
+            confidence=argparse_args.confidence,
+        )
+        sys.exit(0)
+
     run_experiment_parallel(
         split="eval_out_of_distribution",
         interface_module_name=interface_module,
@@ -0,0 +1,83 @@
+import json
+import re
+
+from trajectory_compressor import parse_steps, MAX_LOOP_PERIOD
+
+# 一个 turn 里很多失败轨迹是同一种失败方式；按失败签名聚类，每类只把一个代表送去给 LLM 分析，
+# 规模最大的类排在最前
+INVALID_OBSERVATION = "Nothing happens."
+
+def action_verb(action):
+    words = action.strip().lower().split()
+    if not words:
+        return "none"
+    if words[0] == "go" and len(words) > 1 and words[1] == "to":
+        return "go to"
+    return words[0]
+
+def observation_template(observation):
+    # 屏蔽实例编号与具体物体名，"cabinet 3" 与 "drawer 5" 的同类反馈归到一起
+    template = re.sub(r"\b[a-z]+ \d+\b", "<obj>", observation.strip().lower())
+    template = re.sub(r"\d+", "#", template)
+    return template[:80]
+
+def loop_shape(steps):
+    """
+    "loop{period}x{repeats}" for the longest repeated block of 1..MAX_LOOP_PERIOD actions at the end of the episode,
+    "none" if the episode did not end in a loop.
+    """
+    actions = [step["action"] for step in steps]
+    best = None
+    for period in range(1, MAX_LOOP_PERIOD + 1):
+        block = actions[-period:]
+        if len(block) < period:
+            break
+        repeats = 1
+        while actions[-(repeats + 1) * period:len(actions) - repeats * period] == block:
+            repeats += 1
+        if repeats > 1 and (best is None or repeats * period > best[0] * best[1]):
+            best = (period, repeats)
+    return f"loop{best[0]}x{min(best[1], 5)}{'+' if best[1] > 5 else ''}" if best else "none"
+
+def compute_signature(env_log):
+    """
+    task type | verb of the last invalid action | template of the last observation | loop shape at the end.
+    """
+    task_type = str(env_log.get("task_id", "?")).split("-")[0]
+    _, steps = parse_steps(env_log["logging"])
+    if not steps:
+        return f"{task_type}|no_steps"
+    invalid_steps = [step for step in steps if step["observation"].startswith(INVALID_OBSERVATION)]
+    last_invalid_verb = action_verb(invalid_steps[-1]["action"]) if invalid_steps else "none"
+    return f"{task_type}|{last_invalid_verb}|{observation_template(steps[-1]['observation'])}|{loop_shape(steps)}"
+
+def cluster_failures(env_logging):
+    """
+    Groups failed trajectories by signature. Returns clusters sorted by size (largest first), each
+    {"signature", "size", "task_ids", "representative"}; the representative is the shortest log of the cluster
+    (cheapest to analyze), annotated with "cluster_size" and "cluster_task_ids".
+    """
+    clusters = {}
+    for env_log in env_logging:
+        if env_log["score"] == 1:
+            continue
+        clusters.setdefault(compute_signature(env_log), []).append(env_log)
+
+    result = []
+    for signature, members in clusters.items():
+        representative = dict(min(members, key=lambda env_log: len(env_log["logging"])))
+        representative["cluster_size"] = len(members)
+        representative["cluster_task_ids"] = [env_log.get("task_id") for env_log in members]
+        result.append({
+            "signature": signature,
+            "size": len(members),
+            "task_ids": representative["cluster_task_ids"],
+            "representative": representative,
+        })
+    # 稳定排序：同样大小时保持原来（打乱后）的顺序
+    result.sort(key=lambda cluster: -cluster["size"])
+    return result
+
+def save_clusters(clusters, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{key: value for key, value in cluster.items() if key != "representative"} for cluster in clusters], f, ensure_ascii=False, indent=2)
@@ -0,0 +1,230 @@
+import gzip
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue as queue_module
+import shutil
+
+# 所有 task / agent 日志都经由 QueueHandler 发到同一个写日志进程：
+# worker 不再各自持有 FileHandler，任务结束时由写进程确定性地关闭文件
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 512))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.5))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 256 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+
+TASK_LOG_FORMAT = '%(levelname)s - %(message)s'
+
+_queue = None
+_writer = None
+
+class LogWriter:
+    def __init__(self, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_writer_loop,
+            args=(self.queue, batch_size, flush_interval, max_bytes, backup_count),
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def stop(self):
+        self.queue.put(None)
+        self.process.join()
+
+def start_log_writer():
+    """
+    Starts the writer process for this run (idempotent) and routes this process's file loggers to it.
+    """
+    global _writer, _queue
+    if _writer is None:
+        _writer = LogWriter().start()
+        _queue = _writer.queue
+    return _writer
+
+def stop_log_writer():
+    global _writer, _queue
+    if _writer is not None:
+        _writer.stop()
+    _writer = None
+    _queue = None
+
+def sync_log_writer(timeout=60):
+    """
+    Blocks until every message queued so far by this process has been written and flushed.
+    Raises TimeoutError if the writer has not confirmed within `timeout` seconds.
+    """
+    if _queue is None:
+        return
+    # 每次同步带一根自己的管道，写进程从这根管道回复确认，不同进程的确认互不相干
+    reply, reply_sender = multiprocessing.Pipe(duplex=False)
+    try:
+        # Queue.put 由后台线程异步 pickle，收到回复之前不能关掉发送端
+        _queue.put(("sync", reply_sender))
+        if not reply.poll(timeout):
+            raise TimeoutError(f"the log writer did not confirm the sync within {timeout:g}s")
+        reply.recv()
+    finally:
+        reply_sender.close()
+        reply.close()
+
+def get_queue():
+    return _queue
+
+def init_worker(log_queue):
+    """
+    `ProcessPoolExecutor(initializer=init_worker, initargs=(get_queue(),))`: routes the worker's file loggers to the writer.
+    """
+    global _queue
+    _queue = log_queue
+
+class _FileQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, path):
+        super().__init__(log_queue)
+        self.path = path
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.log_file = self.path
+        return record
+
+def attach_file_handler(logger, path, fmt=TASK_LOG_FORMAT, truncate=False, level=logging.INFO):
+    """
+    Adds a handler writing `logger`'s records to `path`: through the writer process if one is
+    reachable from this process, otherwise a plain FileHandler.
+    """
+    if _queue is not None:
+        if truncate:
+            _queue.put(("open", path, "w"))
+        handler = _FileQueueHandler(_queue, path)
+    else:
+        handler = logging.FileHandler(path, mode="w" if truncate else "a")
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter(fmt))
+    logger.addHandler(handler)
+    return handler
+
+def detach_file_handlers(logger):
+    """
+    Removes all handlers from `logger` and closes the files behind them.
+    """
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        if isinstance(handler, _FileQueueHandler):
+            handler.queue.put(("close", handler.path))
+        handler.close()
+
+def open_file_logger(name, path, fmt=TASK_LOG_FORMAT, truncate=True):
+    """
+    Per-task logger. It is deliberately not registered with `logging.getLogger`, so long-lived workers
+    do not accumulate one logger object per task; call `close_file_logger` when the task ends.
+    """
+    logger = logging.Logger(name, logging.INFO)
+    logger.propagate = False
+    attach_file_handler(logger, path, fmt, truncate=truncate)
+    return logger
+
+def close_file_logger(logger):
+    if logger is not None:
+        detach_file_handlers(logger)
+
+def _rotate(path, backup_count):
+    # path -> path.1.gz, path.1.gz -> path.2.gz, ...
+    for i in range(backup_count - 1, 0, -1):
+        src, dst = f"{path}.{i}.gz", f"{path}.{i + 1}.gz"
+        if os.path.exists(src):
+            os.replace(src, dst)
+    with open(path, "rb") as f_in, gzip.open(f"{path}.1.gz", "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(path)
+
+def log_segments(path):
+    """
+    Existing files of a (possibly rotated) log, oldest first: path.N.gz, ..., path.1.gz, path.
+    """
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}.gz"):
+        rotated.append(f"{path}.{i}.gz")
+        i += 1
+    segments = rotated[::-1]
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+def read_log_lines(path):
+    """
+    Lines of a log including its rotated .gz segments, in the order they were written.
+    """
+    for segment in log_segments(path):
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rt", encoding="utf-8") as f:
+            yield from f
+
+def _writer_loop(log_queue, batch_size, flush_interval, max_bytes, backup_count):
+    handles = {}
+
+    def get_handle(path, mode="a"):
+        if path not in handles:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handles[path] = open(path, mode, encoding="utf-8")
+        return handles[path]
+
+    running = True
+    while running:
+        try:
+            batch = [log_queue.get(timeout=flush_interval)]
+        except queue_module.Empty:
+            continue
+        while len(batch) < batch_size:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue_module.Empty:
+                break
+
+        touched = set()
+        for item in batch:
+            if item is None:
+                running = False
+                break
+            if isinstance(item, tuple):
+                command, *args = item
+                if command == "open":
+                    path, mode = args
+                    if path in handles:
+                        handles.pop(path).close()
+                    get_handle(path, mode)
+                elif command == "close":
+                    path = args[0]
+                    if path in handles:
+                        handles.pop(path).close()
+                    touched.discard(path)
+                elif command == "sync":
+                    for path in touched:
+                        handles[path].flush()
+                    touched.clear()
+                    reply_sender = args[0]
+                    try:
+                        reply_sender.send(True)
+                    except OSError:
+                        # 等待方已经超时退出
+                        pass
+                    reply_sender.close()
+                continue
+            path = item.log_file
+            f = get_handle(path)
+            f.write(item.getMessage() + "\n")
+            touched.add(path)
+
+        for path in touched:
+            f = handles[path]
+            f.flush()
+            if max_bytes and f.tell() > max_bytes:
+                handles.pop(path).close()
+                _rotate(path, backup_count)
+
+    for f in handles.values():
+        f.close()
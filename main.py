@@ -23,6 +23,9 @@ _slice = int(os.getenv("slice", 3))
 
 train_task_list = eval(os.getenv("train_task_list", "[0, 1,2,3,4,5]"))
 
+# 每个 turn 的 slice 预算中留给最近失败 / 未跑过任务的比例，0 表示完全随机抽样
+failure_focus = float(os.getenv("failure_focus", 0.5))
+
 initial_interface_module_name = os.getenv("INTERFACE_MODULE_NAME", "interface_ini")
 interface_module_name = initial_interface_module_name
 
@@ -45,6 +48,7 @@ if os.getenv("past") is not None:
     base_dir = config["base_dir"]
     _slice = config["slice"]
     train_task_list = config["train_task_list"]
+    failure_focus = config.get("failure_focus", failure_focus)
     initial_interface_module_name = config["INTERFACE_MODULE_NAME"]
 
     initial_turn = 1
@@ -87,12 +91,16 @@ with open(f"{base_dir}/config.json", "w") as f:
         "base_dir": base_dir,
         "slice": _slice,
         "train_task_list": train_task_list,
+        "failure_focus": failure_focus,
         "INTERFACE_MODULE_NAME": initial_interface_module_name,
         "TEMPLATE": TEMPLATE,
     }, f, indent=2)
 
+# 设置后训练 rollout 走共享目录上的任务队列，由任意数量的 `experiment_vanilla.py --worker` 进程执行
+WORK_QUEUE_DB = os.getenv("WORK_QUEUE_DB")
+
 if TEMPLATE=="vanilla":
-    from experiment_vanilla import run_experiment_parallel
+    from experiment_vanilla import run_experiment_parallel, run_experiment_queue
 
 else:
     raise Exception(f"Unknown template: {TEMPLATE}")
@@ -107,8 +115,26 @@ agent_logger = logging.getLogger(f"{EXPERIMENT_NAME}_{date_time}_agent")
 agent_logger.setLevel(logging.INFO)
 agent_logger.propagate = False
 
+# 所有 worker 的 task 日志和 agent 日志都交给同一个写日志进程
+import log_writer
+log_writer.start_log_writer()
+
+from episode_cache import hash_interface_source
+from coverage_select import COVERAGE_SELECTION, COVERAGE_FULL_RUN, reuse_unaffected_results
+from env_meter import format_overhead
+from turn_logging import merge_task_logs, parse_exp_logging
+from profiler import get_profiler, merge_traces
+profiler = get_profiler()
+from task_sampler import TaskSampler
+from failure_clustering import cluster_failures, save_clusters
+task_sampler = TaskSampler(f"{base_dir}/task_history.json", failure_fraction=failure_focus)
+import task_catalog
+num_train_tasks_by_type = task_catalog.num_tasks_by_type("train")
+
 from analysis_agent import AnalysisAgent
 analysis_agent = AnalysisAgent()
+from analysis_memo import AnalysisMemo
+analysis_memo = AnalysisMemo(f"{base_dir}/analysis_memo.json")
 
 from optimization_agent import OptimizationAgent
 optimization_agent = OptimizationAgent()
@@ -119,93 +145,100 @@ if not os.path.exists(f"{base_dir}/golden_action_obs.json"):
     with open(f"{base_dir}/golden_action_obs.json", "w", encoding="utf-8") as f:
         json.dump(golden_action_obs, f, indent=2)
 
+# 上一轮的 (turn 目录, 接口源码)，用于复用没有走到改动分支的任务结果
+previous_turn = None
 try:
     for turn in tqdm(range(initial_turn, initial_turn + 8)):
         os.makedirs(f"{base_dir}/turn_{turn}", exist_ok=True)
         exp_logger_file = f"{base_dir}/turn_{turn}/exp_logger.log"
 
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         agent_logger_file = f"{base_dir}/turn_{turn}/agent_logger.log"
-        for handler in agent_logger.handlers[:]:
-            agent_logger.removeHandler(handler)
-        file_handler = logging.FileHandler(agent_logger_file)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(formatter)
-        agent_logger.addHandler(file_handler)
+        log_writer.detach_file_handlers(agent_logger)
+        log_writer.attach_file_handler(agent_logger, agent_logger_file, fmt='%(asctime)s - %(levelname)s - %(message)s')
+
+        with open(f"alfworld/{interface_module_name}.py", "r") as f:
+            interface_source = f.read()
+        interface_hash = hash_interface_source(interface_source)
 
         score = {}
         if not os.path.exists(exp_logger_file):
-            results = run_experiment_parallel(
-                split="train",
-                interface_module_name=interface_module_name,
-                logger_base_dir=f"{base_dir}/turn_{turn}",
-                _slice=_slice,
-                random_choice=True,
-                task_type_list=train_task_list,
-                base_dir=base_dir,
-            )
-            # 遍历 f"{base_dir}/turn_{turn}" 目录下的所有 task_*.log 文件，将其合并到 exp_logger_file 中
-            # 搜索所有 task_*.log 文件
-            task_log_files = sorted(glob.glob(os.path.join(f"{base_dir}/turn_{turn}", "task_*.log")))
-            
-            # 以追加方式打开 exp_logger_file，将所有 log 内容合并写入
-            with open(exp_logger_file, 'a', encoding='utf-8') as out_f:
-                for task_file in task_log_files:
-                    with open(task_file, 'r', encoding='utf-8') as in_f:
-                        for line in in_f:
-                            out_f.write(line)
-                    out_f.write("\n")  # 添加换行符以分隔不同文件的内容
+            task_indices = task_sampler.sample(num_train_tasks_by_type, train_task_list, _slice, interface_hash)
+            if COVERAGE_SELECTION and not COVERAGE_FULL_RUN and previous_turn is not None:
+                reused = reuse_unaffected_results(previous_turn[0], previous_turn[1], interface_source, f"{base_dir}/turn_{turn}", task_indices)
+                print(f"Reusing {len(reused)} task results from {previous_turn[0]} (they do not reach the changed interface code)")
+                agent_logger.info(f"[Coverage] reused task results: {', '.join(reused) if reused else 'none'}")
+            if WORK_QUEUE_DB:
+                results = run_experiment_queue(
+                    split="train",
+                    interface_module_name=interface_module_name,
+                    queue_db=WORK_QUEUE_DB,
+                    logger_base_dir=f"{base_dir}/turn_{turn}",
+                    _slice=_slice,
+                    random_choice=True,
+                    task_type_list=train_task_list,
+                    base_dir=base_dir,
+                    task_indices=task_indices,
+                )
+            else:
+                results = run_experiment_parallel(
+                    split="train",
+                    interface_module_name=interface_module_name,
+                    logger_base_dir=f"{base_dir}/turn_{turn}",
+                    _slice=_slice,
+                    random_choice=True,
+                    task_type_list=train_task_list,
+                    base_dir=base_dir,
+                    task_indices=task_indices,
+                    interface_source=interface_source,
+                )
+            merge_task_logs(f"{base_dir}/turn_{turn}", exp_logger_file)
+
+        # 每个接口版本的隐藏 env.step 开销，按 turn 汇总到 base_dir/env_overhead.json，方便对比哪个版本更贵
+        if os.path.exists(f"{base_dir}/turn_{turn}/env_overhead.json"):
+            with open(f"{base_dir}/turn_{turn}/env_overhead.json", "r") as f:
+                overhead = json.load(f)
+            agent_logger.info(f"[EnvOverhead] turn {turn}, interface {interface_hash[:12]}: {format_overhead(overhead)}")
+            overhead_history = {}
+            if os.path.exists(f"{base_dir}/env_overhead.json"):
+                with open(f"{base_dir}/env_overhead.json", "r") as f:
+                    overhead_history = json.load(f)
+            overhead_history[str(turn)] = {"interface_module": interface_module_name, "interface_hash": interface_hash, **overhead}
+            with open(f"{base_dir}/env_overhead.json", "w") as f:
+                json.dump(overhead_history, f, indent=2)
         
         with open(f"{base_dir}/golden_action_obs.json", "r", encoding="utf-8") as f:
             gold_action_obs = json.load(f)
         
-        with open(f"alfworld/{interface_module_name}.py", "r") as f:
-            cur_env_rule = f.read()
+        cur_env_rule = interface_source
         
         with open(exp_logger_file, "r") as f:
             all_logging = f.readlines()
         
-        env_logging = []
-        nothing_happens_num = []
-        slice_len = -1
-        for line in all_logging:
-            if line.strip() == "":
-                continue
-            if "INFO - ==========" in line:
-                if slice_len != -1 and len(env_logging) > 0:
-                    env_logging[-1]["logging"] = env_logging[-1]["logging"][:slice_len].strip()
-                env_logging.append({"score": 0, "logging": ""})
-                task_id = line.split("Task ID: ")[1].split(" ========")[0].strip()
-                env_logging[-1]["task_id"] = task_id
-                env_logging[-1]["gold_action_obs_sequence"] = gold_action_obs[task_id]
-                nothing_happens_num = []
-                slice_len = -1
-            elif "INFO - Reward:" in line:
-                env_logging[-1]["score"] = int(eval(line.split("Reward: ")[1].strip()))
-            elif "INFO - Observation:" in line:
-                if line.split("Observation: ")[1].strip() == "Nothing happens.":
-                    nothing_happens_num.append(1)
-                else:
-                    nothing_happens_num.append(0)
-                if len(nothing_happens_num) > 6:
-                    nothing_happens_num = nothing_happens_num[-6:]
-            env_logging[-1]["logging"] += line
-            if len(nothing_happens_num) == 6 and sum(nothing_happens_num) > 4 and "INFO - Done:" in line and slice_len == -1:
-                slice_len = len(env_logging[-1]["logging"])
+        env_logging = parse_exp_logging(all_logging, gold_action_obs)
         
+        task_sampler.update(env_logging, interface_hash, turn)
+        for env_log in env_logging:
+            env_log["turn"] = turn
+
         # 将 all_logging 随机打乱
         random.shuffle(env_logging)
 
+        # 同一种失败方式只送一个代表去分析，规模最大的类排在最前
+        failure_clusters = cluster_failures(env_logging)
+        save_clusters(failure_clusters, f"{base_dir}/turn_{turn}/failure_clusters.json")
+        print(f"{len(failure_clusters)} failure clusters from {sum(cluster['size'] for cluster in failure_clusters)} failed tasks")
+
         last_environment_logics = environment_logics
         cur_new_environment_logics = ""
         if not os.path.exists(f"{base_dir}/turn_{turn}/environment_logics.txt"):
             new_environment_logics = analysis_agent.analyze_logging(
                 cur_env_rule=cur_env_rule,
-                env_logging=env_logging,
+                env_logging=[cluster["representative"] for cluster in failure_clusters],
                 # model=MAIN_MODEL,
                 model=ANALYSIS_AGENT_MODEL,
                 agent_logger=agent_logger,
-                environment_logics=environment_logics
+                environment_logics=environment_logics,
+                memo=analysis_memo,
             )
             new_environment_logics_count = len(new_environment_logics.split("### Analysis Result")) - 1
             if environment_logics == "No Analysis Currently":
@@ -243,17 +276,26 @@ try:
             agent_logger=agent_logger,
             last_environment_logics=last_environment_logics,
             new_environment_logics=cur_new_environment_logics,
+            golden_path=f"{base_dir}/golden_action_obs.json",
         )
 
         with open(f"alfworld/{initial_interface_module_name}_{EXPERIMENT_NAME}_{date_time}_turn_{turn+1}.py", "w") as f:
             f.write(cur_env_rule)
         interface_module_name = f"{initial_interface_module_name}_{EXPERIMENT_NAME}_{date_time}_turn_{turn+1}"
+        previous_turn = (f"{base_dir}/turn_{turn}", interface_source)
+
+        # 主进程（分析 / 优化 agent 与 simulator）的 trace 与本 turn 的 worker trace 合并
+        if profiler.enabled:
+            profiler.dump(f"{base_dir}/turn_{turn}/trace/main.trace.json")
+            merge_traces(f"{base_dir}/turn_{turn}/trace", f"{base_dir}/turn_{turn}/trace.json")
 except Exception as e:
     print(e)
     exc_type, exc_value, exc_traceback = sys.exc_info()
     error_details = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
     print(error_details)
 finally:
+    log_writer.detach_file_handlers(agent_logger)
+    log_writer.stop_log_writer()
     for turn in range(20):
         system_file = f"alfworld/{initial_interface_module_name}_{EXPERIMENT_NAME}_{date_time}_turn_{turn}.py"
         if os.path.exists(system_file):
@@ -3,15 +3,36 @@ import sys
 # sys.path.append('.')
 import os
 TEMPLATE = os.getenv("TEMPLATE", "vanilla")
+# Best-of-N：>1 时并发采样 N 个候选补丁，全部做 golden 回放，回放通过的再在少量任务上 rollout，保留得分最高的一个
+OPTIMIZATION_NUM_CANDIDATES = int(os.getenv("OPTIMIZATION_NUM_CANDIDATES", 1))
+OPTIMIZATION_CANDIDATE_TEMPERATURE = float(os.getenv("OPTIMIZATION_CANDIDATE_TEMPERATURE", 0.7))
+OPTIMIZATION_SCORE_TASKS = int(os.getenv("OPTIMIZATION_SCORE_TASKS", 2))
+# full：每次输出整份接口代码；patch：只输出统一 diff 或要替换的函数，由 code_patcher 打到当前代码上
+OPTIMIZATION_EDIT_MODE = os.getenv("OPTIMIZATION_EDIT_MODE", "full")
+OPTIMIZATION_PATCH_MAX_TOKENS = int(os.getenv("OPTIMIZATION_PATCH_MAX_TOKENS", 4096))
 import traceback
+import concurrent.futures
 
-import yaml
 from call_llm import call_llm
+from conversation_log import ConversationLogger
+from interface_cache import load_interface
+import task_catalog
+from code_patcher import apply_patch
+from structured_output import (
+    STRUCTURED_OUTPUT,
+    OPTIMIZATION_CODE_SCHEMA,
+    OPTIMIZATION_SIMULATION_SCHEMA,
+    format_instructions,
+    format_stats,
+    parse_reply,
+    response_format,
+)
 from tqdm import tqdm
 
 if TEMPLATE == "vanilla":
     import optimization_agent_prompt_vanilla as optimization_agent_prompt_vanilla
-    from experiment_vanilla import run_single_task
+    from replay_harness import replay_candidates, select_task_ids, format_report as format_replay_report
+    from env_simulator_vanilla import run_task_summaries_batch
     from env_simulator_vanilla import EnvSimulator
     from env_simulator_vanilla import validate_InferRules_code, validate_WrapStep_code
 
@@ -21,27 +42,18 @@ else:
 import re
 
 def process_llm_response(response: str, simulator: EnvSimulator, cur_env_rule):
-    # Extract contents of various tags
-    action_pattern = r"<action>(.*?)</action>"
-    if_need_refine_pattern = r"<if_need_refine>(.*?)</if_need_refine>"
-    refine_strategy_pattern = r"<refine_strategy>(.*?)</refine_strategy>"
-
-    # Search for matches
-    action_match = re.search(action_pattern, response, flags=re.DOTALL)
-    if_need_refine_match = re.search(if_need_refine_pattern, response, flags=re.DOTALL)
-    refine_strategy_match = re.search(refine_strategy_pattern, response, flags=re.DOTALL)
-    
-    # Store found content (if any) – you could log or display these as desired
-    if_need_refine = if_need_refine_match.group(1).strip() if if_need_refine_match else ""
-    refine_strategy = refine_strategy_match.group(1).strip() if refine_strategy_match else ""
+    # 标签格式与 JSON（结构化输出）都由 schema 驱动的 parse_reply 解析
+    fields, _ = parse_reply(response, OPTIMIZATION_SIMULATION_SCHEMA)
+    if_need_refine = fields["if_need_refine"]
+    refine_strategy = fields["refine_strategy"]
 
     # If a <conclusion> tag is present, we consider the process finished
     if if_need_refine:
         return True, True, (if_need_refine, refine_strategy)
 
     # If we have an <action> tag, parse it to decide which simulator method to invoke
-    if action_match:
-        action_content = action_match.group(1).strip()
+    if fields["action"]:
+        action_content = fields["action"]
 
         if action_content.startswith("init_simulator(task_id="):
             task_id_match = re.search(r'init_simulator\(task_id\s*=\s*"([^"]+)"\)', action_content)
@@ -91,6 +103,24 @@ def process_llm_response(response: str, simulator: EnvSimulator, cur_env_rule):
             success, env_log = simulator.get_next_agent_action()
             return False, success, env_log
 
+        elif action_content.startswith("explore("):
+            explore_match = re.search(r'explore\(actions\s*=\s*\[(.*)\]\s*\)', action_content, flags=re.DOTALL)
+            if explore_match:
+                explore_actions = re.findall(r'"([^"]+)"', explore_match.group(1))
+                success, env_log = simulator.explore(explore_actions)
+                return False, success, env_log
+            else:
+                return False, False, "[Error]: Invalid Action Format for explore. Expected format: explore(actions=[\"xxx\", \"yyy\"])"
+
+        elif action_content.startswith("run_tasks("):
+            run_tasks_match = re.search(r'run_tasks\(task_ids\s*=\s*\[(.*)\]\s*\)', action_content, flags=re.DOTALL)
+            if run_tasks_match:
+                task_ids = re.findall(r'"([^"]+)"', run_tasks_match.group(1))
+                success, env_log = simulator.run_tasks(task_ids, cur_env_rule)
+                return False, success, env_log
+            else:
+                return False, False, "[Error]: Invalid Action Format for run_tasks. Expected format: run_tasks(task_ids=[\"x-y\", \"x-z\"])"
+
         elif action_content.startswith("run_task(task_id="):
             task_id_match = re.search(r'run_task\(task_id\s*=\s*"([^"]+)"\)', action_content)
             if task_id_match:
@@ -110,16 +140,23 @@ class OptimizationAgent:
     def __init__(self):
         pass
 
-    def optimize_patch(self, cur_env_rule, model_code, model_valid, agent_logger, last_environment_logics, new_environment_logics):
+    def optimize_patch(self, cur_env_rule, model_code, model_valid, agent_logger, last_environment_logics, new_environment_logics, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+        """
+        golden_path: the experiment's golden action/observation file (`{base_dir}/golden_action_obs.json`, which grows as
+        rollouts record new tasks); candidates are replayed on its sequences.
+        """
         init_cur_env_rule = cur_env_rule
 
         messages = [
             {
                 "role": "user",
-                "content": optimization_agent_prompt_vanilla.get_optimize_user_prompt(cur_env_rule, last_environment_logics, new_environment_logics)
+                "content": optimization_agent_prompt_vanilla.get_optimize_user_prompt(cur_env_rule, last_environment_logics, new_environment_logics) + format_instructions(OPTIMIZATION_CODE_SCHEMA)
             }
         ]
-        agent_logger.info(f"[OptimizationAgent] messages: {messages}")
+        if OPTIMIZATION_EDIT_MODE == "patch":
+            messages[0]["content"] += optimization_agent_prompt_vanilla.get_patch_mode_instructions()
+        conversation = ConversationLogger(agent_logger, "OptimizationAgent")
+        conversation.log(messages)
         max_tries = 10
 
         tries = 0
@@ -131,58 +168,16 @@ class OptimizationAgent:
                 break
             first_gen_tries += 1
 
-            response = call_llm(messages, model=model_code, temperature=0.2, max_tokens=12800)
+            if OPTIMIZATION_NUM_CANDIDATES > 1:
+                response, code, replay_report = self.best_of_n(messages, model_code, agent_logger, init_cur_env_rule, golden_path=golden_path)
+            else:
+                response, code = self.generate_candidate(messages, model_code, agent_logger, init_cur_env_rule)
+                replay_report = None
             messages.append({"role": "assistant", "content": response})
-            agent_logger.info(f"[OptimizationAgent] response: {response}")
-
-            if "<code>" not in response or "</code>" not in response:
-                if "```python" in response and "```" in response.split("```python")[1]:
-                    pass
-                else:
-                    continue_gen_time = 5
-                    while continue_gen_time > 0:
-                        continue_gen_time -= 1
-                        if "<code>" in response and "</code>" not in response:
-                            agent_logger.info(f"[OptimizationAgent] continue_gen_time: {5-continue_gen_time}")
-                            print(f"[OptimizationAgent] continue_gen_time: {5-continue_gen_time}")
-                            new_messages = messages.copy()
-                            final_line_code = response.strip().split("\n")[-1]
-                            new_messages.append({"role": "user", "content": f"Continue generating from the last line of code. You should generate '{final_line_code}' firstly, and then continue generating. Do not output anything else! Just output the code and end with </code>."})
-                            new_response = call_llm(new_messages, model=model_code, temperature=0.2, max_tokens=12800)
-                            agent_logger.info(f"[OptimizationAgent] new_response(continue): {new_response}")
-                            if final_line_code.strip() not in new_response:
-                                agent_logger.info(f"[OptimizationAgent] Final line code not found in new response. Retrying...")
-                                continue
-                            response = response.strip()
-                            space_number = 0
-                            for i in final_line_code:
-                                if i == " ": 
-                                    space_number += 1
-                                else:
-                                    break
-                            new_response_first_line_code = new_response.strip().split("\n")[0]
-                            while final_line_code.strip() not in new_response_first_line_code:
-                                new_response = "\n".join(new_response.split("\n")[1:])
-                                new_response_first_line_code = new_response.strip().split("\n")[0]
-                            response = "\n".join(response.split("\n")[:-1]) + "\n" + " " * space_number + new_response_first_line_code + "\n" + "\n".join(new_response.strip().split("\n")[1:])
-                            messages[-1]["content"] = response
-                            agent_logger.info(f"[OptimizationAgent] merged response: {response}")
-                        else:
-                            break
-
-            if ("<code>" in response and "</code>" in response) or ("```python" in response and "```" in response.split("```python")[1]):
-                if "<code>" in response and "</code>" in response:
-                    cur_env_rule = response.split("<code>")[1].split("</code>")[0]
-                else:
-                    cur_env_rule = response.split("```python")[1].split("```")[0]
-                cur_env_rule = cur_env_rule.strip()
-                if cur_env_rule.startswith("```python"):
-                    cur_env_rule = cur_env_rule.split("```python")[1].strip()
-                elif cur_env_rule.startswith("```"):
-                    cur_env_rule = cur_env_rule.split("```")[1].strip()
-                if cur_env_rule.endswith("```"):
-                    cur_env_rule = cur_env_rule.split("```")[0].strip()
-                cur_env_rule = cur_env_rule.strip()
+            conversation.log(messages)
+
+            if code is not None:
+                cur_env_rule = code
 
                 eval_result, WrapStep = validate_WrapStep_code(cur_env_rule)
                 if not eval_result:
@@ -200,23 +195,19 @@ class OptimizationAgent:
                     messages.pop(-1)
                     continue
                 
-                with open("alfworld/alfworld/configs/base_config.yaml", "r") as f:
-                    alfworld_config = yaml.safe_load(f)
-
-                try:
-                    # run_experiment(task_type_idx=1, split="train", interface_module_name=func, logger=None, _slice=1)
-                    run_single_task("train", None, (0, 1, "alfworld/data/json_2.1.1/train/pick_and_place_simple-Bread-None-Microwave-15/trial_T20190907_041007_141387/game.tw-pddl", "train", alfworld_config), InferRules, WrapStep)
-                    agent_logger.info(f"[OptimizationAgent] Code executed successfully.")
-                except Exception as e:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    error_details = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
-                    agent_logger.info(f"[OptimizationAgent] Exception: {error_details}")
-                    # messages.append({"role": "user", "content": f"Code execution failed. Please revise the code. Error details: {error_details}\n\nYou should output in the same format as before."})
+                # 冒烟测试：离线回放 golden 专家动作（不调用 LLM），检查异常、返回值约定以及 reward / done 与原始环境一致；
+                # 只拒绝回归（当前接口能通过、新版本通过不了的任务）和新出现的异常，当前接口本来就过不了的任务不算
+                if replay_report is None:
+                    replay_report = replay_candidates(init_cur_env_rule, [cur_env_rule], golden_path=golden_path)[0]
+                agent_logger.info(f"[OptimizationAgent] {format_replay_report(replay_report)}")
+                if not replay_report["passed"]:
+                    # messages.append({"role": "user", "content": f"Code execution failed. Please revise the code. Error details: {format_replay_report(replay_report)}\n\nYou should output in the same format as before."})
                     messages.pop(-1)
                     continue
+                agent_logger.info(f"[OptimizationAgent] Code executed successfully.")
                 
-                messages = [messages[0], messages[-1], {"role": "user", "content": optimization_agent_prompt_vanilla.get_simulate_env_user_prompt()}]
-                agent_logger.info(f"[OptimizationAgent] New messages: {messages}")
+                messages = [messages[0], messages[-1], {"role": "user", "content": optimization_agent_prompt_vanilla.get_simulate_env_user_prompt() + format_instructions(OPTIMIZATION_SIMULATION_SCHEMA)}]
+                conversation.log(messages)
                 simulator = EnvSimulator()
                 first_gen_tries = 0
                 tries += 1
@@ -224,11 +215,12 @@ class OptimizationAgent:
                 simulate_step = 0
                 STOP = False
                 while True:
-                    response = call_llm(messages, model=model_valid, temperature=0.1)
+                    response = call_llm(messages, model=model_valid, temperature=0.1, response_format=response_format(OPTIMIZATION_SIMULATION_SCHEMA))
                     simulate_step += 1
                     messages.append({"role": "assistant", "content": response})
-                    agent_logger.info(f"[OptimizationAgent] response: {response}")
+                    conversation.log(messages)
                     finished, p1, p2 = process_llm_response(response, simulator, cur_env_rule)
+                    format_stats.record("OptimizationAgent", isinstance(p2, str) and p2.startswith("[Error]: Unrecognized response format"))
                     if finished:
                         break
                     messages.append({"role": "user", "content": p2})
@@ -242,13 +234,12 @@ class OptimizationAgent:
 <thought> Your reasoning here </thought>
 <if_need_refine> True/False </if_need_refine>
 <refine_strategy> Your strategy for refining the WrapStep function, if if_need_refine is True </refine_strategy>"""
-                        agent_logger.info(f"[OptimizationAgent] add user message: {messages[-1]['content']}")
-                    agent_logger.info(f"[OptimizationAgent] add user message: {p2}")
+                    conversation.log(messages)
                 if STOP:
                     continue
                 if p2[0].strip() == "True":
                     messages = [messages[0], messages[1], {"role": "user", "content": f"After simulation and validation, you need to refine the code. Refine strategy: {p2[1].strip()}. You should output in the same format as before."}]
-                    agent_logger.info(f"[OptimizationAgent] New messages: {messages}")
+                    conversation.log(messages)
                     continue
                 elif p2[0].strip() == "False":
                     agent_logger.info(f"[OptimizationAgent] Simulation completed successfully.")
@@ -260,4 +251,122 @@ class OptimizationAgent:
                 messages.pop(-1)
         if cur_env_rule == init_cur_env_rule:
             agent_logger.info(f"[OptimizationAgent] No changes made to the environment rule. Exiting...")
+        agent_logger.info(f"[OptimizationAgent] {format_stats.report()}")
         return cur_env_rule
+
+    def generate_candidate(self, messages, model_code, agent_logger, base_source, temperature=0.2):
+        """
+        One code-generation call, continued when the <code> block was cut off by max_tokens.
+        Returns (response, code); code is None when the response contains no code block. In patch mode the
+        returned code is `base_source` with the model's changes applied (None if they cannot be applied).
+        """
+        max_tokens = OPTIMIZATION_PATCH_MAX_TOKENS if OPTIMIZATION_EDIT_MODE == "patch" else 12800
+        response = call_llm(messages, model=model_code, temperature=temperature, max_tokens=max_tokens, response_format=response_format(OPTIMIZATION_CODE_SCHEMA))
+
+        code = None
+        if STRUCTURED_OUTPUT:
+            fields, error = parse_reply(response, OPTIMIZATION_CODE_SCHEMA)
+            if error is None:
+                code = fields["code"]
+        elif "<code>" not in response or "</code>" not in response:
+            if "```python" in response and "```" in response.split("```python")[1]:
+                pass
+            else:
+                continue_gen_time = 5
+                while continue_gen_time > 0:
+                    continue_gen_time -= 1
+                    if "<code>" in response and "</code>" not in response:
+                        agent_logger.info(f"[OptimizationAgent] continue_gen_time: {5-continue_gen_time}")
+                        print(f"[OptimizationAgent] continue_gen_time: {5-continue_gen_time}")
+                        new_messages = messages + [{"role": "assistant", "content": response}]
+                        final_line_code = response.strip().split("\n")[-1]
+                        new_messages.append({"role": "user", "content": f"Continue generating from the last line of code. You should generate '{final_line_code}' firstly, and then continue generating. Do not output anything else! Just output the code and end with </code>."})
+                        new_response = call_llm(new_messages, model=model_code, temperature=0.2, max_tokens=max_tokens)
+                        agent_logger.info(f"[OptimizationAgent] new_response(continue): {new_response}")
+                        if final_line_code.strip() not in new_response:
+                            agent_logger.info(f"[OptimizationAgent] Final line code not found in new response. Retrying...")
+                            continue
+                        response = response.strip()
+                        space_number = 0
+                        for i in final_line_code:
+                            if i == " ": 
+                                space_number += 1
+                            else:
+                                break
+                        new_response_first_line_code = new_response.strip().split("\n")[0]
+                        while final_line_code.strip() not in new_response_first_line_code:
+                            new_response = "\n".join(new_response.split("\n")[1:])
+                            new_response_first_line_code = new_response.strip().split("\n")[0]
+                        response = "\n".join(response.split("\n")[:-1]) + "\n" + " " * space_number + new_response_first_line_code + "\n" + "\n".join(new_response.strip().split("\n")[1:])
+                    else:
+                        break
+
+        if not STRUCTURED_OUTPUT:
+            if "<code>" in response and "</code>" in response:
+                code = response.split("<code>")[1].split("</code>")[0]
+            elif "```python" in response and "```" in response.split("```python")[1]:
+                code = response.split("```python")[1].split("```")[0]
+        format_stats.record("OptimizationAgent", code is None)
+
+        if code is not None:
+            code = code.strip()
+            if code.startswith("```python"):
+                code = code.split("```python")[1].strip()
+            elif code.startswith("```"):
+                code = code.split("```")[1].strip()
+            if code.endswith("```"):
+                code = code.split("```")[0].strip()
+            code = code.strip()
+
+        if code is not None and OPTIMIZATION_EDIT_MODE == "patch":
+            code, error = apply_patch(base_source, code)
+            if error:
+                agent_logger.info(f"[OptimizationAgent] Patch could not be applied: {error}")
+        return response, code
+
+    def best_of_n(self, messages, model_code, agent_logger, base_source, num_candidates=OPTIMIZATION_NUM_CANDIDATES, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+        """
+        Samples `num_candidates` patches concurrently and scores them: every loadable candidate is replayed on the
+        golden sequences, the ones that pass are rolled out on OPTIMIZATION_SCORE_TASKS tasks. Only candidates that pass
+        the replay are ranked, by (replay pass rate, rollout successes, fewer rollout steps). Returns (response, code,
+        replay_report) of the best, or (response, None, None) when no candidate passes.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_candidates) as executor:
+            generated = list(executor.map(lambda _: self.generate_candidate(messages, model_code, agent_logger, base_source, OPTIMIZATION_CANDIDATE_TEMPERATURE), range(num_candidates)))
+
+        candidates = []
+        for i, (response, code) in enumerate(generated):
+            if code is None or code in [candidate_code for _, _, candidate_code in candidates]:
+                continue
+            interface = load_interface(code)
+            if interface.InferRules is None or interface.WrapStep is None:
+                agent_logger.info(f"[OptimizationAgent] Candidate {i}: invalid interface: {' '.join(interface.diagnostics)}")
+                continue
+            candidates.append((i, response, code))
+        if not candidates:
+            # 没有可用的候选：交给 optimize_patch 按原来的流程记录失败并重试
+            return generated[0][0], generated[0][1], None
+
+        replay_reports = replay_candidates(base_source, [code for _, _, code in candidates], golden_path=golden_path)
+        score_task_ids = select_task_ids(OPTIMIZATION_SCORE_TASKS, golden_path) if OPTIMIZATION_SCORE_TASKS > 0 else []
+        jobs = [(task_id, code) for (_, _, code), report in zip(candidates, replay_reports) if report["passed"] for task_id in score_task_ids]
+        summaries = run_task_summaries_batch(jobs) if jobs else []
+
+        scores = {}
+        for k, ((i, _, code), report) in enumerate(zip(candidates, replay_reports)):
+            if not report["passed"]:
+                agent_logger.info(f"[OptimizationAgent] Candidate {i}: rejected by replay: {format_replay_report(report)}")
+                continue
+            candidate_summaries = [summary for (_, job_code), summary in zip(jobs, summaries) if job_code == code]
+            replay_rate = report["num_passing"] / report["num_tasks"] if report["num_tasks"] else 1.0
+            successes = sum(1 for summary in candidate_summaries if summary.get("success"))
+            steps = sum(summary.get("steps", 0) for summary in candidate_summaries)
+            scores[k] = (replay_rate, successes, -steps)
+            agent_logger.info(f"[OptimizationAgent] Candidate {i}: replay {replay_rate:.2f}, rollout {successes}/{len(candidate_summaries)} succeeded in {steps} steps")
+        if not scores:
+            agent_logger.info(f"[OptimizationAgent] Best of {num_candidates}: no candidate passed the replay")
+            return candidates[0][1], None, None
+
+        best = max(scores, key=lambda k: scores[k])
+        agent_logger.info(f"[OptimizationAgent] Best of {num_candidates}: candidate {candidates[best][0]}")
+        return candidates[best][1], candidates[best][2], replay_reports[best]
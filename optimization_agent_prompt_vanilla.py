@@ -181,6 +181,29 @@ Please ensure your final answer follows these guidelines so that we can accurate
 def get_optimize_user_prompt(WrapStep, last_environment_logics, new_environment_logics):
     return optimize_user_prompt_template.replace("{{ WrapStep }}", WrapStep).replace("{{ last_environment_logics }}", str(last_environment_logics)).replace("{{ new_environment_logics }}", str(new_environment_logics))
 
+patch_mode_instructions = """
+
+-----------------------------------------------------------------------
+### Output Only Your Changes
+
+Do not output the whole code again. Inside <code></code>, output only your changes to the current code shown above, in one of these two forms:
+
+1. A unified diff against the current code, e.g.
+   @@ -52,3 +52,4 @@
+    unchanged line
+   -removed line
+   +added line
+    unchanged line
+   Keep a few unchanged lines around every change so it can be located; the line numbers may be approximate.
+
+2. The complete new definitions of only the functions you change (including helper functions nested inside `WrapStep`), plus any new imports. Each function replaces the function of the same name; functions with new names are added.
+
+Your changes are always applied to the current code shown above, so when you are asked to refine, output all of your changes again, not only the new ones.
+"""
+
+def get_patch_mode_instructions():
+    return patch_mode_instructions
+
 simulate_env_user_prompt_template = """Now you should conduct simulation experiments in the simulator to verify if the `InferRules` and `WrapStep` function you provided is correct for the new environment logics and misalignment analyzed by the AnalysisAgent.
 
 You must perform sufficient experiments to confirm or refute your suspicion. Here are the operations you can use:
@@ -217,6 +240,15 @@ You must perform sufficient experiments to confirm or refute your suspicion. Her
    - Runs the entire task in the simulator and returns the running log.
    - After running the whole task, you need to call `init_simulator` or `reset_simulator` to reinitialize the simulator for further operations.
 
+7. explore(actions: list[str])
+   - Executes each candidate agent action with the `WrapStep` function you generated, every one starting from the current simulator state, and returns all outcomes together.
+   - The current simulator state is not changed. Use it to compare several hypotheses in one operation, e.g. explore(actions=["open drawer 1", "go to drawer 1"]).
+
+8. run_tasks(task_ids: list[str])
+   - Runs several whole tasks concurrently with the `WrapStep` function you generated, e.g. run_tasks(task_ids=["0-1", "2-5", "4-3"]).
+   - Returns one summary line per task (success, number of steps, first action answered with "Nothing happens.") instead of the full running logs, and does not change the current simulator state.
+   - Use `run_task` when you need the full log of a single task.
+
 If you believe you have reached a conclusion from your experiments, provide it in this format:
 
 <thought> Your reasoning here </thought>
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from env_meter import EnvProxy
+
+# 分阶段计时（LLM 调用 / WrapStep / 隐藏的 env.step / 日志 / 环境初始化 / golden 序列 / 锁等待），
+# 导出为 Chrome trace-event JSON（chrome://tracing 或 https://ui.perfetto.dev 打开）
+PROFILE_ENABLED = os.getenv("PROFILE", "0") == "1"
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Profiler:
+    def __init__(self, enabled=PROFILE_ENABLED):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.events = []
+
+    def span(self, name, category="phase", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name, category, args):
+        # 用墙上时钟（微秒）而不是 perf_counter，这样不同 worker 进程的事件能对齐到同一时间轴
+        start = time.time_ns() // 1000
+        try:
+            yield
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": time.time_ns() // 1000 - start,
+                "pid": self.pid,
+                "tid": threading.get_ident() % 100000,
+                "args": args,
+            })
+
+    def dump(self, path):
+        """
+        Writes the recorded events to `path` and clears them.
+        """
+        if not self.enabled or not self.events:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.events, f)
+        self.events = []
+
+_profiler = None
+
+def get_profiler():
+    """
+    Per-process profiler; a forked worker gets a fresh one instead of inheriting the parent's events.
+    """
+    global _profiler
+    if _profiler is None or _profiler.pid != os.getpid():
+        _profiler = Profiler()
+    return _profiler
+
+class ProfiledEnv(EnvProxy):
+    """
+    Proxy around an env that records every `env.step` call (including the hidden ones made inside `WrapStep`).
+    """
+    _shared = ("_profiler",)
+
+    def __init__(self, env, profiler):
+        super().__init__(env)
+        self._profiler = profiler
+
+    def step(self, actions):
+        with self._profiler.span("env.step", category="env", action=actions[0] if actions else ""):
+            return self._env.step(actions)
+
+def merge_traces(trace_dir, output_path):
+    """
+    Merges all `*.trace.json` event files under `trace_dir` into one Chrome trace with one track per process.
+    """
+    events = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "*.trace.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            events.extend(json.load(f))
+    if not events:
+        return None
+    pids = sorted({event["pid"] for event in events})
+    main_pid = os.getpid()
+    metadata = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": "main" if pid == main_pid else f"worker {pid}"},
+        }
+        for pid in pids
+    ]
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+    return output_path
@@ -0,0 +1,269 @@
+import io
+import logging
+import multiprocessing
+import numbers
+import os
+import time
+import traceback
+
+import task_catalog
+from interface_cache import load_interface
+from env_simulator_vanilla import build_env
+from sandbox import call_interface, InterfaceViolation, limit_memory, run_watched, can_fork
+from coverage_select import COVERAGE_SELECTION, COVERAGE_FULL_RUN, CoverageRecorder, changed_branches, affects
+from episode_cache import hash_interface_source
+
+# 离线回放验证：把 golden 库里的专家动作序列逐步送进候选 WrapStep（不调用 LLM），检查
+# 1) 是否抛异常；2) 返回值是否符合 (obs: str, reward, done) 的约定；3) reward / done 是否与原始环境一致
+# （golden 序列里记录的就是原始环境的 reward / done）。几秒内给出通过 / 失败报告
+REPLAY_NUM_TASKS = int(os.getenv("REPLAY_NUM_TASKS", 24))
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", 8))
+# 单个任务回放的墙钟上限（秒），超过就杀掉 worker 进程
+REPLAY_TASK_TIMEOUT = float(os.getenv("REPLAY_TASK_TIMEOUT", 300))
+# 报告里每个任务的 traceback 最多保留的行数
+MAX_TRACEBACK_LINES = 12
+
+def parse_golden_sequence(sequence):
+    """
+    [(action, reward, done)] from a golden sequence, reward / done as recorded from the raw env.
+    """
+    steps, action = [], None
+    for line in sequence:
+        if line.startswith("Agent Action: "):
+            action = line[len("Agent Action: "):].strip()
+        elif line.startswith("Observation: ") and action is not None:
+            _, _, flags = line.rpartition(" | Reward: ")
+            reward, _, done = flags.partition(" | Done: ")
+            steps.append((action, reward.strip() == "True", done.strip() == "True"))
+            action = None
+    return steps
+
+def select_task_ids(num_tasks=REPLAY_NUM_TASKS, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    Up to `num_tasks` task ids with a golden sequence, taken round-robin over task types so every type is covered.
+    """
+    by_type = {}
+    for task_id in sorted(task_catalog.get_golden_sequences(golden_path), key=lambda task_id: tuple(int(x) for x in task_id.split("-"))):
+        by_type.setdefault(task_id.split("-")[0], []).append(task_id)
+    task_ids = []
+    while len(task_ids) < num_tasks and any(by_type.values()):
+        for task_type in sorted(by_type):
+            if by_type[task_type] and len(task_ids) < num_tasks:
+                task_ids.append(by_type[task_type].pop(0))
+    return task_ids
+
+def _is_flag(value):
+    # bool / int / numpy.bool_ 都可以；None、字符串、列表（比如直接把 env.step 的 batch 结果返回）都不行
+    return isinstance(value, numbers.Number) or type(value).__name__ == "bool_"
+
+def _short_traceback():
+    lines = traceback.format_exc().rstrip().split("\n")
+    return "\n".join(lines[-MAX_TRACEBACK_LINES:])
+
+def replay_task(task_id, interface_source, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    Replays the golden actions of one task through the interface.
+    Returns {"task_id", "passed", "steps", "error", "raised", "coverage"}; `error` names the first violation,
+    `raised` tells whether it was the interface itself failing (not loading, raising, exceeding its time / memory
+    limit) rather than a wrong return value, and `coverage` is the list of interface branches the replay reached
+    (None unless COVERAGE_SELECTION).
+    """
+    result = {"task_id": task_id, "passed": False, "steps": 0, "error": None, "raised": False, "coverage": None}
+    interface = load_interface(interface_source)
+    if interface.InferRules is None or interface.WrapStep is None:
+        result["error"] = f"interface does not load: {' '.join(interface.diagnostics)}"
+        result["raised"] = True
+        return result
+    coverage = CoverageRecorder(interface.WrapStep)
+    try:
+        return _replay(task_id, interface, golden_path, result, coverage)
+    finally:
+        if coverage.enabled:
+            result["coverage"] = coverage.branches()
+
+def _replay(task_id, interface, golden_path, result, coverage):
+    golden_steps = parse_golden_sequence(task_catalog.get_golden_sequences(golden_path)[task_id])
+    task_type_idx, task_idx = (int(x) for x in task_id.split("-"))
+    env, obs, _ = build_env(task_type_idx, task_idx)
+    obs = '\n'.join(obs[0].split('\n\n')[1:])
+    task = obs.split('\n')[1].strip()
+    init_obs = obs.split('\n')[0].strip()
+
+    try:
+        with coverage:
+            rules = call_interface(interface.InferRules, init_obs, task)
+    except InterfaceViolation as e:
+        result["error"], result["raised"] = str(e), True
+        return result
+    except Exception:
+        result["error"], result["raised"] = f"InferRules raised:\n{_short_traceback()}", True
+        return result
+    if not isinstance(rules, str):
+        result["error"] = f"InferRules returned {type(rules).__name__}, expected str"
+        return result
+
+    # 不注册到 logging 的全局表中；WrapStep 的调试输出这里不需要
+    function_logger = logging.Logger(f"replay_logger_{task_id}")
+    function_logger.addHandler(logging.StreamHandler(io.StringIO()))
+    function_logger.propagate = False
+
+    for i, (action, gold_reward, gold_done) in enumerate(golden_steps):
+        step = f"step {i + 1} ({action!r})"
+        try:
+            with coverage:
+                returned = call_interface(interface.WrapStep, env, init_obs, task, action, function_logger)
+        except InterfaceViolation as e:
+            result["error"], result["raised"] = f"{step}: {e}", True
+            return result
+        except Exception:
+            result["error"], result["raised"] = f"{step}: WrapStep raised:\n{_short_traceback()}", True
+            return result
+        result["steps"] = i + 1
+
+        if not isinstance(returned, tuple) or len(returned) != 3:
+            result["error"] = f"{step}: WrapStep returned {type(returned).__name__}, expected (obs, reward, done)"
+            return result
+        obs, reward, done = returned
+        if not isinstance(obs, str):
+            result["error"] = f"{step}: obs is {type(obs).__name__}, expected str"
+            return result
+        if not _is_flag(reward) or not _is_flag(done):
+            result["error"] = f"{step}: reward / done must be bool, got {type(reward).__name__} / {type(done).__name__}"
+            return result
+        if bool(reward) != gold_reward or bool(done) != gold_done:
+            result["error"] = f"{step}: reward={reward}, done={done} but the raw env gives reward={gold_reward}, done={gold_done} (obs: {obs[:200]!r})"
+            return result
+        if done:
+            break
+
+    result["passed"] = True
+    return result
+
+def _replay_task_safe(task_id, interface_source, golden_path):
+    try:
+        return replay_task(task_id, interface_source, golden_path)
+    except Exception:
+        # 环境构建等与接口无关的错误也记成失败，不让整个报告中断
+        return {"task_id": task_id, "passed": False, "steps": 0, "error": f"replay harness error:\n{_short_traceback()}", "raised": False, "coverage": None}
+
+def replay_golden(interface_source, task_ids=None, num_workers=REPLAY_WORKERS, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    Replays golden sequences through the interface in a fork-started process pool.
+    Returns {"passed", "num_tasks", "failures": [result], "seconds"}; passes trivially when the golden store is empty.
+    """
+    return replay_golden_many([interface_source], task_ids, num_workers, golden_path)[0]
+
+def _run_replay_jobs(jobs, num_workers, golden_path):
+    """
+    [result] for [(interface_source, task_id)] jobs, run in one fork-started process pool.
+    """
+    num_workers = min(len(jobs), num_workers)
+    if num_workers <= 1 or not can_fork():
+        return [_replay_task_safe(task_id, source, golden_path) for source, task_id in jobs]
+    results = [None] * len(jobs)
+    watched = run_watched(_replay_task_safe, {i: (task_id, source, golden_path) for i, (source, task_id) in enumerate(jobs)}, num_workers,
+                          timeout=REPLAY_TASK_TIMEOUT, initializer=limit_memory, mp_context=multiprocessing.get_context("fork"))
+    for i, result, error in watched:
+        if error is not None:
+            # 超时被杀（例如卡在正则的 C 调用里）或 worker 崩溃，都算接口本身出错
+            result = {"task_id": jobs[i][1], "passed": False, "steps": 0, "error": f"{type(error).__name__}: {error}", "raised": True, "coverage": None}
+        results[i] = result
+    return results
+
+def replay_golden_many(interface_sources, task_ids=None, num_workers=REPLAY_WORKERS, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    `replay_golden` for several interfaces at once: all (interface, task) pairs share one process pool.
+    Returns one report per interface; `seconds` is the wall time of the whole batch.
+    """
+    start = time.time()
+    task_catalog.preload(["train"])
+    if task_ids is None:
+        task_ids = select_task_ids(golden_path=golden_path)
+    results = _run_replay_jobs([(source, task_id) for source in interface_sources for task_id in task_ids], num_workers, golden_path)
+
+    seconds = time.time() - start
+    reports = []
+    for i in range(len(interface_sources)):
+        failures = [result for result in results[i * len(task_ids):(i + 1) * len(task_ids)] if not result["passed"]]
+        reports.append({"passed": not failures, "num_tasks": len(task_ids), "replayed": len(task_ids), "failures": failures, "seconds": seconds})
+    return reports
+
+# 当前接口（被修改的基线）在每个回放任务上的结果与覆盖率，(接口 hash, golden 文件, task_id) -> result
+_baseline_results = {}
+
+def replay_baseline(base_source, task_ids, num_workers=REPLAY_WORKERS, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    {task_id: result} of the current interface, replayed once per (interface, golden file, task) and cached.
+    """
+    base_hash = hash_interface_source(base_source)
+    missing = [task_id for task_id in task_ids if (base_hash, golden_path, task_id) not in _baseline_results]
+    for result in _run_replay_jobs([(base_source, task_id) for task_id in missing], num_workers, golden_path):
+        _baseline_results[(base_hash, golden_path, result["task_id"])] = result
+    return {task_id: _baseline_results[(base_hash, golden_path, task_id)] for task_id in task_ids}
+
+def replay_candidates(base_source, interface_sources, task_ids=None, num_workers=REPLAY_WORKERS, golden_path=task_catalog.GOLDEN_ACTION_OBS_PATH):
+    """
+    Golden replay of patched versions of `base_source`, judged on regressions: a candidate fails a task if the
+    current interface passes it and the candidate does not, or if the candidate raises (or times out) on a task
+    where the current interface did not. Other failures on tasks the current interface already fails are reported
+    as pre-existing failures (or as fixed) but do not fail the candidate.
+    With COVERAGE_SELECTION (and not COVERAGE_FULL_RUN), a candidate is only replayed on the tasks whose replay under
+    `base_source` reached a branch the candidate changed; on the other tasks it behaves exactly like the base.
+    Returns one report per candidate: {"passed", "num_tasks", "num_passing", "replayed", "failures": regressions,
+    "exceptions": new exceptions on already failing tasks, "preexisting_failures", "fixed", "seconds"}.
+    """
+    start = time.time()
+    task_catalog.preload(["train"])
+    if task_ids is None:
+        task_ids = select_task_ids(golden_path=golden_path)
+    baseline = replay_baseline(base_source, task_ids, num_workers, golden_path)
+
+    select = COVERAGE_SELECTION and not COVERAGE_FULL_RUN
+    jobs, selections = [], []
+    for source in interface_sources:
+        changed = changed_branches(base_source, source) if select else None
+        selected = [task_id for task_id in task_ids if affects(baseline[task_id]["coverage"], changed)]
+        jobs.extend((source, task_id) for task_id in selected)
+        selections.append(selected)
+    results = iter(_run_replay_jobs(jobs, num_workers, golden_path))
+
+    seconds = time.time() - start
+    reports = []
+    for selected in selections:
+        replayed = {task_id: next(results) for task_id in selected}
+        regressions, exceptions, preexisting, fixed, num_passing = [], [], [], 0, 0
+        for task_id in task_ids:
+            result = replayed.get(task_id, baseline[task_id])
+            num_passing += result["passed"]
+            if baseline[task_id]["passed"] and not result["passed"]:
+                regressions.append(result)
+            elif not baseline[task_id]["passed"]:
+                if result["passed"]:
+                    fixed += 1
+                elif result.get("raised") and not baseline[task_id].get("raised"):
+                    # 当前接口在这里只是结果不对，候选直接抛异常：同样拒绝
+                    exceptions.append(result)
+                else:
+                    preexisting.append(result)
+        reports.append({"passed": not regressions and not exceptions, "num_tasks": len(task_ids), "num_passing": num_passing, "replayed": len(selected),
+                        "failures": regressions, "exceptions": exceptions, "preexisting_failures": preexisting, "fixed": fixed, "seconds": seconds})
+    return reports
+
+def format_report(report, max_failures=5):
+    if report["num_tasks"] == 0:
+        return "Golden replay: no golden sequences available, nothing replayed."
+    status = "PASSED" if report["passed"] else "FAILED"
+    text = f"Golden replay {status}: {report['num_tasks'] - len(report['failures'])}/{report['num_tasks']} tasks passed in {report['seconds']:.1f}s."
+    if "preexisting_failures" in report:
+        # 与当前接口对比的报告：只有回归（当前接口能过、候选过不了）才算失败
+        text = (f"Golden replay {status}: {len(report['failures'])} regressions, {len(report['exceptions'])} new exceptions, "
+                f"{report['num_passing']}/{report['num_tasks']} tasks passed in {report['seconds']:.1f}s "
+                f"({len(report['preexisting_failures'])} already failing under the current interface, {report['fixed']} fixed).")
+    if report.get("replayed", report["num_tasks"]) < report["num_tasks"]:
+        text += f" ({report['replayed']} replayed; the others do not reach the changed code.)"
+    failures = report["failures"] + report.get("exceptions", [])
+    for failure in failures[:max_failures]:
+        text += f"\n- Task {failure['task_id']}: {failure['error']}"
+    if len(failures) > max_failures:
+        text += f"\n- ... and {len(failures) - max_failures} more failed tasks"
+    return text
@@ -0,0 +1,197 @@
+import concurrent.futures
+import contextlib
+import ctypes
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+# LLM 生成的接口代码的执行限制：每次调用 InferRules / WrapStep 有墙钟时间上限，worker 进程有地址空间上限。
+# 超限记为 InterfaceViolation，由调用方当作失败的一步处理，而不是让 worker 卡死、拖住整轮的 as_completed。
+# 信号只能打断 Python 代码，卡在单个 C 调用里（比如灾难性回溯的正则）的 worker 由 run_watched 在进程层面杀掉
+INTERFACE_CALL_TIMEOUT = float(os.getenv("INTERFACE_CALL_TIMEOUT", 30))  # 秒，0 表示不限制
+INTERFACE_MEMORY_LIMIT_MB = int(os.getenv("INTERFACE_MEMORY_LIMIT_MB", 8192))  # 0 表示不限制
+# 进程池里单个任务（一整个 episode）的墙钟上限，超过就杀掉它的 worker 进程
+INTERFACE_TASK_TIMEOUT = float(os.getenv("INTERFACE_TASK_TIMEOUT", 3600))  # 秒，0 表示不限制
+# 同一个任务所在的 worker 进程意外退出（OOM kill、段错误）超过这么多次就记为失败，不再重新提交
+MAX_WORKER_CRASHES = 2
+
+class InterfaceTimeout(BaseException):
+    # 继承 BaseException：生成的代码里常见的 `except Exception` 吞不掉它
+    pass
+
+class InterfaceViolation(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise InterfaceTimeout()
+
+def _inject_timeout(thread_id):
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(InterfaceTimeout))
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """
+    Raises InterfaceTimeout in the current thread once `seconds` of wall time have passed. The main thread uses
+    SIGALRM; other threads (e.g. concurrent analyses) get the exception injected by a watchdog timer. Both only
+    interrupt Python code, not a single long-running C call.
+    """
+    if not seconds:
+        yield
+        return
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, "setitimer"):
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        return
+
+    lock = threading.Lock()
+    active = [True]
+    thread_id = threading.get_ident()
+    def fire():
+        with lock:
+            if active[0]:
+                _inject_timeout(thread_id)
+    watchdog = threading.Timer(seconds, fire)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        yield
+    finally:
+        with lock:
+            active[0] = False
+        watchdog.cancel()
+
+def call_interface(function, *args, timeout=None):
+    """
+    `function(*args)` under the per-call time limit. Timeouts and memory / recursion exhaustion are raised as
+    InterfaceViolation; other exceptions from the interface propagate unchanged.
+    """
+    timeout = INTERFACE_CALL_TIMEOUT if timeout is None else timeout
+    name = getattr(function, "__name__", "interface function")
+    try:
+        with time_limit(timeout):
+            return function(*args)
+    except InterfaceTimeout:
+        raise InterfaceViolation(f"`{name}` exceeded the {timeout:g}s time limit")
+    except MemoryError:
+        raise InterfaceViolation(f"`{name}` exceeded the memory limit of {INTERFACE_MEMORY_LIMIT_MB} MB")
+    except RecursionError:
+        raise InterfaceViolation(f"`{name}` exceeded the maximum recursion depth")
+
+def limit_memory(limit_mb=None):
+    """
+    Caps the address space of the current process (RLIMIT_AS); meant for pool worker initializers.
+    """
+    limit_mb = INTERFACE_MEMORY_LIMIT_MB if limit_mb is None else limit_mb
+    if not limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+class TaskTimeout(Exception):
+    pass
+
+class WorkerCrashed(Exception):
+    pass
+
+def _watched_call(started, key, function, args):
+    started[key] = (os.getpid(), time.time())
+    try:
+        return function(*args)
+    finally:
+        started.pop(key, None)
+
+def _crashed_keys(executor, started):
+    """
+    Keys of the jobs whose worker process exited on its own (crash, OOM kill); workers the broken pool terminated
+    itself exit with SIGTERM or are still alive. Without access to the pool's processes every running job is suspect.
+    """
+    processes = getattr(executor, "_processes", None)
+    crashed = set()
+    for key, (pid, _) in list(started.items()):
+        process = processes.get(pid) if processes is not None else None
+        if process is None or process.exitcode not in (None, -signal.SIGTERM):
+            crashed.add(key)
+    return crashed
+
+def can_fork():
+    """
+    Whether a fork-started process pool may be used here: only from the main thread. A thread of a multithreaded
+    process (e.g. one of the concurrent analyses) could fork while another thread holds a logging / queue / LLM client
+    lock, and the child would inherit that lock held forever; such callers run their jobs in-process instead.
+    """
+    return "fork" in multiprocessing.get_all_start_methods() and threading.current_thread() is threading.main_thread()
+
+def run_watched(function, jobs, max_workers, timeout=None, initializer=None, initargs=(), mp_context=None, poll_interval=1.0):
+    """
+    Runs `function(*args)` for every `key: args` in `jobs` in a process pool and yields (key, result, error) as jobs
+    finish; `error` is the exception raised by the job, or None. A job running longer than `timeout` seconds gets its
+    worker process SIGKILLed (this also stops a C call that never returns) and is reported with TaskTimeout. A killed
+    or crashed worker breaks the whole pool, so the pool is rebuilt and the other unfinished jobs are resubmitted;
+    a job whose worker died MAX_WORKER_CRASHES times is reported with WorkerCrashed.
+    """
+    timeout = INTERFACE_TASK_TIMEOUT if timeout is None else timeout
+    remaining = dict(jobs)
+    crashes = {}
+    # Manager 的服务进程与池子用同一种启动方式
+    with (mp_context or multiprocessing).Manager() as manager:
+        # key -> (worker pid, 开始时间)，由 worker 自己登记；父进程据此找到超时任务所在的进程
+        started = manager.dict()
+        while remaining:
+            started.clear()
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(remaining))), mp_context=mp_context, initializer=initializer, initargs=initargs)
+            futures = {executor.submit(_watched_call, started, key, function, args): key for key, args in remaining.items()}
+            killed = set()
+            crashed = None
+            try:
+                pending = set(futures)
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        key = futures[future]
+                        if key in killed:
+                            del remaining[key]
+                            yield key, None, TaskTimeout(f"task exceeded the {timeout:g}s time limit; its worker process was killed")
+                            continue
+                        try:
+                            result = future.result()
+                        except concurrent.futures.process.BrokenProcessPool:
+                            # 池子坏了：进程自己退出的那个任务记一次崩溃，其余的（被连带终止的）到新池子里重跑
+                            if crashed is None:
+                                crashed = _crashed_keys(executor, started)
+                            if key in crashed and not killed:
+                                crashes[key] = crashes.get(key, 0) + 1
+                                if crashes[key] >= MAX_WORKER_CRASHES:
+                                    del remaining[key]
+                                    yield key, None, WorkerCrashed(f"the worker process died {crashes[key]} times while running this task")
+                            continue
+                        except Exception as e:
+                            del remaining[key]
+                            yield key, None, e
+                            continue
+                        del remaining[key]
+                        yield key, result, None
+                    if timeout and not killed:
+                        now = time.time()
+                        for key, (pid, start) in list(started.items()):
+                            if now - start > timeout:
+                                killed.add(key)
+                                try:
+                                    os.kill(pid, signal.SIGKILL)
+                                except ProcessLookupError:
+                                    pass
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,227 @@
+import json
+import math
+import os
+import random
+from statistics import NormalDist
+
+from tqdm import tqdm
+
+from experiment_vanilla import (
+    MAX_WORKERS,
+    VLLM_CONFIG,
+    build_task_list,
+    failed_task_result,
+    is_scored,
+    load_interface_module,
+    read_interface_source,
+    run_single_task_from_source,
+    save_and_print_results,
+)
+from sandbox import limit_memory, run_watched
+
+# 顺序评估：按任务类型分层随机抽样，置信区间足够窄（或两个 interface 已可区分）时提前停止
+# 每批的任务数；批越小看得越勤、能省下的 rollout 越多，但每批内并行度也越低
+SEQUENTIAL_BATCH_SIZE = int(os.getenv("SEQUENTIAL_BATCH_SIZE", 16))
+
+def stratified_order(all_tasks, seed=0):
+    """
+    Shuffles tasks within each task type and interleaves the types so that every prefix of the
+    returned list is (close to) proportionally stratified over the full split.
+    """
+    rng = random.Random(seed)
+    by_type = {}
+    for task_info in all_tasks:
+        by_type.setdefault(task_info[0], []).append(task_info)
+    for tasks in by_type.values():
+        rng.shuffle(tasks)
+
+    total = len(all_tasks)
+    taken = {task_type_idx: 0 for task_type_idx in by_type}
+    ordered = []
+    for _ in range(total):
+        # 选择当前"欠采样"最多的类型：已取比例 / 应取比例 最小
+        task_type_idx = min(
+            (t for t in by_type if taken[t] < len(by_type[t])),
+            key=lambda t: ((taken[t] + 1) / len(by_type[t]), t),
+        )
+        ordered.append(by_type[task_type_idx][taken[task_type_idx]])
+        taken[task_type_idx] += 1
+    return ordered
+
+def wilson_interval(successes, n, z):
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+def stratified_mean_interval(values_by_type, weights, z, value_range=(0.0, 1.0)):
+    """
+    Stratified estimate of the split-level mean. `values_by_type` maps task type -> observed values
+    (scores in [0, 1], or paired differences in [-1, 1]); `weights` maps task type -> share of the split.
+    Per-type variances add z^2 pseudo-observations split between the ends of the value range
+    (Agresti-Coull style), so all-0 / all-1 / all-tied strata are not treated as certain.
+    """
+    mean, variance = 0.0, 0.0
+    for task_type_idx, weight in weights.items():
+        values = values_by_type.get(task_type_idx, [])
+        n = len(values)
+        if n == 0:
+            return None, (None, None)
+        low, high = value_range
+        pseudo = z * z
+        augmented_n = n + pseudo
+        augmented_mean = (sum(values) + pseudo * (low + high) / 2) / augmented_n
+        augmented_sq = (sum(v * v for v in values) + pseudo * (low * low + high * high) / 2) / augmented_n
+        type_mean = sum(values) / n
+        type_var = max(augmented_sq - augmented_mean ** 2, 0.0) / n
+        mean += weight * type_mean
+        variance += weight * weight * type_var
+    half = z * math.sqrt(variance)
+    return mean, (mean - half, mean + half)
+
+def run_sequential_evaluation(split, interface_module_names, logger_base_dir, precision=0.05, confidence=0.95,
+                              batch_size=SEQUENTIAL_BATCH_SIZE, min_tasks_per_type=2, task_type_list=[0,1,2,3,4,5], seed=0,
+                              max_workers=MAX_WORKERS):
+    """
+    interface_module_names: one module (estimate its score to +-precision) or two modules (paired mode:
+    stop as soon as the score difference is statistically non-zero, or pinned within +-precision of zero).
+
+    Intervals are only checked after each batch of `batch_size` tasks (each batch runs concurrently, on up to
+    `max_workers` workers); the per-look confidence is Bonferroni-adjusted by the number of batch ends at which the
+    stopping rule can be tested, so it stays conservative despite repeated testing. Tasks that hit an
+    infrastructure error (see failed_task_result) are left out of the intervals and counted separately.
+    """
+    if isinstance(interface_module_names, str):
+        interface_module_names = [interface_module_names]
+    if len(interface_module_names) not in (1, 2):
+        raise ValueError("interface_module_names must contain one or two modules")
+    paired = len(interface_module_names) == 2
+
+    # 先在主进程校验；worker 收到的是源码，经 interface_cache 加载
+    for name in interface_module_names:
+        load_interface_module(name)
+    interfaces = [read_interface_source(name) for name in interface_module_names]
+    all_tasks = stratified_order(build_task_list(split, task_type_list=task_type_list), seed=seed)
+    weights = {}
+    for task_info in all_tasks:
+        weights[task_info[0]] = weights.get(task_info[0], 0) + 1 / len(all_tasks)
+
+    max_looks = count_looks(all_tasks, batch_size, weights, min_tasks_per_type)
+    alpha = (1 - confidence) / max(1, max_looks)
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+
+    arm_dirs = [f"{logger_base_dir}/{name}" for name in interface_module_names] if paired else [logger_base_dir]
+    for arm_dir in arm_dirs:
+        os.makedirs(arm_dir, exist_ok=True)
+
+    results_by_arm = [{i: {split: []} for i in range(6)} for _ in interfaces]
+    scores_by_arm = [{} for _ in interfaces]
+    history = []
+    stop_reason = "split exhausted"
+    position = 0
+    pbar = tqdm(total=len(all_tasks), desc="Sequential evaluation")
+
+    while position < len(all_tasks):
+        batch = all_tasks[position:position + batch_size]
+        position += len(batch)
+
+        jobs = {}
+        for i, task_info in enumerate(batch):
+            for arm, interface_source in enumerate(interfaces):
+                task_logger_file_path = f"{arm_dirs[arm]}/task_{split}_{task_info[0]}_{task_info[1]}.log"
+                jobs[(arm, i)] = (split, None, task_info, interface_source, arm_dirs[arm], task_logger_file_path, i % len(VLLM_CONFIG))
+
+        for (arm, i), result, error in run_watched(run_single_task_from_source, jobs, max_workers, initializer=limit_memory):
+            task_info = batch[i]
+            task_type_idx, task_idx = task_info[0], task_info[1]
+            if error is not None:
+                print(f"Task {task_type_idx}-{task_idx} failed: {type(error).__name__}: {error}")
+                result = failed_task_result(task_info[2], error)
+            with open(f"{arm_dirs[arm]}/task_{split}_{task_type_idx}_{task_idx}.json", "w") as f:
+                json.dump(result, f, indent=2)
+            results_by_arm[arm][task_type_idx][split].append(result)
+            if is_scored(result):
+                scores_by_arm[arm][(task_type_idx, task_idx)] = result["score"]
+        pbar.update(len(batch))
+
+        summary = summarize(all_tasks[:position], scores_by_arm, weights, z, paired)
+        history.append(summary)
+        print(json.dumps(summary["overall"]))
+
+        enough = has_enough_per_type({t: summary["per_type"][str(t)]["n"] for t in weights}, weights, len(all_tasks), min_tasks_per_type)
+        if not enough or summary["overall"]["mean"] is None:
+            continue
+        low, high = summary["overall"]["interval"]
+        if paired and (low > 0 or high < 0):
+            stop_reason = "interfaces are distinguishable"
+            break
+        if (high - low) / 2 <= precision:
+            stop_reason = "interval within requested precision"
+            break
+    pbar.close()
+
+    print(f"Stopped after {position}/{len(all_tasks)} tasks: {stop_reason}")
+    for arm, arm_dir in enumerate(arm_dirs):
+        save_and_print_results(results_by_arm[arm], split, arm_dir)
+    report = {
+        "interface_modules": interface_module_names,
+        "precision": precision,
+        "confidence": confidence,
+        "per_look_z": z,
+        "max_looks": max_looks,
+        "tasks_run": position,
+        "tasks_total": len(all_tasks),
+        "stop_reason": stop_reason,
+        "final": history[-1] if history else None,
+        "history": history,
+    }
+    with open(f"{logger_base_dir}/sequential_eval.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def has_enough_per_type(counts, weights, num_tasks, min_tasks_per_type):
+    return all(counts.get(t, 0) >= min(min_tasks_per_type, weights[t] * num_tasks) for t in weights)
+
+def count_looks(all_tasks, batch_size, weights, min_tasks_per_type):
+    """
+    Number of batch ends at which the stopping rule is tested (enough tasks of every type have run by then).
+    """
+    looks, counts = 0, {}
+    for position, task_info in enumerate(all_tasks, start=1):
+        counts[task_info[0]] = counts.get(task_info[0], 0) + 1
+        if (position % batch_size == 0 or position == len(all_tasks)) and has_enough_per_type(counts, weights, len(all_tasks), min_tasks_per_type):
+            looks += 1
+    return looks
+
+def summarize(tasks_run, scores_by_arm, weights, z, paired):
+    values_by_type = {}
+    errors = 0
+    for task_type_idx, task_idx, *_ in tasks_run:
+        key = (task_type_idx, task_idx)
+        if any(key not in scores for scores in scores_by_arm):
+            # 基础设施错误（沙箱 / worker）的任务不计入区间
+            errors += 1
+            continue
+        if paired:
+            value = scores_by_arm[1][key] - scores_by_arm[0][key]
+        else:
+            value = scores_by_arm[0][key]
+        values_by_type.setdefault(task_type_idx, []).append(value)
+
+    per_type = {}
+    for task_type_idx in weights:
+        values = values_by_type.get(task_type_idx, [])
+        if paired:
+            _, interval = stratified_mean_interval({task_type_idx: values}, {task_type_idx: 1.0}, z, (-1.0, 1.0))
+        else:
+            interval = wilson_interval(sum(values), len(values), z)
+        per_type[str(task_type_idx)] = {
+            "n": len(values),
+            "mean": sum(values) / len(values) if values else None,
+            "interval": interval,
+        }
+    mean, interval = stratified_mean_interval(values_by_type, weights, z, (-1.0, 1.0) if paired else (0.0, 1.0))
+    return {"overall": {"n": len(tasks_run) - errors, "mean": mean, "interval": interval}, "errors": errors, "per_type": per_type}
@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+# 结构化输出：STRUCTURED_OUTPUT=1 时用 JSON schema 约束解码（Ollama 通过 response_format 支持），
+# 回复一定能解析；关闭时沿用 XML 标签格式。两种格式都由同一个按 schema 驱动的 parse_reply 解析，
+# schema 的字段名就是原来的标签名
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "0") == "1"
+
+def _schema(name, properties, required):
+    # 解码时要求输出全部字段（不用的给空字符串）；`required_fields` 是解析时必须非空的字段
+    return {
+        "name": name,
+        "schema": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+        "required_fields": required,
+    }
+
+_STRING = {"type": "string"}
+
+ANALYSIS_VERDICT_SCHEMA = _schema("analysis_verdict", {
+    "thought": _STRING,
+    "analysis_result": {"type": "string", "enum": ["No Misalignment", "Found Misalignment"]},
+    "environment_logic_and_misalignments": _STRING,
+}, ["analysis_result"])
+
+ANALYSIS_SIMULATION_SCHEMA = _schema("analysis_simulation_step", {
+    "thought": _STRING,
+    "action": _STRING,
+    "environment_logic_and_misalignments": _STRING,
+}, [])
+
+OPTIMIZATION_CODE_SCHEMA = _schema("optimization_code", {
+    "thought": _STRING,
+    "code": _STRING,
+}, ["code"])
+
+OPTIMIZATION_SIMULATION_SCHEMA = _schema("optimization_simulation_step", {
+    "thought": _STRING,
+    "action": _STRING,
+    "if_need_refine": {"type": "string", "enum": ["", "True", "False"]},
+    "refine_strategy": _STRING,
+}, [])
+
+def response_format(schema):
+    """
+    `response_format` argument for call_llm, or None when structured output is disabled.
+    """
+    if not STRUCTURED_OUTPUT:
+        return None
+    return {"type": "json_schema", "json_schema": {"name": schema["name"], "schema": schema["schema"]}}
+
+def format_instructions(schema):
+    """
+    Appended to a prompt in structured mode: the reply is a JSON object keyed by the tag names the prompt describes.
+    """
+    if not STRUCTURED_OUTPUT:
+        return ""
+    fields = ", ".join(f'"{name}"' for name in schema["schema"]["properties"])
+    return (f"\n\nOutput format override: reply with a single JSON object instead of XML tags. Its keys are the tag "
+            f"names described above ({fields}); put what you would have written inside each tag into the value of "
+            f"that key, and use an empty string for tags you would not output.")
+
+def _parse_json(response):
+    text = response.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def parse_reply(response, schema):
+    """
+    Returns ({field: str}, error). Reads a JSON object when the reply is one, otherwise `<field>...</field>` tags.
+    Missing optional fields are "", enum values are checked, `error` is None when the reply matches the schema.
+    """
+    properties = schema["schema"]["properties"]
+    data = _parse_json(response)
+    fields = {}
+    for name in properties:
+        if data is not None:
+            value = data.get(name, "")
+        else:
+            match = re.search(rf"<{name}>(.*?)</{name}>", response, flags=re.DOTALL)
+            value = match.group(1) if match else ""
+        fields[name] = str(value).strip() if value is not None else ""
+
+    for name in schema["required_fields"]:
+        if not fields[name]:
+            return fields, f"missing <{name}>"
+    for name, spec in properties.items():
+        if "enum" in spec and fields[name] not in spec["enum"]:
+            return fields, f"invalid <{name}>: {fields[name]!r}"
+    return fields, None
+
+class FormatStats:
+    """
+    Counts replies and format errors (i.e. retries caused by unparseable replies) per agent.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.replies = Counter()
+        self.errors = Counter()
+
+    def record(self, agent, error):
+        with self._lock:
+            self.replies[agent] += 1
+            if error:
+                self.errors[agent] += 1
+
+    def report(self):
+        with self._lock:
+            mode = "structured" if STRUCTURED_OUTPUT else "tagged"
+            parts = [f"{agent}: {self.errors[agent]}/{self.replies[agent]} format errors" for agent in sorted(self.replies)]
+            return f"[{mode} output] " + ("; ".join(parts) if parts else "no replies")
+
+format_stats = FormatStats()
@@ -0,0 +1,69 @@
+import json
+import os
+
+import yaml
+
+# 进程内的任务目录：file_names_{split}.json / base_config.yaml / golden_action_obs.json 只读一次，
+# 文件 mtime 变了才重新加载；worker 用 fork 启动时直接继承父进程已加载的内容，不再随每个任务 pickle 配置
+ALFWORLD_CONFIG_PATH = "alfworld/alfworld/configs/base_config.yaml"
+FILE_NAMES_PATH = "alfworld/file_names_{split}.json"
+GOLDEN_ACTION_OBS_PATH = "alfworld/golden_action_obs.json"
+
+_memo = {}
+
+def _load(path, loader):
+    """
+    Returns `loader(path)`, re-running it only when the file's mtime changed since the last call.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _memo.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, loader(path))
+        _memo[path] = cached
+    return cached[1]
+
+def _load_yaml(path):
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+def _load_file_names(path):
+    with open(path, "r") as f:
+        # 元组而不是列表：只读、fork 出来的 worker 共享同一份
+        return tuple(tuple(file_names) for file_names in json.load(f))
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def get_golden_sequences(golden_path=GOLDEN_ACTION_OBS_PATH):
+    """
+    task_id -> full golden action/observation sequence. Tasks without an expert solution are left out.
+    """
+    return {task_id: sequence for task_id, sequence in _load(golden_path, _load_json).items()
+            if sequence and sequence[0].startswith("Task: ")}
+
+def get_alfworld_config():
+    """
+    The parsed base_config.yaml. Shared by all callers; do not modify it in place.
+    """
+    return _load(ALFWORLD_CONFIG_PATH, _load_yaml)
+
+def get_file_names(split):
+    """
+    `file_names[task_type_idx][task_idx]` -> game file for `split`.
+    """
+    return _load(FILE_NAMES_PATH.format(split=split), _load_file_names)
+
+def num_tasks_by_type(split):
+    return [len(file_names) for file_names in get_file_names(split)]
+
+def get_game_file(split, task_type_idx, task_idx):
+    return get_file_names(split)[task_type_idx][task_idx]
+
+def preload(splits=("train",)):
+    """
+    Loads everything up front, e.g. before starting a process pool so forked workers inherit it.
+    """
+    get_alfworld_config()
+    for split in splits:
+        get_file_names(split)
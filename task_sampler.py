@@ -0,0 +1,79 @@
+import json
+import os
+import random
+
+from failure_clustering import compute_signature
+
+# 训练 turn 的任务采样：把一部分预算留给最近失败或从未跑过的任务，而不是均匀随机抽样
+
+class TaskSampler:
+    def __init__(self, history_path, failure_fraction=0.5, seed=None):
+        self.history_path = history_path
+        self.failure_fraction = failure_fraction
+        self.rng = random.Random(seed)
+        self.history = {}
+        if os.path.exists(history_path):
+            with open(history_path, "r", encoding="utf-8") as f:
+                self.history = json.load(f)
+
+    def save(self):
+        tmp_path = f"{self.history_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.history, f, indent=2)
+        os.replace(tmp_path, self.history_path)
+
+    def sample(self, num_tasks_by_type, task_type_list, _slice, interface_hash):
+        """
+        Returns {task_type_idx: [task_idx, ...]} with `_slice` tasks per type. A `failure_fraction` share of
+        each type's budget goes to focus tasks, in this priority order:
+          1. tasks that failed under a different interface version (the interface changed since),
+          2. tasks never run in this experiment,
+          3. tasks that failed under the current interface.
+        The rest of the budget is sampled uniformly from the remaining tasks, so solved tasks are still
+        re-checked for regressions.
+        """
+        task_indices = {}
+        for task_type_idx in task_type_list:
+            all_idx = list(range(num_tasks_by_type[task_type_idx]))
+            budget = min(_slice, len(all_idx))
+            num_focus = int(round(budget * self.failure_fraction))
+
+            changed_failures, unseen, same_failures = [], [], []
+            for task_idx in all_idx:
+                entry = self.history.get(f"{task_type_idx}-{task_idx}")
+                if entry is None:
+                    unseen.append(task_idx)
+                elif entry["score"] == 0:
+                    if entry["interface_hash"] != interface_hash:
+                        changed_failures.append(task_idx)
+                    else:
+                        same_failures.append(task_idx)
+
+            chosen = []
+            for pool in (changed_failures, unseen, same_failures):
+                self.rng.shuffle(pool)
+                chosen.extend(pool[:num_focus - len(chosen)])
+                if len(chosen) >= num_focus:
+                    break
+            chosen_set = set(chosen)
+            rest = [task_idx for task_idx in all_idx if task_idx not in chosen_set]
+            chosen.extend(self.rng.sample(rest, budget - len(chosen)))
+            task_indices[task_type_idx] = sorted(chosen)
+        return task_indices
+
+    def update(self, env_logging, interface_hash, turn):
+        """
+        env_logging: the parsed per-task entries of a turn ({"task_id", "score", "logging", ...}).
+        """
+        for env_log in env_logging:
+            previous = self.history.get(env_log["task_id"], {})
+            # 续跑同一个 turn 时不重复计数
+            runs = previous.get("runs", 0) + (0 if previous.get("turn") == turn else 1)
+            self.history[env_log["task_id"]] = {
+                "score": env_log["score"],
+                "failure_signature": None if env_log["score"] == 1 else compute_signature(env_log),
+                "interface_hash": interface_hash,
+                "turn": turn,
+                "runs": runs,
+            }
+        self.save()
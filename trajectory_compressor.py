@@ -0,0 +1,151 @@
+import os
+from collections import namedtuple
+
+# 分析 prompt 里的轨迹压缩：连续重复的 action/observation 做游程编码，相同的 WrapStep 调试日志只保留一份，
+# 与 golden 序列一致的开头几步合并成一行（只合并开头的公共前缀，分叉之后即使再与 golden 一致也照常输出）；
+# 每个动作都标注原始步号，step_map 记录压缩后每一项对应的原始步号（从 1 开始），分析/优化时可按原始步号引用
+TRAJECTORY_COMPRESSION = os.getenv("TRAJECTORY_COMPRESSION", "1") != "0"
+MAX_LOOP_PERIOD = 3
+
+ACTION_PREFIX = "INFO - Agent Action: "
+OBSERVATION_PREFIX = "INFO - Observation: "
+REWARD_PREFIX = "INFO - Reward: "
+DONE_PREFIX = "INFO - Done: "
+DEBUG_PREFIX = "INFO - Log contents when executing `WrapStep`: "
+SEPARATOR = "INFO - ---------------------------------"
+
+COMPRESSION_NOTE = ("(Compressed log: `Steps i-j (xN)` means the same action/observation pattern repeated N times in a row, "
+                    "a WrapStep log identical to an earlier one is referenced instead of repeated, and leading steps "
+                    "identical to the golden sequence are summarized in one line. Every action is tagged with its original "
+                    "step number(s); refer to steps by these numbers.)")
+
+CompressedTrajectory = namedtuple("CompressedTrajectory", ["text", "step_map", "original_chars"])
+
+def parse_steps(logging_text):
+    """
+    Splits a task log into the header lines (task id, task description) and one dict per step with
+    `action`, `observation`, `reward`, `done` and `debug` (the WrapStep log, "" if none).
+    """
+    header, steps = [], []
+    field = None
+    for line in logging_text.split("\n"):
+        if line.startswith(ACTION_PREFIX):
+            steps.append({"action": line[len(ACTION_PREFIX):].strip(), "observation": "", "reward": "", "done": "", "debug": ""})
+            field = "action"
+        elif not steps:
+            header.append(line)
+        elif line.startswith(SEPARATOR):
+            field = None
+        elif field != "debug" and line.startswith(OBSERVATION_PREFIX):
+            steps[-1]["observation"] = line[len(OBSERVATION_PREFIX):]
+            field = "observation"
+        elif field != "debug" and line.startswith(REWARD_PREFIX):
+            steps[-1]["reward"] = line[len(REWARD_PREFIX):].strip()
+            field = None
+        elif field != "debug" and line.startswith(DONE_PREFIX):
+            steps[-1]["done"] = line[len(DONE_PREFIX):].strip()
+            field = None
+        elif line.startswith(DEBUG_PREFIX):
+            steps[-1]["debug"] = line[len(DEBUG_PREFIX):]
+            field = "debug"
+        elif field in ("observation", "debug"):
+            steps[-1][field] += "\n" + line
+    for step in steps:
+        step["observation"] = step["observation"].strip()
+        step["debug"] = step["debug"].strip()
+    return header, steps
+
+def parse_golden_steps(gold_action_obs_sequence):
+    """
+    [(action, observation)] from a golden sequence ("Agent Action: ..." / "Observation: ... | Reward: ... | Done: ...").
+    """
+    golden, action = [], None
+    for line in gold_action_obs_sequence or []:
+        if line.startswith("Agent Action: "):
+            action = line[len("Agent Action: "):].strip()
+        elif line.startswith("Observation: ") and action is not None:
+            golden.append((action, line[len("Observation: "):].split(" | Reward: ")[0].strip()))
+            action = None
+    return golden
+
+def _step_key(step):
+    return (step["action"], step["observation"], step["reward"], step["done"])
+
+def _find_loop(steps, start):
+    """
+    Returns (period, repeats) of the longest run of a repeated block of 1..MAX_LOOP_PERIOD steps starting at `start`.
+    """
+    best = (1, 1)
+    for period in range(1, MAX_LOOP_PERIOD + 1):
+        block = [_step_key(step) for step in steps[start:start + period]]
+        if len(block) < period:
+            break
+        repeats = 1
+        while [_step_key(step) for step in steps[start + repeats * period:start + (repeats + 1) * period]] == block:
+            repeats += 1
+        if repeats > 1 and repeats * period > best[0] * best[1]:
+            best = (period, repeats)
+    return best
+
+def _step_range(first, last):
+    return f"Step {first}" if first == last else f"Steps {first}-{last}"
+
+def compress_trajectory(logging_text, gold_action_obs_sequence=None):
+    header, steps = parse_steps(logging_text)
+    lines = [line for line in header if line.strip()]
+    lines.append(COMPRESSION_NOTE)
+    step_map = []
+
+    # 1. 开头与 golden 序列逐步一致的部分合并成一行
+    golden = parse_golden_steps(gold_action_obs_sequence)
+    matched = 0
+    while matched < min(len(steps), len(golden)) and (steps[matched]["action"], steps[matched]["observation"]) == golden[matched]:
+        matched += 1
+    position = 0
+    if matched >= 2:
+        actions = "; ".join(step["action"] for step in steps[:matched])
+        lines.append(f"{_step_range(1, matched)}: identical to golden steps 1-{matched} (actions and observations): {actions}")
+        step_map.append((_step_range(1, matched), list(range(1, matched + 1))))
+        position = matched
+
+    # 2. 其余步骤：重复的 1~3 步循环做游程编码，相同的调试日志只输出第一次
+    debug_first_seen = {}
+    while position < len(steps):
+        period, repeats = _find_loop(steps, position)
+        first, last = position + 1, position + period * repeats
+        label = _step_range(first, last) + (f" (x{repeats})" if repeats > 1 else "")
+        if period > 1 and repeats > 1:
+            label += f" [loop of {period} steps]"
+        lines.append(f"{label}:")
+        for offset, step in enumerate(steps[position:position + period]):
+            step_number = first + offset
+            numbers = [step_number + repeat * period for repeat in range(repeats)]
+            tag = f"step {numbers[0]}" if repeats == 1 else "steps " + ", ".join(str(number) for number in numbers)
+            lines.append(f"Agent Action ({tag}): {step['action']}")
+            lines.append(f"Observation: {step['observation']} | Reward: {step['reward']} | Done: {step['done']}")
+            if step["debug"]:
+                if step["debug"] in debug_first_seen:
+                    lines.append(f"Log contents when executing `WrapStep`: (same as step {debug_first_seen[step['debug']]})")
+                else:
+                    debug_first_seen[step["debug"]] = step_number
+                    lines.append(f"Log contents when executing `WrapStep`: {step['debug']}")
+        step_map.append((label, list(range(first, last + 1))))
+        position = last
+
+    text = "\n".join(lines)
+    return CompressedTrajectory(text, step_map, len(logging_text))
+
+def compress_for_prompt(logging_text, gold_action_obs_sequence=None):
+    """
+    (text, step_map) to put into an analysis prompt: the compressed trajectory unless TRAJECTORY_COMPRESSION=0 or
+    nothing was gained, in which case the raw log is returned with step_map None (its steps are already numbered
+    1..n in order). In the compressed text every action carries its original step number(s), and step_map lists
+    (label, [original step numbers]) per compressed entry. Golden elision only collapses the leading prefix shared
+    with the golden sequence; matching steps after the first divergence are kept.
+    """
+    if not TRAJECTORY_COMPRESSION:
+        return logging_text, None
+    compressed = compress_trajectory(logging_text, gold_action_obs_sequence)
+    if len(compressed.text) >= len(logging_text):
+        return logging_text, None
+    return compressed.text, compressed.step_map
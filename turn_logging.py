@@ -0,0 +1,55 @@
+import glob
+import os
+import re
+
+from log_writer import read_log_lines
+
+# 每个 turn 的任务日志合并与解析（原来直接写在 main.py 的循环里）
+
+def merge_task_logs(turn_dir, exp_logger_file):
+    # 遍历 turn_dir 目录下的所有 task_*.log 文件，将其合并到 exp_logger_file 中
+    # 搜索所有 task_*.log 文件；日志过大时写日志进程会把它轮转成 task_*.log.N.gz，这些分段也要按顺序读进来
+    task_log_files = set(glob.glob(os.path.join(turn_dir, "task_*.log")))
+    task_log_files.update(re.sub(r"\.\d+\.gz$", "", path) for path in glob.glob(os.path.join(turn_dir, "task_*.log.*.gz")))
+    
+    # 以追加方式打开 exp_logger_file，将所有 log 内容合并写入
+    with open(exp_logger_file, 'a', encoding='utf-8') as out_f:
+        for task_file in sorted(task_log_files):
+            for line in read_log_lines(task_file):
+                out_f.write(line)
+            out_f.write("\n")  # 添加换行符以分隔不同文件的内容
+
+def parse_exp_logging(all_logging, gold_action_obs):
+    """
+    all_logging: lines of the merged exp_logger.log.
+    Returns one {"task_id", "score", "logging", "gold_action_obs_sequence"} entry per task. A task's
+    logging is cut after the step where 5 of the last 6 observations were "Nothing happens.".
+    """
+    env_logging = []
+    nothing_happens_num = []
+    slice_len = -1
+    for line in all_logging:
+        if line.strip() == "":
+            continue
+        if "INFO - ==========" in line:
+            if slice_len != -1 and len(env_logging) > 0:
+                env_logging[-1]["logging"] = env_logging[-1]["logging"][:slice_len].strip()
+            env_logging.append({"score": 0, "logging": ""})
+            task_id = line.split("Task ID: ")[1].split(" ========")[0].strip()
+            env_logging[-1]["task_id"] = task_id
+            env_logging[-1]["gold_action_obs_sequence"] = gold_action_obs[task_id]
+            nothing_happens_num = []
+            slice_len = -1
+        elif "INFO - Reward:" in line:
+            env_logging[-1]["score"] = int(eval(line.split("Reward: ")[1].strip()))
+        elif "INFO - Observation:" in line:
+            if line.split("Observation: ")[1].strip() == "Nothing happens.":
+                nothing_happens_num.append(1)
+            else:
+                nothing_happens_num.append(0)
+            if len(nothing_happens_num) > 6:
+                nothing_happens_num = nothing_happens_num[-6:]
+        env_logging[-1]["logging"] += line
+        if len(nothing_happens_num) == 6 and sum(nothing_happens_num) > 4 and "INFO - Done:" in line and slice_len == -1:
+            slice_len = len(env_logging[-1]["logging"])
+    return env_logging
@@ -0,0 +1,224 @@
+import fcntl
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# 共享目录上的任务队列：多台机器上的 experiment_vanilla worker 通过租约(lease)领取任务
+DEFAULT_LEASE_SECONDS = int(os.getenv("WORK_QUEUE_LEASE_SECONDS", 300))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", 3))
+
+class FileLock:
+    """
+    `with FileLock(path):` — fcntl based lock file, usable across processes and hosts sharing a directory.
+    Drop-in replacement for the manager lock passed to `run_single_task`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        self._fd = open(self.path, "a")
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._fd.close()
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+        return False
+
+class WorkQueue:
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                job TEXT NOT NULL,
+                task_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                PRIMARY KEY (job, task_key)
+            )""")
+
+    def _connect(self):
+        # 共享文件系统上不能用 WAL，保持默认的 rollback journal，并用 BEGIN IMMEDIATE 串行化写操作
+        conn = sqlite3.connect(self.db_path, timeout=120, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 120000")
+        return _Connection(conn)
+
+    def enqueue(self, job, tasks):
+        """
+        tasks: [(task_key, payload_dict), ...]. Tasks already present in the job are left untouched,
+        so re-running a coordinator resumes instead of duplicating work; tasks that had permanently failed
+        get a fresh set of attempts.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (job, task_key, payload) VALUES (?, ?, ?)",
+                [(job, task_key, json.dumps(payload)) for task_key, payload in tasks],
+            )
+            # 恢复运行时重试上次用完重试次数的任务（失败多半是环境 / 机器问题，不是任务本身）
+            conn.executemany(
+                """UPDATE tasks SET status = 'pending', attempts = 0, error = NULL, worker = NULL, lease_expires = NULL
+                   WHERE job = ? AND task_key = ? AND status = 'failed'""",
+                [(job, task_key) for task_key, _ in tasks],
+            )
+            conn.execute("COMMIT")
+
+    def claim(self, worker_id):
+        """
+        Claims one pending task, or one whose lease has expired. Returns (job, task_key, payload) or None.
+        A task whose worker died (lease expired without `fail`) after `max_attempts` claims is marked failed.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # worker 被 OOM / SIGKILL 杀掉时不会调用 fail，重试次数在这里限制，否则任务会被无限次重新领取
+            conn.execute(
+                """UPDATE tasks SET status = 'failed', worker = NULL, lease_expires = NULL,
+                   error = COALESCE(error, '') || 'lease expired without a result (worker died) after ' || attempts || ' attempts'
+                   WHERE status = 'running' AND lease_expires < ? AND attempts >= ?""",
+                (now, self.max_attempts),
+            )
+            row = conn.execute(
+                """SELECT job, task_key, payload FROM tasks
+                   WHERE (status = 'pending') OR (status = 'running' AND lease_expires < ? AND attempts < ?)
+                   ORDER BY attempts, rowid LIMIT 1""",
+                (now, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job, task_key, payload = row
+            conn.execute(
+                """UPDATE tasks SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1
+                   WHERE job = ? AND task_key = ?""",
+                (worker_id, now + self.lease_seconds, job, task_key),
+            )
+            conn.execute("COMMIT")
+        return job, task_key, json.loads(payload)
+
+    def heartbeat(self, job, task_key, worker_id):
+        """
+        Extends the lease. Returns False if the lease was lost (expired and re-claimed by another worker).
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE tasks SET lease_expires = ?
+                   WHERE job = ? AND task_key = ? AND worker = ? AND status = 'running'""",
+                (time.time() + self.lease_seconds, job, task_key, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job, task_key, worker_id, result):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE tasks SET status = 'done', result = ?, lease_expires = NULL
+                   WHERE job = ? AND task_key = ? AND worker = ? AND status = 'running'""",
+                (json.dumps(result), job, task_key, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job, task_key, worker_id, error):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT attempts FROM tasks WHERE job = ? AND task_key = ? AND worker = ?",
+                               (job, task_key, worker_id)).fetchone()
+            if row is not None:
+                status = "failed" if row[0] >= self.max_attempts else "pending"
+                conn.execute(
+                    """UPDATE tasks SET status = ?, error = ?, worker = NULL, lease_expires = NULL
+                       WHERE job = ? AND task_key = ?""",
+                    (status, error, job, task_key),
+                )
+            conn.execute("COMMIT")
+
+    def counts(self, job):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM tasks WHERE job = ? GROUP BY status", (job,)).fetchall()
+        return {status: count for status, count in rows}
+
+    def results(self, job):
+        """
+        Returns {task_key: result} for finished tasks and {task_key: error} for permanently failed ones.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT task_key, status, result, error FROM tasks WHERE job = ?", (job,)).fetchall()
+        results, errors = {}, {}
+        for task_key, status, result, error in rows:
+            if status == "done":
+                results[task_key] = json.loads(result)
+            elif status == "failed":
+                errors[task_key] = error
+        return results, errors
+
+class _Connection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, *args):
+        return self.conn.executemany(*args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+        return False
+
+class LeaseHeartbeat:
+    """
+    Background thread that keeps a claimed task's lease alive while the worker is running it.
+    """
+    def __init__(self, queue: WorkQueue, job, task_key, worker_id):
+        self.queue = queue
+        self.job = job
+        self.task_key = task_key
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(self.queue.lease_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                if not self.queue.heartbeat(self.job, self.task_key, self.worker_id):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                print(f"[work_queue] heartbeat error for {self.task_key}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"